@@ -19,6 +19,7 @@
 __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 
 import re
+import threading
 import zlib
 from . import util
 
@@ -39,6 +40,12 @@ IP_RE = re.compile('^[0-9.]+$')
 
 KNOWN_SECOND_DOMAINS = [x.rstrip() for x in open(util.FindDataFile('data/second_level_domains.txt')).readlines()]
 
+# KNOWN_SECOND_DOMAINS as a trie of reversed labels (uk -> co), built when
+# first needed. A node containing SUFFIX_END ends a known suffix.
+SUFFIX_END = None
+_suffix_trie = None
+_suffix_trie_lock = threading.Lock()
+
 def ExtractIPsFromString(ip_string):
   """Return a tuple of ip addressed held in a string."""
 
@@ -69,14 +76,50 @@ def GetNetworkForIp(ip, reverse=False):
     print("GetNetworkForIp() does not yet support IPv6")
     return None
 
+def _SuffixTrie():
+  global _suffix_trie
+  with _suffix_trie_lock:
+    if _suffix_trie is None:
+      trie = {}
+      for suffix in KNOWN_SECOND_DOMAINS:
+        node = trie
+        for label in reversed(suffix.lower().strip('.').split('.')):
+          node = node.setdefault(label, {})
+        node[SUFFIX_END] = True
+      _suffix_trie = trie
+    return _suffix_trie
+
 def GetDomainFromHostname(hostname):
-  """Get the domain part of a hostname."""
-  for second_level in KNOWN_SECOND_DOMAINS:
-    if hostname.lower().endswith(second_level):
-      custom_part = hostname.replace(second_level, '').split('.')[-1]
-      return '%s%s' % (custom_part, second_level)
+  """Get the domain part of a hostname.
+
+  This is the label before the longest known second-level domain
+  (example.co.uk), or the last two labels (example.com).
+  """
+  labels = hostname.lower().split('.')
+  node = _SuffixTrie()
+  suffix_length = 0
+  for (depth, label) in enumerate(reversed(labels), 1):
+    node = node.get(label)
+    if node is None:
+      break
+    if SUFFIX_END in node:
+      suffix_length = depth
+
+  if suffix_length and suffix_length < len(labels):
+    return '.'.join(labels[-suffix_length - 1:])
+  return '.'.join(labels[-2:])
+
+def GetDomainsFromHostnames(hostnames):
+  """Get the domain part of many hostnames at once.
 
-  return '.'.join(hostname.split('.')[-2:]).lower()
+  Returns:
+    dictionary of hostname -> domain (see GetDomainFromHostname)
+  """
+  domains = {}
+  for hostname in hostnames:
+    if hostname not in domains:
+      domains[hostname] = GetDomainFromHostname(hostname)
+  return domains
 
 def GetProviderPartOfHostname(hostname):
   """Get the custom patr of a hostname"""
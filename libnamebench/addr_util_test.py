@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the addr_util module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import unittest
+
+from . import addr_util
+
+
+class AddrUtilTest(unittest.TestCase):
+  def testGetDomainFromHostname(self):
+    self.assertEqual(addr_util.GetDomainFromHostname('google-public-dns-a.google.com'), 'google.com')
+    self.assertEqual(addr_util.GetDomainFromHostname('ns1.Example.CO.UK'), 'example.co.uk')
+    # The longest known suffix wins (.nsw.edu.au over .edu.au).
+    self.assertEqual(addr_util.GetDomainFromHostname('ns.school.nsw.edu.au'), 'school.nsw.edu.au')
+    self.assertEqual(addr_util.GetDomainFromHostname('co.uk'), 'co.uk')
+    self.assertEqual(addr_util.GetDomainFromHostname('localhost'), 'localhost')
+
+  def testGetDomainsFromHostnames(self):
+    hostnames = ['a.example.com', 'b.example.com', 'ns.isp.com.au']
+    self.assertEqual(addr_util.GetDomainsFromHostnames(hostnames),
+                     {'a.example.com': 'example.com', 'b.example.com': 'example.com',
+                      'ns.isp.com.au': 'isp.com.au'})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,284 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""asyncio based query engine, used by the benchmark instead of threads.
+
+BenchmarkThreads can only have as many queries outstanding as it has threads,
+which makes a large benchmark bound by round-trip time. This engine keeps
+hundreds of queries in flight on the shared non-blocking UDP transport instead.
+
+Given a rate (qps), the engine runs open-loop: queries go out on a fixed or
+Poisson schedule no matter how quickly they are answered, and each duration
+is measured from the query's intended send time. A resolver that falls
+behind then shows up as growing latency, instead of quietly slowing the
+benchmark down (coordinated omission).
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import asyncio
+import errno
+import os
+import random
+import socket
+import time
+
+# external dependencies (from nb_third_party)
+import dns.exception
+import dns.query
+
+from . import dns_wire
+from . import transport
+from . import util
+
+DEFAULT_MAX_IN_FLIGHT = 256
+
+# Send schedules for open-loop (qps) mode.
+SCHEDULES = ('fixed', 'poisson')
+
+
+class AsyncQueryEngine(object):
+  """Send benchmark queries concurrently from a single asyncio event loop."""
+
+  def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, qps=None, schedule='fixed'):
+    """Constructor.
+
+    Args:
+      max_in_flight: How many queries may be outstanding at once (int)
+      qps: Queries per second to send to each nameserver, open-loop (float)
+      schedule: How to space queries in open-loop mode (fixed, poisson)
+    """
+    if schedule not in SCHEDULES:
+      raise ValueError('Invalid send schedule: %s (choose from %s)' % (schedule, ', '.join(SCHEDULES)))
+    self.max_in_flight = max_in_flight or DEFAULT_MAX_IN_FLIGHT
+    self.qps = qps
+    self.schedule = schedule
+    # (ns, request_type, hostname, intended send time, actual send time) in
+    # monotonic nanoseconds, for each query sent in open-loop mode.
+    self.send_log = []
+    # Socket fd -> future that is set once it is writable (see _WaitWritable).
+    self._writable = {}
+
+  def Run(self, work_items, on_result=None):
+    """Process a list of benchmark work items.
+
+    Queries are sent in the order they are given, so the interleaving done by
+    Benchmark._SingleTestRun is preserved. In open-loop mode, each nameserver
+    gets its own send schedule.
+
+    Args:
+      work_items: a list of (nameserver, request_type, hostname) tuples
+      on_result: optional function, called with each result as it arrives
+        (from the calling thread).
+
+    Returns:
+      A list of (ns, request_type, hostname, response, duration_ns, error_msg)
+      tuples in completion order - the same shape BenchmarkThreads produces.
+    """
+    loop = asyncio.new_event_loop()
+    self._writable = {}
+    try:
+      return loop.run_until_complete(self._RunAll(work_items, on_result))
+    finally:
+      loop.close()
+
+  async def _RunAll(self, work_items, on_result):
+    semaphore = asyncio.Semaphore(self.max_in_flight)
+    results = []
+
+    async def _Worker(ns, request_type, hostname, intended_ns=None):
+      async with semaphore:
+        result = await self.TimedRequest(ns, request_type, hostname, intended_ns=intended_ns)
+      results.append(result)
+      if on_result:
+        on_result(result)
+
+    if not self.qps:
+      await asyncio.gather(*[_Worker(*item) for item in work_items])
+      return results
+
+    tasks = []
+    for (intended_ns, item) in self.SendSchedule(work_items, time.monotonic_ns()):
+      delay_ns = intended_ns - time.monotonic_ns()
+      if delay_ns > 0:
+        await asyncio.sleep(delay_ns / 1000000000.0)
+      tasks.append(asyncio.ensure_future(_Worker(*item, intended_ns=intended_ns)))
+    await asyncio.gather(*tasks)
+    return results
+
+  def SendSchedule(self, work_items, start_ns):
+    """Assign every work item an intended send time for open-loop mode.
+
+    Args:
+      work_items: a list of (nameserver, request_type, hostname) tuples
+      start_ns: when the schedule begins (monotonic nanoseconds)
+
+    Returns:
+      A list of (intended send time in monotonic ns, work item), in send order.
+    """
+    offsets = {}
+    schedule = []
+    for item in work_items:
+      ns = item[0]
+      if self.schedule == 'poisson':
+        offset = offsets.get(ns, 0) + random.expovariate(self.qps)
+      else:
+        offset = offsets.get(ns, -1.0 / self.qps) + 1.0 / self.qps
+      offsets[ns] = offset
+      schedule.append((start_ns + int(offset * 1000000000), item))
+    # sort() is stable, so simultaneous sends keep their interleaving.
+    schedule.sort(key=lambda x: x[0])
+    return schedule
+
+  async def TimedRequest(self, ns, request_type, hostname, intended_ns=None):
+    """Asynchronous equivalent of NameServer.TimedRequestNs for one work item.
+
+    Args:
+      ns: NameServer object
+      request_type: DNS record type to query (string)
+      hostname: DNS record name to query (string)
+      intended_ns: when the query should have been sent (monotonic ns), if it
+        is part of an open-loop schedule.
+
+    Returns:
+      (ns, request_type, hostname, response, duration in ns [int], error_msg)
+    """
+    # Done here so that it's after all of the random selection goes through.
+    is_random = '__RANDOM__' in hostname
+    if is_random:
+      hostname = hostname.replace('__RANDOM__', str(random.random() * random.randint(0, 99999)))
+
+    ns.request_count += 1
+    try:
+      request = dns_wire.GetQueryTemplate(hostname, request_type, cache=not is_random).NewRequest()
+    except (ValueError, dns.exception.SyntaxError):
+      return (ns, request_type, hostname, None, 0, util.GetLastExceptionString())
+
+    error_msg = None
+    start_ns = time.monotonic_ns()
+    send_lag_ns = 0
+    if intended_ns is not None:
+      send_lag_ns = max(0, start_ns - intended_ns)
+      self.send_log.append((ns, request_type, hostname, intended_ns, start_ns))
+    try:
+      response = await self._Query(request, ns.ip, ns.timeout, port=ns.port,
+                                   retransmit_timeout=ns.retransmit_timeout)
+    except (KeyboardInterrupt, SystemExit, SystemError) as exc:
+      raise exc
+    except:
+      response = None
+      error_msg = ns.ErrorMessageForLastException(request_type, hostname)
+    duration_ns = time.monotonic_ns() - start_ns
+    (response, duration_ns, error_msg) = ns.FinishTimedRequest(response, duration_ns, error_msg,
+                                                               send_lag_ns=send_lag_ns)
+    return (ns, request_type, hostname, response, duration_ns, error_msg)
+
+  async def _Query(self, request, ip, timeout, port=53, retransmit_timeout=None):
+    """Send a request over the shared transport and wait for the reply.
+
+    Like UdpTransport.Query, the request is sent again each time one of the
+    RetransmitWaits() passes without a reply.
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def _Wake(pending):
+      loop.call_soon_threadsafe(_SetResult, future, pending)
+
+    udp = transport.GetTransport()
+    pending = udp.Register(request.to_wire(), ip, port=port, callback=_Wake)
+    try:
+      await self._Send(udp, pending)
+    except:
+      udp.Cancel(pending)
+      raise
+    for (attempt, wait) in enumerate(transport.RetransmitWaits(timeout, retransmit_timeout)):
+      if attempt:
+        try:
+          await self._Send(udp, pending)
+        except socket.error:
+          pass
+      try:
+        # shield() keeps the future alive when a wait other than the last one ends.
+        await asyncio.wait_for(asyncio.shield(future), wait)
+        break
+      except asyncio.TimeoutError:
+        continue
+    else:
+      udp.Cancel(pending)
+      raise dns.exception.Timeout()
+    response = dns_wire.WireResponse(pending.reply, duration_ns=pending.duration_ns,
+                                     send_count=pending.send_count)
+    # The id may have been changed by the transport to avoid a collision.
+    request.id = response.id
+    if not request.is_response(response):
+      raise dns.query.BadResponse()
+    return response
+
+  async def _Send(self, udp, pending):
+    """Send a query, as UdpTransport.Send() does, without blocking the event loop.
+
+    While the socket buffer is full, other queries keep being answered and
+    timed, and the send is retried for up to transport.MAX_SEND_WAIT seconds.
+
+    Raises:
+      socket.error: if it cannot be sent, or there is still no room in time.
+    """
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + transport.MAX_SEND_WAIT
+    while True:
+      error = udp.TrySend(pending)
+      if not error:
+        return
+      remaining = deadline - loop.time()
+      if remaining <= 0:
+        raise socket.error(error, os.strerror(error))
+      if error == errno.ENOBUFS:
+        # The socket stays writable: it is the interface queue that is full.
+        await asyncio.sleep(min(remaining, transport.SEND_RETRY_INTERVAL))
+      else:
+        await self._WaitWritable(pending.sock, remaining)
+
+  async def _WaitWritable(self, sock, timeout):
+    """Wait (up to timeout seconds) for a socket to have buffer space.
+
+    Every query waiting on the same socket shares one writer callback, as the
+    event loop only keeps one per file descriptor.
+    """
+    loop = asyncio.get_event_loop()
+    fd = sock.fileno()
+    future = self._writable.get(fd)
+    if future is None or future.done():
+      future = loop.create_future()
+
+      def _Writable():
+        loop.remove_writer(fd)
+        _SetResult(future, True)
+
+      try:
+        loop.add_writer(fd, _Writable)
+      except NotImplementedError:
+        # Event loops without add_writer (Windows proactor) poll instead.
+        await asyncio.sleep(min(timeout, transport.SEND_RETRY_INTERVAL))
+        return
+      self._writable[fd] = future
+    try:
+      await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+      pass
+
+
+def _SetResult(future, result):
+  if not future.done():
+    future.set_result(result)
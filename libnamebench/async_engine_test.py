@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the async_engine module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import asyncio
+import errno
+import unittest
+
+from . import async_engine
+from . import dns_wire
+from . import nameserver
+from . import transport
+from . import transport_test
+from . import util
+
+
+class FakeClock(object):
+  """Stands in for the time module: the clock only moves when told to."""
+
+  def __init__(self, now_ns=1000000000):
+    self.now_ns = now_ns
+
+  def monotonic_ns(self):
+    return self.now_ns
+
+  def Advance(self, nanoseconds):
+    self.now_ns += nanoseconds
+
+
+class SendScheduleTest(unittest.TestCase):
+  def testFixedSchedule(self):
+    engine = async_engine.AsyncQueryEngine(qps=10)
+    work_items = [('ns1', 'A', 'a.'), ('ns2', 'A', 'a.'), ('ns1', 'A', 'b.'),
+                  ('ns2', 'A', 'b.'), ('ns1', 'A', 'c.')]
+    schedule = engine.SendSchedule(work_items, 5000)
+    # Each server gets a query every 100ms, and simultaneous sends keep
+    # their interleaving.
+    self.assertEqual(schedule, [(5000, ('ns1', 'A', 'a.')),
+                                (5000, ('ns2', 'A', 'a.')),
+                                (100005000, ('ns1', 'A', 'b.')),
+                                (100005000, ('ns2', 'A', 'b.')),
+                                (200005000, ('ns1', 'A', 'c.'))])
+
+  def testPoissonSchedule(self):
+    engine = async_engine.AsyncQueryEngine(qps=100, schedule='poisson')
+    work_items = [('ns%s' % (x % 2), 'A', 'a.') for x in range(4000)]
+    schedule = engine.SendSchedule(work_items, 0)
+    self.assertEqual(len(schedule), len(work_items))
+    for server in ('ns0', 'ns1'):
+      times = [x[0] for x in schedule if x[1][0] == server]
+      self.assertEqual(times, sorted(times))
+      gaps = [b - a for (a, b) in zip(times, times[1:])]
+      # Gaps average 1/qps (10ms), but vary.
+      self.assertTrue(9000000 < util.CalculateListAverage(gaps) < 11000000)
+      self.assertTrue(min(gaps) < 1000000 < 30000000 < max(gaps))
+
+  def testInvalidSchedule(self):
+    self.assertRaises(ValueError, async_engine.AsyncQueryEngine, qps=10, schedule='bursty')
+
+
+class SendLagTest(unittest.TestCase):
+  def setUp(self):
+    self.clock = FakeClock()
+    self.saved_time = async_engine.time
+    async_engine.time = self.clock
+    self.engine = async_engine.AsyncQueryEngine(qps=10)
+    self.ns = nameserver.NameServer('127.0.0.1')
+
+  def tearDown(self):
+    async_engine.time = self.saved_time
+
+  def _TimedRequest(self, send_lag_ns, query_ns, transport_ns=None, hostname='www.example.com.'):
+    """Run TimedRequest with a query that takes query_ns on the fake clock.
+
+    Args:
+      send_lag_ns: how long after its intended send time the query goes out
+      query_ns: how long the query takes, as seen by the caller
+      transport_ns: the duration the transport measured itself, if any
+      hostname: DNS record name to query (string)
+
+    Returns:
+      the TimedRequest result tuple
+    """
+    intended_ns = self.clock.monotonic_ns()
+    self.clock.Advance(send_lag_ns)
+
+    async def _Query(request, unused_ip, unused_timeout, **unused_kwargs):
+      self.clock.Advance(query_ns)
+      reply = bytearray(request.to_wire())
+      reply[2] |= 0x80
+      return dns_wire.WireResponse(bytes(reply), duration_ns=transport_ns)
+
+    self.engine._Query = _Query
+    loop = asyncio.new_event_loop()
+    try:
+      return loop.run_until_complete(self.engine.TimedRequest(self.ns, 'A', hostname,
+                                                              intended_ns=intended_ns))
+    finally:
+      loop.close()
+
+  def testLagIsAddedToDuration(self):
+    result = self._TimedRequest(5000000, 3000000)
+    self.assertEqual(result[4], 8000000)
+    self.assertEqual(result[5], None)
+    (unused_ns, unused_type, unused_hostname, intended_ns, sent_ns) = self.engine.send_log[0]
+    self.assertEqual(sent_ns - intended_ns, 5000000)
+
+  def testLagIsAddedToTransportDuration(self):
+    result = self._TimedRequest(5000000, 3000000, transport_ns=2000000)
+    self.assertEqual(result[4], 7000000)
+
+  def testNoLag(self):
+    result = self._TimedRequest(0, 3000000)
+    self.assertEqual(result[4], 3000000)
+    self.assertEqual(len(self.engine.send_log), 1)
+
+  def testRandomNamesAreNotCached(self):
+    cached = dns_wire._CachedQueryTemplate.cache_info().currsize
+    result = self._TimedRequest(0, 3000000, hostname='x__RANDOM__.example.com.')
+    self.assertFalse('__RANDOM__' in result[2])
+    self.assertEqual(result[5], None)
+    self.assertEqual(dns_wire._CachedQueryTemplate.cache_info().currsize, cached)
+
+
+class AsyncSendTest(unittest.TestCase):
+  def _Send(self, errors):
+    """Send a query from a socket that first fails with errors, as the engine does.
+
+    Returns:
+      (pending query, how often another task ran while it was being sent)
+    """
+    engine = async_engine.AsyncQueryEngine()
+    udp = transport.UdpTransport()
+    pending = transport.PendingQuery(None, None)
+    pending.wire = transport_test._Query()
+    pending.address = ('127.0.0.1', 9)
+    pending.sock = transport_test.FlakySendSocket(errors)
+    ticks = []
+
+    async def _Ticker(send):
+      while not send.done():
+        ticks.append(1)
+        await asyncio.sleep(0.001)
+
+    async def _Both():
+      send = asyncio.ensure_future(engine._Send(udp, pending))
+      await _Ticker(send)
+      return await send
+
+    loop = asyncio.new_event_loop()
+    try:
+      loop.run_until_complete(_Both())
+    finally:
+      loop.close()
+      pending.sock.close()
+      udp.Close()
+    return (pending, len(ticks))
+
+  def testFullBuffersDoNotBlockTheLoop(self):
+    (pending, ticks) = self._Send([errno.ENOBUFS] * 5 + [errno.EAGAIN, errno.EAGAIN])
+    self.assertEqual(pending.send_count, 1)
+    self.assertEqual(pending.sock.sent, [(pending.wire, pending.address)])
+    # Other tasks kept running while the send waited for room.
+    self.assertTrue(ticks >= 5, ticks)
+
+  def testOtherErrorsAreRaised(self):
+    self.assertRaises(OSError, self._Send, [errno.EHOSTUNREACH])
+
+  def testGiveUpAfterMaxSendWait(self):
+    saved = transport.MAX_SEND_WAIT
+    transport.MAX_SEND_WAIT = 0.05
+    try:
+      self.assertRaises(OSError, self._Send, [errno.EAGAIN] * 100000)
+    finally:
+      transport.MAX_SEND_WAIT = saved
+
+
+if __name__ == '__main__':
+  unittest.main()
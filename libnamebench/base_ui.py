@@ -18,14 +18,20 @@ import tempfile
 
 from . import addr_util
 from . import benchmark
+from . import capacity
 from . import better_webbrowser
 from . import config
 from . import data_sources
 from . import geoip
+from . import health_cache
 from . import nameserver
+from . import nameserver_list
 from . import reporter
+from . import reverse_dns
+from . import result_spool
 from . import providers
 from . import site_connector
+from . import transport
 from . import util
 
 __author__ = 'tstromberg@google.com (Thomas Stromberg)'
@@ -49,6 +55,8 @@ class BaseUI(object):
     self.url = None
     self.share_state = None
     self.test_records = []
+    self.spool = None
+    self.completed_results = None
 
   def UpdateStatus(self, msg, **kwargs):
     """Update the little status message on the bottom of the window."""
@@ -65,6 +73,10 @@ class BaseUI(object):
 
   def PrepareTestRecords(self):
     """Figure out what data source a user wants, and create test_records."""
+    if self.options.resume:
+      self.RestoreCheckpoint()
+      return
+
     if self.options.input_source:
       src_type = self.options.input_source
     else:
@@ -77,10 +89,31 @@ class BaseUI(object):
         select_mode=self.options.select_mode
     )
 
-  def GatherNameServerData(self):
-    """Build a nameserver data set from config and other sources."""
-
-    ns_data = config.GetNameServerData()
+  def RestoreCheckpoint(self):
+    """Pick up the test records and nameservers of an interrupted benchmark."""
+    if not self.options.spool_file:
+      raise result_spool.InvalidCheckpoint('--resume requires the --spool file of the benchmark to resume')
+    checkpoint = result_spool.LoadCheckpoint(self.options.spool_file)
+    self.test_records = checkpoint['test_records']
+    self.options.run_count = checkpoint['run_count']
+    self.options.query_count = len(self.test_records)
+    self.nameservers.RestoreServerSet(checkpoint['servers'])
+    self.completed_results = result_spool.LoadResults(self.options.spool_file, self.nameservers,
+                                                      keep_responses=not self.options.discard_responses)
+    if self.options.adaptive:
+      self.UpdateStatus('Adaptive benchmarks can not be resumed, sending every remaining query.')
+      self.options.adaptive = False
+    self.UpdateStatus('Resuming benchmark: %s runs of %s queries on %s servers' %
+                      (self.options.run_count, len(self.test_records), len(checkpoint['servers'])))
+
+  def GatherNameServerData(self, **kwargs):
+    """Build a nameserver data set from config and other sources.
+
+    Args:
+      kwargs: tag filter and client location, see config.GetNameServerData()
+    """
+
+    ns_data = config.GetNameServerData(**kwargs)
     for i, ip in enumerate(self.options.servers):
       ns = nameserver.NameServer(ip, tags=['specified'], name='USR%s-%s' % (i, ip))
       ns_data.append(ns)
@@ -106,37 +139,55 @@ class BaseUI(object):
 
 
 
+  def InvalidateCaches(self):
+    """Forget cached health checks and hostnames."""
+    for cache in (health_cache.HealthCache(), reverse_dns.GetCache()):
+      self.UpdateStatus('Invalidating cache %s' % cache.path)
+      cache.Clear()
+
   def PrepareNameServers(self):
     """Setup self.nameservers to have a list of healthy fast servers."""
-    self.nameservers = self.GatherNameServerData()
-    self.nameservers.max_servers_to_check = self.options.max_servers_to_check
-    self.nameservers.thread_count = self.options.health_thread_count
+    if self.options.invalidate_cache:
+      # Before any hostnames are looked up.
+      self.InvalidateCaches()
     require_tags = set()
     include_tags = self.options.tags
     country_code = None
+    domain = asn = None
+    lat = lon = None
 
     if self.options.ipv6_only:
       require_tags.add('ipv6')
     elif self.options.ipv4_only:
       require_tags.add('ipv4')
 
+    # Find out where we are first, so that only servers that could match the
+    # tags need to be loaded.
     if self.options.tags.intersection(set(['nearby', 'country', 'likely-isp', 'nearby'])):
       country_code, country_name, lat, lon = self.ConfiguredLocationData()
-      if country_code:
-        self.nameservers.SetClientLocation(lat, lon, country_code)
 
     if self.options.tags.intersection(set(['isp','network'])):
       domain, asn = self.GetExternalNetworkData()
-      if asn:
-        self.nameservers.SetNetworkLocation(domain, asn)
-        self.UpdateStatus("Looking for nameservers within %s or AS%s" % (domain, asn))
-        self.nameservers.AddNetworkTags()
-
 
     if 'country' in self.options.tags:
       include_tags.discard('country')
       include_tags.add('country_%s' % country_code.lower())
 
+    self.nameservers = self.GatherNameServerData(include_tags=include_tags, require_tags=require_tags,
+                                                 country_code=country_code, asn=asn, domain=domain,
+                                                 latitude=lat, longitude=lon,
+                                                 max_distance=self.options.distance)
+    self.nameservers.max_servers_to_check = self.options.max_servers_to_check
+    self.nameservers.thread_count = self.options.health_thread_count
+
+    if country_code:
+      self.nameservers.SetClientLocation(lat, lon, country_code)
+
+    if asn:
+      self.nameservers.SetNetworkLocation(domain, asn)
+      self.UpdateStatus("Looking for nameservers within %s or AS%s" % (domain, asn))
+      self.nameservers.AddNetworkTags()
+
     if 'nearby' in self.options.tags and lat:
       distance = self.options.distance
       if 'country' in self.options.tags:
@@ -171,10 +222,47 @@ class BaseUI(object):
     return country_code, country_name, lat, lon
 
   def CheckNameServerHealth(self):
+    if self.options.kernel_timestamps:
+      if not transport.KernelTimestampsSupported():
+        self.UpdateStatus('Kernel timestamps are not supported here, timing queries in the transport instead.')
+      transport.UseKernelTimestamps()
     self.nameservers.SetTimeouts(self.options.timeout,
                                  self.options.ping_timeout,
-                                 self.options.health_timeout)
+                                 self.options.health_timeout,
+                                 adaptive_timeouts=not self.options.fixed_timeouts)
+    if self.options.resume:
+      # Health checks could change the server set we are resuming with.
+      return
+
+    cache = health_cache.HealthCache()
+    client_network = self.GetClientNetwork()
+    candidates = list(self.nameservers.visible_servers)
+    if self.nameservers.RestoreCachedHealth(cache, client_network):
+      if not self.nameservers.enabled_servers:
+        raise nameserver_list.TooFewNameservers('None of the nameservers tested are healthy (cached)')
+      return
+
     self.nameservers.CheckHealth(sanity_checks=config.GetSanityChecks())
+    for ns in candidates:
+      cache.Put(ns, client_network)
+    try:
+      cache.Save()
+    except IOError:
+      self.UpdateStatus('Unable to save health cache to %s: %s' % (cache.path, util.GetLastExceptionString()))
+
+  def GetClientNetwork(self):
+    """Which network we are running from, as far as health checks are concerned."""
+    try:
+      client_ip = providers.GetExternalIp()
+    except Exception:
+      client_ip = None
+    if isinstance(client_ip, bytes):
+      client_ip = client_ip.decode('ascii', 'replace')
+    if not client_ip:
+      return 'unknown'
+    elif ':' in client_ip:
+      return client_ip
+    return addr_util.GetNetworkForIp(client_ip)
 
   def PrepareBenchmark(self):
     """Setup the benchmark object with the appropriate dataset."""
@@ -183,15 +271,52 @@ class BaseUI(object):
     else:
       thread_count = self.options.benchmark_thread_count
 
+    engine = self.options.benchmark_engine
+    if self.options.qps:
+      engine = 'async'
+
+    if self.options.spool_file:
+      self.UpdateStatus('Spooling results to %s' % self.options.spool_file)
+      self.spool = result_spool.ResultSpool(self.options.spool_file, append=self.options.resume)
+      if not self.options.resume:
+        result_spool.SaveCheckpoint(self.options.spool_file, self.test_records,
+                                    self.nameservers.enabled_servers, self.options.run_count)
+
     self.bmark = benchmark.Benchmark(self.nameservers,
                                      query_count=self.options.query_count,
                                      run_count=self.options.run_count,
                                      thread_count=thread_count,
-                                     status_callback=self.UpdateStatus)
+                                     status_callback=self.UpdateStatus,
+                                     engine=engine,
+                                     max_in_flight=self.options.max_in_flight,
+                                     qps=self.options.qps,
+                                     qps_schedule=self.options.qps_schedule,
+                                     adaptive=self.options.adaptive,
+                                     processes=self.options.benchmark_processes,
+                                     keep_responses=not self.options.discard_responses,
+                                     spool=self.spool,
+                                     spool_only=self.options.spool_only)
+
+  def RunCapacitySweep(self):
+    """Ramp the offered load on each nameserver until it breaks the SLO."""
+    self.capacity_sweep = capacity.CapacitySweep(self.nameservers,
+                                                 max_qps=self.options.max_qps,
+                                                 p99_slo=self.options.slo_p99,
+                                                 max_timeout_rate=self.options.max_timeout_rate,
+                                                 max_in_flight=self.options.max_in_flight,
+                                                 qps_schedule=self.options.qps_schedule,
+                                                 status_callback=self.UpdateStatus)
+    results = self.capacity_sweep.Run(self.test_records)
+    self.UpdateStatus("Capacity sweep finished.")
+    return results
 
   def RunBenchmark(self):
     """Run the benchmark."""
-    results = self.bmark.Run(self.test_records)
+    try:
+      results = self.bmark.Run(self.test_records, completed=self.completed_results)
+    finally:
+      if self.spool:
+        self.spool.Close()
     self.UpdateStatus("Benchmark finished.")
     index = []
     if self.options.upload_results in (1, True):
@@ -205,7 +330,8 @@ class BaseUI(object):
       self.DiscoverLocation()
 
     self.reporter = reporter.ReportGenerator(self.options, self.nameservers,
-                                             results, index=index, geodata=self.geodata)
+                                             results, index=index, geodata=self.geodata,
+                                             spool_path=self.options.spool_file)
 
   def DiscoverLocation(self):
     if not getattr(self, 'geodata', None):
@@ -19,11 +19,35 @@ Designed to assist system administrators in selection and prioritization.
 
 __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 
+import concurrent.futures
+import math
 import queue
 import random
+import statistics
 import threading
 import time
 
+from . import async_engine
+from . import result_store
+from . import transport
+from . import util
+
+# Which query engines Benchmark knows how to drive.
+ENGINES = ('threads', 'async')
+DEFAULT_ENGINE = 'threads'
+
+# Adaptive mode: queries per server in each round, how many results a server
+# needs before it can be eliminated, the chance of wrongly eliminating any
+# server over the whole benchmark, and how much slower than the leader a
+# server must be for the difference to matter.
+ADAPTIVE_ROUND_SIZE = 20
+ADAPTIVE_MIN_SAMPLES = 20
+ADAPTIVE_ALPHA = 0.05
+ADAPTIVE_MIN_GAP = 1.1
+
+# How often to update the status (in seconds) while results stream in.
+STATUS_INTERVAL = 0.5
+
 
 class BenchmarkThreads(threading.Thread):
   """Benchmark multiple nameservers in parallel."""
@@ -39,11 +63,13 @@ class BenchmarkThreads(threading.Thread):
       try:
         (ns, request_type, hostname) = self.input.get_nowait()
         # We've moved this here so that it's after all of the random selection goes through.
-        if '__RANDOM__' in hostname:
+        is_random = '__RANDOM__' in hostname
+        if is_random:
           hostname = hostname.replace('__RANDOM__', str(random.random() * random.randint(0, 99999)))
 
-        (response, duration, error_msg) = ns.TimedRequest(request_type, hostname)
-        self.results.put((ns, request_type, hostname, response, duration, error_msg))
+        (response, duration_ns, error_msg) = ns.TimedRequestNs(request_type, hostname,
+                                                               cache_template=not is_random)
+        self.results.put((ns, request_type, hostname, response, duration_ns, error_msg))
       except queue.Empty:
         return
 
@@ -52,7 +78,9 @@ class Benchmark(object):
   """The main benchmarking class."""
 
   def __init__(self, nameservers, run_count=2, query_count=30, thread_count=1,
-               status_callback=None):
+               status_callback=None, engine=DEFAULT_ENGINE, max_in_flight=None, qps=None,
+               qps_schedule='fixed', adaptive=False, processes=None, on_result=None,
+               keep_responses=True, spool=None, spool_only=False):
     """Constructor.
 
     Args:
@@ -61,12 +89,43 @@ class Benchmark(object):
       query_count: How many DNS lookups to test in each test-run (int)
       thread_count: How many benchmark threads to use (int)
       status_callback: Where to send msg() updates to.
+      engine: Which query engine to use (threads, async). None picks the default.
+      max_in_flight: How many queries the async engine keeps outstanding (int)
+      qps: Open-loop rate to query each nameserver at (float, async engine only)
+      qps_schedule: How to space open-loop queries (fixed, poisson)
+      adaptive: Drop clearly slower servers between rounds (boolean)
+      processes: Shard servers across this many worker processes (int)
+      on_result: Called with (ns, result) for each result as it arrives, where
+        result is a (hostname, request_type, duration_ns, response, error_msg)
+        tuple. It is always called from the thread that called Run().
+      keep_responses: Keep each raw reply, so reports can show answer text.
+      spool: a result_spool.ResultSpool to append each stored result to.
+      spool_only: Only keep per-run totals in memory, leaving the rows in the
+        spool (see result_store.ResultStore).
     """
+    if not engine:
+      engine = DEFAULT_ENGINE
+    if engine not in ENGINES:
+      raise ValueError('Invalid benchmark engine: %s (choose from %s)' % (engine, ', '.join(ENGINES)))
+    if qps and engine != 'async':
+      raise ValueError('A query rate (qps) requires the async engine.')
     self.query_count = query_count
     self.run_count = run_count
     self.thread_count = thread_count
+    self.engine = engine
+    self.max_in_flight = max_in_flight
+    self.qps = qps
+    self.qps_schedule = qps_schedule
+    self.adaptive = adaptive
+    self.processes = processes
+    # Worker processes for _RunProcessPool, kept for the length of a Run().
+    self._pool = None
+    self.on_result = on_result
+    # Open-loop send logs, one per test run (see AsyncQueryEngine.send_log).
+    self.send_logs = []
     self.nameservers = nameservers
-    self.results = {}
+    self.results = result_store.ResultStore(keep_responses=keep_responses, spool=spool,
+                                            spool_only=spool_only)
     self.status_callback = status_callback
 
   def msg(self, msg, **kwargs):
@@ -85,18 +144,12 @@ class Benchmark(object):
     """
     needs_test = []
     index_results = {}
-    for test in test_records:
-      matched = False
-      for ns in self.results:
-        for result in self.results[ns][0]:
-          hostname, request_type = result[0:2]
-          if (request_type, hostname) == test:
-            matched = True
-            index_results.setdefault(ns, []).append(result)
-            # So that we don't include the second results if duplicates exist.
-            break
-      if not matched:
-        needs_test.append(test)
+    for (request_type, hostname) in test_records:
+      matches = self.results.Lookup(request_type, hostname)
+      for (ns, result) in matches.items():
+        index_results.setdefault(ns, []).append(result)
+      if not matches:
+        needs_test.append((request_type, hostname))
     return (index_results, needs_test)
 
   def RunIndex(self, test_records):
@@ -106,25 +159,138 @@ class Benchmark(object):
       return None
 
     index_results, pending_tests = self._CheckForIndexHostsInResults(test_records)
-    run_results = self._SingleTestRun(pending_tests)
+    try:
+      run_results = self._SingleTestRun(pending_tests)
+    finally:
+      self._ShutdownPool()
     for ns in run_results:
       index_results.setdefault(ns, []).extend(run_results[ns])
     return index_results
 
-  def Run(self, test_records=None):
-    """Run all test runs for all nameservers."""
+  def Run(self, test_records=None, completed=None):
+    """Run all test runs for all nameservers.
+
+    Args:
+      test_records: a list of tuples in the form of (request_type, hostname)
+      completed: results of an interrupted benchmark of the same test records
+        (see result_spool.LoadResults). They are carried over, and only the
+        queries they lack are sent.
+
+    Returns:
+      A result_store.ResultStore
+    """
+    if completed and self.adaptive:
+      raise ValueError('Adaptive benchmarks can not be resumed.')
 
     # We don't want to keep stats on how many queries timed out from previous runs.
     for ns in self.nameservers.enabled_servers:
       ns.ResetErrorCounts()
 
-    for _ in range(self.run_count):
-      run_results = self._SingleTestRun(test_records)
-      for ns in run_results:
-        self.results.setdefault(ns, []).append(run_results[ns])
+    try:
+      if self.adaptive and len(self.nameservers.enabled_servers) > 1:
+        return self._RunAdaptive(test_records)
+
+      for run_number in range(self.run_count):
+        if completed:
+          self._ResumeTestRun(test_records, completed, run_number)
+        else:
+          self._SingleTestRun(test_records, new_run=self.results.AddRun)
+      return self.results
+    finally:
+      self._ShutdownPool()
+
+  def _ResumeTestRun(self, test_records, completed, run_number):
+    """Finish one test run of an interrupted benchmark.
+
+    Args:
+      test_records: a list of tuples in the form of (request_type, hostname)
+      completed: ResultStore of the interrupted benchmark
+      run_number: which test run to finish (int)
+    """
+    runs = {}
+    missing = {}
+    for ns in self.nameservers.enabled_servers:
+      runs[ns] = self.results.AddRun(ns)
+      done = completed.get(ns, [])
+      if run_number < len(done):
+        runs[ns].Restore(done[run_number])
+        missing[ns] = _MissingRecords(test_records, done[run_number])
+      else:
+        missing[ns] = list(test_records)
+
+    servers = [ns for ns in runs if missing[ns]]
+    if not servers:
+      return
+    self.msg('Resuming test run %s: %s of %s queries left' %
+             (run_number + 1, sum([len(missing[ns]) for ns in servers]),
+              len(test_records) * len(runs)))
+    self._SingleTestRun(test_records, servers=servers, new_run=runs.get, server_records=missing)
+
+  def _RunAdaptive(self, test_records):
+    """Spend the run_count x query_count budget where it changes the ranking.
+
+    Test runs are sent in rounds of ADAPTIVE_ROUND_SIZE queries per server.
+    After each round, any server whose average latency is, with high
+    confidence, worse than the leader's is dropped. The queries it would have
+    used are spent on further runs against the servers that remain, until
+    only one is left or the budget is gone.
+    """
+    servers = list(self.nameservers.enabled_servers)
+    budget = self.run_count * len(test_records) * len(servers)
+    z_score = _AdaptiveZScore(_MaxAdaptiveComparisons(budget, len(test_records), len(servers)))
+    spent = 0
+    durations = dict((ns, []) for ns in servers)
+    position = len(test_records)
+
+    while len(servers) > 1 and spent < budget:
+      if position >= len(test_records):
+        position = 0
+        for ns in servers:
+          self.results.AddRun(ns)
+      round_records = test_records[position:position + ADAPTIVE_ROUND_SIZE]
+      position += len(round_records)
+
+      round_results = self._SingleTestRun(round_records, servers=servers)
+      for ns in round_results:
+        self.results[ns][-1].extend(round_results[ns])
+        durations[ns].extend([x[2] for x in round_results[ns]])
+      spent += len(round_records) * len(servers)
+      servers = self._EliminateSlowServers(servers, durations, z_score)
+
+    if len(servers) == 1:
+      self.msg('%s is the clear winner after %s of %s queries' % (servers[0], spent, budget))
     return self.results
 
-  def _SingleTestRun(self, test_records):
+  def _EliminateSlowServers(self, servers, durations, z_score):
+    """Return the servers that could still turn out to be the fastest.
+
+    Eliminated servers are tagged, and get a note saying so: they have fewer
+    results than the others in the report.
+
+    Args:
+      servers: list of nameservers still in the running
+      durations: dictionary of all durations so far (ns), keyed by nameserver
+      z_score: how wide the latency bounds are, in standard errors
+
+    Returns:
+      list of nameservers
+    """
+    bounds = dict((ns, _LatencyBounds(durations[ns], z_score)) for ns in servers)
+    best_upper = min([upper for (unused_lower, upper) in bounds.values()])
+    survivors = []
+    for ns in servers:
+      if bounds[ns][0] > best_upper * ADAPTIVE_MIN_GAP:
+        self.msg('Dropping %s: average latency of at least %.1fms, the leader is under %.1fms' %
+                 (ns, util.NanosecondsToMilliseconds(bounds[ns][0]),
+                  util.NanosecondsToMilliseconds(best_upper)))
+        ns.tags.add('eliminated')
+        ns.AddWarning('Dropped by the adaptive benchmark after %s queries (clearly slower)' %
+                      len(durations[ns]), penalty=False)
+      else:
+        survivors.append(ns)
+    return survivors
+
+  def _SingleTestRun(self, test_records, servers=None, new_run=None, server_records=None):
     """Manage and execute a single test-run on all nameservers.
 
     We used to run all tests for a nameserver, but the results proved to be
@@ -133,57 +299,323 @@ class Benchmark(object):
 
     Args:
       test_records: a list of tuples in the form of (request_type, hostname)
+      servers: nameservers to test (defaults to all enabled servers)
+      new_run: function returning the (list-like) run to store a nameserver's
+        results in. Defaults to a new list.
+      server_records: dictionary of test records to use instead of
+        test_records, keyed by nameserver.
 
     Returns:
-      results: A dictionary of tuples, keyed by nameserver.
+      results: A dictionary of result runs, keyed by nameserver.
     """
-    input_queue = queue.Queue()
+    if servers is None:
+      servers = self.nameservers.enabled_servers
+    work_items = []
     shuffled_records = {}
     results = {}
     # Pre-compute the shuffled test records per-nameserver to avoid thread
     # contention.
-    for ns in self.nameservers.enabled_servers:
-      random.shuffle(test_records)
-      shuffled_records[ns.ip] = list(test_records)
-
-    # Feed the pre-computed records into the input queue.
-    for i in range(len(test_records)):
-      for ns in self.nameservers.enabled_servers:
-        (request_type, hostname) = shuffled_records[ns.ip][i]
-        input_queue.put((ns, request_type, hostname))
+    for ns in servers:
+      if server_records:
+        records = list(server_records[ns])
+      else:
+        records = test_records
+      random.shuffle(records)
+      shuffled_records[ns.ip] = list(records)
+
+    # Interleave the pre-computed records, one per nameserver at a time.
+    for i in range(max([len(x) for x in shuffled_records.values()] or [0])):
+      for ns in servers:
+        if i < len(shuffled_records[ns.ip]):
+          (request_type, hostname) = shuffled_records[ns.ip][i]
+          work_items.append((ns, request_type, hostname))
 
-    results_queue = self._LaunchBenchmarkThreads(input_queue)
     errors = []
-    while results_queue.qsize():
-      (ns, request_type, hostname, response, duration, error_msg) = results_queue.get()
+
+    def _Collect(query_result):
+      (ns, request_type, hostname, response, duration_ns, error_msg) = query_result
       if error_msg:
-        duration = ns.timeout * 1000
+        duration_ns = int(ns.timeout * 1000000000)
         errors.append((ns, error_msg))
-      results.setdefault(ns, []).append((hostname, request_type, duration, response, error_msg))
-
+      result = (hostname, request_type, duration_ns, response, error_msg)
+      if ns not in results:
+        results[ns] = new_run(ns) if new_run else []
+      results[ns].append(result)
+      if self.on_result:
+        self.on_result(ns, result)
+
+    self._SendWorkItems(work_items, len(servers), _Collect)
     for (ns, error_msg) in errors:
       self.msg('Error querying %s: %s' % (ns, error_msg))
     return results
 
-  def _LaunchBenchmarkThreads(self, input_queue):
-    """Launch and manage the benchmark threads."""
+  def _SendWorkItems(self, work_items, server_count, on_result):
+    """Send (ns, request_type, hostname) work items with the configured engine.
+
+    Args:
+      work_items: list of (ns, request_type, hostname) tuples
+      server_count: how many servers the work items are for (int)
+      on_result: called with each (ns, request_type, hostname, response,
+        duration_ns, error_msg) tuple as it arrives, from this thread.
+    """
+    if self.processes and self.processes > 1 and server_count > 1:
+      self._RunProcessPool(work_items, server_count, on_result)
+    elif self.engine == 'async':
+      self._RunAsyncEngine(work_items, server_count, on_result)
+    else:
+      status_message = ('Sending %s queries to %s servers' % (len(work_items) // server_count, server_count))
+      self._LaunchBenchmarkThreads(work_items, self._TrackProgress(status_message, len(work_items), on_result))
+
+  def _TrackProgress(self, status_message, total, on_result):
+    """Wrap an on_result callback so that it also keeps the status up to date."""
+    count = 0
+    last_update = 0
+
+    def _OnResult(query_result):
+      nonlocal count, last_update
+      count += 1
+      on_result(query_result)
+      now = time.time()
+      if count == total or now - last_update >= STATUS_INTERVAL:
+        last_update = now
+        self.msg(status_message, count=count, total=total)
+
+    self.msg(status_message, count=0, total=total)
+    return _OnResult
+
+  def _ProcessPool(self, server_count):
+    """Return the worker process pool, starting it on first use.
+
+    The pool is shared by every test run (and adaptive round) of a Run(),
+    so the workers are only spawned once. Later runs only ever test the
+    same servers or fewer, so the first run's server count bounds its size.
+    """
+    if not self._pool:
+      self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=min(self.processes, server_count))
+    return self._pool
+
+  def _ShutdownPool(self):
+    """Stop the worker processes started by _ProcessPool, if any."""
+    if self._pool:
+      self._pool.shutdown()
+      self._pool = None
+
+  def _RunProcessPool(self, work_items, server_count, on_result):
+    """Shard the work items by server across worker processes.
+
+    Each worker gets every work item for its servers, in their original
+    (interleaved) order, and runs them through the configured engine on its
+    own sockets. The per-server counters the workers update (request and
+    failure counts, error_map, RTT estimate) are merged back afterwards.
+    """
+    servers = {}
+    for (ns, unused_type, unused_hostname) in work_items:
+      servers.setdefault(ns.ip, ns)
+    shard_count = min(self.processes, server_count)
+    shard_for_ip = dict((ip, i % shard_count) for (i, ip) in enumerate(servers))
+    shards = [[] for _ in range(shard_count)]
+    for item in work_items:
+      shards[shard_for_ip[item[0].ip]].append(item)
+
+    settings = {
+        'thread_count': self.thread_count,
+        'engine': self.engine,
+        'max_in_flight': self.max_in_flight,
+        'qps': self.qps,
+        'qps_schedule': self.qps_schedule,
+        'kernel_timestamps': transport.KernelTimestampsEnabled()
+    }
+    status_message = ('Sending %s queries to %s servers (%s processes)' %
+                      (len(work_items) // server_count, server_count, shard_count))
+    on_result = self._TrackProgress(status_message, len(work_items), on_result)
+    pool = self._ProcessPool(server_count)
+    futures = [pool.submit(_RunShard, shard, settings) for shard in shards]
+    for future in concurrent.futures.as_completed(futures):
+      (shard_results, server_state, send_logs) = future.result()
+      for (ip, request_type, hostname, response, duration_ns, error_msg) in shard_results:
+        on_result((servers[ip], request_type, hostname, response, duration_ns, error_msg))
+      for (ip, (request_count, failure_count, error_map, estimator)) in server_state.items():
+        ns = servers[ip]
+        ns.request_count += request_count
+        ns.failure_count += failure_count
+        for (error, count) in error_map.items():
+          ns.error_map[error] = ns.error_map.get(error, 0) + count
+        ns.rtt = estimator
+      for log in send_logs:
+        self.send_logs.append([(servers[entry[0]],) + entry[1:] for entry in log])
+
+  def _RunAsyncEngine(self, work_items, server_count, on_result):
+    """Send all work items through the asyncio query engine."""
+    engine = async_engine.AsyncQueryEngine(max_in_flight=self.max_in_flight, qps=self.qps,
+                                           schedule=self.qps_schedule)
+    if self.qps:
+      status_message = ('Sending %s queries to %s servers (%s qps each, %s schedule)' %
+                        (len(work_items) // server_count, server_count, self.qps, self.qps_schedule))
+    else:
+      status_message = ('Sending %s queries to %s servers (%s in flight)' %
+                        (len(work_items) // server_count, server_count, engine.max_in_flight))
+    engine.Run(work_items, on_result=self._TrackProgress(status_message, len(work_items), on_result))
+    if self.qps:
+      self.send_logs.append(engine.send_log)
+      lags = [sent - intended for (_, _, _, intended, sent) in engine.send_log]
+      if lags:
+        self.msg('Open-loop send lag: %.1fms average, %.1fms max' %
+                 (util.NanosecondsToMilliseconds(sum(lags) / len(lags)),
+                  util.NanosecondsToMilliseconds(max(lags))))
+
+  def _LaunchBenchmarkThreads(self, work_items, on_result):
+    """Launch and manage the benchmark threads.
+
+    Results are handed to on_result from this thread as soon as they arrive,
+    rather than collected once every thread has finished.
+    """
+    input_queue = queue.Queue()
+    for item in work_items:
+      input_queue.put(item)
     results_queue = queue.Queue()
-    expected_total = input_queue.qsize()
     threads = []
     for unused_thread_num in range(0, self.thread_count):
       thread = BenchmarkThreads(input_queue, results_queue)
       thread.start()
       threads.append(thread)
 
-    query_count = expected_total / len(self.nameservers.enabled_servers)
-    status_message = ('Sending %s queries to %s servers' %
-                      (query_count, len(self.nameservers.enabled_servers)))
-    while results_queue.qsize() != expected_total:
-      self.msg(status_message, count=results_queue.qsize(), total=expected_total)
-      time.sleep(0.5)
+    received = 0
+    while received < len(work_items):
+      try:
+        on_result(results_queue.get(timeout=STATUS_INTERVAL))
+        received += 1
+      except queue.Empty:
+        # Only give up if every thread has died without answering.
+        if not [x for x in threads if x.is_alive()] and results_queue.empty():
+          break
 
-    self.msg(status_message, count=results_queue.qsize(), total=expected_total)
     for thread in threads:
       thread.join()
-    return results_queue
 
+
+def _RunShard(work_items, settings):
+  """Worker process side of Benchmark._RunProcessPool.
+
+  Args:
+    work_items: (ns, request_type, hostname) tuples for this shard's servers
+    settings: dictionary of Benchmark settings to run them with
+
+  Returns:
+    (results, server_state, send_logs), with nameservers replaced by their IP:
+    results are (ip, request_type, hostname, response, duration_ns, error_msg)
+    tuples, server_state maps each ip to (request_count, failure_count,
+    error_map, rtt estimator) changes, and send_logs are as in
+    AsyncQueryEngine.send_log.
+  """
+  if settings['kernel_timestamps']:
+    transport.UseKernelTimestamps()
+  servers = {}
+  for (ns, unused_type, unused_hostname) in work_items:
+    servers.setdefault(ns.ip, ns)
+  before = dict((ip, (ns.request_count, ns.failure_count, dict(ns.error_map)))
+                for (ip, ns) in servers.items())
+
+  bmark = Benchmark(None, thread_count=settings['thread_count'], engine=settings['engine'],
+                    max_in_flight=settings['max_in_flight'], qps=settings['qps'],
+                    qps_schedule=settings['qps_schedule'])
+  query_results = []
+  bmark._SendWorkItems(work_items, len(servers), query_results.append)
+
+  results = [(result[0].ip,) + tuple(result[1:]) for result in query_results]
+  server_state = {}
+  for (ip, ns) in servers.items():
+    (request_count, failure_count, error_map) = before[ip]
+    errors = dict((error, count - error_map.get(error, 0)) for (error, count) in ns.error_map.items()
+                  if count != error_map.get(error, 0))
+    server_state[ip] = (ns.request_count - request_count, ns.failure_count - failure_count,
+                        errors, ns.rtt)
+  send_logs = [[(entry[0].ip,) + tuple(entry[1:]) for entry in log] for log in bmark.send_logs]
+  return (results, server_state, send_logs)
+
+
+def _MissingRecords(test_records, test_run):
+  """Which test records a (partial) test run has not sent yet.
+
+  Hostnames containing __RANDOM__ are rewritten when sent, so they are
+  matched on the text around the marker.
+
+  Args:
+    test_records: a list of tuples in the form of (request_type, hostname)
+    test_run: results of the test run so far
+
+  Returns:
+    list of (request_type, hostname) tuples
+  """
+  sent = {}
+  for result in test_run:
+    key = (result[1], result[0])
+    sent[key] = sent.get(key, 0) + 1
+
+  missing = []
+  for (request_type, hostname) in test_records:
+    if sent.get((request_type, hostname)):
+      sent[(request_type, hostname)] -= 1
+      continue
+    if '__RANDOM__' in hostname:
+      (prefix, suffix) = hostname.split('__RANDOM__', 1)
+      match = [x for x in sent if sent[x] and x[0] == request_type
+               and x[1].startswith(prefix) and x[1].endswith(suffix)]
+      if match:
+        sent[match[0]] -= 1
+        continue
+    missing.append((request_type, hostname))
+  return missing
+
+
+def _AdaptiveZScore(comparisons):
+  """How wide (in standard errors) adaptive latency bounds must be.
+
+  Every comparison with the leader is a chance to drop a server by bad luck,
+  and they are repeated every round. The bounds are widened (Bonferroni
+  correction) so that the chance of that happening at all is ADAPTIVE_ALPHA.
+
+  Args:
+    comparisons: how many comparisons could be made (int)
+
+  Returns:
+    z score (float)
+  """
+  alpha = ADAPTIVE_ALPHA / max(comparisons, 1)
+  return statistics.NormalDist().inv_cdf(1 - alpha / 2)
+
+
+def _MaxAdaptiveComparisons(budget, record_count, server_count):
+  """The most server-to-leader comparisons an adaptive benchmark can make.
+
+  Args:
+    budget: how many queries may be sent in total (int)
+    record_count: how many test records there are (int)
+    server_count: how many servers are benchmarked (int)
+
+  Returns:
+    int
+  """
+  # The last round over the test records may be short, and every round sends
+  # queries to at least two servers.
+  smallest_round = min(ADAPTIVE_ROUND_SIZE, record_count % ADAPTIVE_ROUND_SIZE or ADAPTIVE_ROUND_SIZE)
+  max_rounds = int(math.ceil(budget / (2.0 * max(smallest_round, 1))))
+  return max_rounds * max(server_count - 1, 1)
+
+
+def _LatencyBounds(durations, z_score):
+  """Confidence bounds on the average of a list of durations.
+
+  Args:
+    durations: list of durations (any unit)
+    z_score: how wide the bounds are, in standard errors (float)
+
+  Returns:
+    (lower, upper) tuple. Until there are ADAPTIVE_MIN_SAMPLES durations, the
+    bounds are unlimited.
+  """
+  if len(durations) < ADAPTIVE_MIN_SAMPLES:
+    return (0, float('inf'))
+  average = util.CalculateListAverage(durations)
+  variance = sum([(x - average) ** 2 for x in durations]) / (len(durations) - 1)
+  margin = z_score * math.sqrt(variance / len(durations))
+  return (average - margin, average + margin)
@@ -17,9 +17,16 @@
 
 __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 
+import concurrent.futures
+import queue
+import random
+import time
 import unittest
 from . import benchmark
+from . import dns_wire
 from . import mocks
+from . import nameserver
+from . import nameserver_list
 
 class BenchmarkTest(unittest.TestCase):
   def testCreateTestsWeighted(self):
@@ -70,6 +77,11 @@ class BenchmarkTest(unittest.TestCase):
     self.assertEquals(len(b.results[ns_list[0]]), 2)
     self.assertEquals(len(b.results[ns_list[0]][0]), 3)
 
+  def testDefaultEngine(self):
+    ns_list = (nameserver.NameServer('127.0.0.1'),)
+    self.assertEqual(benchmark.Benchmark(ns_list, engine=None).engine, benchmark.DEFAULT_ENGINE)
+    self.assertRaises(ValueError, benchmark.Benchmark, ns_list, engine='carrier-pigeon')
+
   def testNormalRun(self):
     ns_list = (mocks.MockNameServer(mocks.GOOD_IP),
                mocks.MockNameServer(mocks.PERFECT_IP),
@@ -200,6 +212,174 @@ class BenchmarkTest(unittest.TestCase):
     ]
     self.assertEquals(b._LowestLatencyAsciiChart(), expected)
 
+  def testMissingRecords(self):
+    test_records = [('A', 'www.google.com.'), ('A', 'www.google.com.'),
+                    ('A', 'x__RANDOM__.example.com.'), ('AAAA', 'www.google.com.')]
+    test_run = [('www.google.com.', 'A', 10.0, None, None),
+                ('x0.123.example.com.', 'A', 12.0, None, None)]
+    self.assertEqual(benchmark._MissingRecords(test_records, test_run),
+                     [('A', 'www.google.com.'), ('AAAA', 'www.google.com.')])
+
+  def testRandomNamesAreNotCached(self):
+    ns = mocks.MockNameServer(mocks.PERFECT_IP)
+    input_queue = queue.Queue()
+    for _ in range(20):
+      input_queue.put((ns, 'A', 'x__RANDOM__.example.com.'))
+    input_queue.put((ns, 'A', 'www.example.com.'))
+    results_queue = queue.Queue()
+    dns_wire.GetQueryTemplate('www.example.com.', 'A')
+    cached = dns_wire._CachedQueryTemplate.cache_info().currsize
+    benchmark.BenchmarkThreads(input_queue, results_queue).run()
+    self.assertEqual(results_queue.qsize(), 21)
+    self.assertEqual(dns_wire._CachedQueryTemplate.cache_info().currsize, cached)
+
+
+def _SyntheticDurations(average_ms, count, spread_ms=1.0):
+  """Durations (ns) spread evenly around an average."""
+  return [int((average_ms + spread_ms * ((x % 5) - 2) / 2.0) * 1000000) for x in range(count)]
+
+
+class AdaptiveTest(unittest.TestCase):
+  def setUp(self):
+    self.fast = nameserver.NameServer('127.0.0.1', name='fast')
+    self.close = nameserver.NameServer('127.0.0.2', name='close')
+    self.slow = nameserver.NameServer('127.0.0.3', name='slow')
+    self.servers = nameserver_list.NameServers()
+    for ns in (self.fast, self.close, self.slow):
+      self.servers.append(ns)
+
+  def testZScore(self):
+    self.assertAlmostEqual(benchmark._AdaptiveZScore(1), 1.96, places=2)
+    # Repeating the comparison widens the bounds.
+    self.assertTrue(benchmark._AdaptiveZScore(10) > benchmark._AdaptiveZScore(2) > 1.96)
+    self.assertEqual(benchmark._MaxAdaptiveComparisons(400, 100, 3), 20)
+    # The short last round (10 records) bounds how many rounds there can be.
+    self.assertEqual(benchmark._MaxAdaptiveComparisons(400, 30, 3), 40)
+
+  def testLatencyBounds(self):
+    self.assertEqual(benchmark._LatencyBounds([10, 20], 2.0), (0, float('inf')))
+    durations = [10, 20] * 10
+    (lower, upper) = benchmark._LatencyBounds(durations, 2.0)
+    self.assertAlmostEqual(lower + upper, 30)
+    self.assertTrue(lower < upper)
+    self.assertTrue(benchmark._LatencyBounds(durations, 4.0)[0] < lower)
+
+  def testEliminateSlowServers(self):
+    b = benchmark.Benchmark(self.servers, adaptive=True)
+    durations = {self.fast: _SyntheticDurations(10, 40),
+                 self.close: _SyntheticDurations(10.2, 40),
+                 self.slow: _SyntheticDurations(20, 40)}
+    servers = [self.fast, self.close, self.slow]
+    self.assertEqual(b._EliminateSlowServers(servers, durations, 3.0), [self.fast, self.close])
+    self.assertTrue(self.slow.HasTag('eliminated'))
+    self.assertTrue([x for x in self.slow.notes if 'after 40 queries' in x])
+    self.assertFalse(self.close.HasTag('eliminated'))
+
+    # Too few results to tell.
+    durations = dict((ns, x[:10]) for (ns, x) in durations.items())
+    self.assertEqual(b._EliminateSlowServers([self.fast, self.slow], durations, 3.0),
+                     [self.fast, self.slow])
+
+  def testRunAdaptive(self):
+    averages = {self.fast: 10, self.close: 10.5, self.slow: 30}
+    b = benchmark.Benchmark(self.servers, adaptive=True, run_count=3)
+
+    def _FakeTestRun(records, servers=None):
+      results = {}
+      for ns in servers:
+        durations = _SyntheticDurations(averages[ns], len(records), spread_ms=4.0)
+        random.shuffle(durations)
+        results[ns] = [(x[1], x[0], d, None, None) for (x, d) in zip(records, durations)]
+      return results
+
+    b._SingleTestRun = _FakeTestRun
+    records = [('A', 'www%s.example.com.' % x) for x in range(100)]
+    results = b.Run(records)
+    counts = dict((ns, sum([len(x) for x in results[ns]])) for ns in results)
+    # The slow server is dropped early, and the rest of the budget is spent
+    # on the two that are too close to call.
+    self.assertTrue(self.slow.HasTag('eliminated'))
+    self.assertTrue(counts[self.slow] < 100)
+    self.assertFalse(self.fast.HasTag('eliminated') or self.close.HasTag('eliminated'))
+    self.assertEqual(counts[self.fast], counts[self.close])
+    self.assertEqual(sum(counts.values()), 900)
+    self.assertTrue(len(results[self.fast]) > 3)
+
+
+class LoopbackBenchmarkTest(unittest.TestCase):
+  """Benchmarks against DNS servers on loopback addresses."""
+
+  RECORDS = [('A', 'www.example.com.'), ('A', 'www.example.net.'), ('A', 'www.example.org.')]
+
+  def setUp(self):
+    self.servers = []
+    try:
+      for ip in ('127.0.0.1', '127.0.0.2', '127.0.0.3'):
+        self.servers.append(mocks.LoopbackDnsServer(ip=ip))
+    except OSError:
+      self.tearDown()
+      raise unittest.SkipTest('Needs 127.0.0.0/8 to be routed to loopback')
+
+  def tearDown(self):
+    for server in self.servers:
+      server.Close()
+
+  def RunBenchmark(self, **kwargs):
+    """Return the shape of a benchmark's results: ip -> (request count, runs of (hostname, answer))."""
+    ns_list = nameserver_list.NameServers()
+    for server in self.servers:
+      ns_list.append(server.NameServer())
+    results = benchmark.Benchmark(ns_list, run_count=2, **kwargs).Run(self.RECORDS)
+    shape = {}
+    for ns in ns_list:
+      runs = [sorted((x[0], x[1], nameserver.ResponseToAscii(x[3]), x[4]) for x in run) for run in results[ns]]
+      shape[ns.ip] = (ns.request_count, runs)
+    return shape
+
+  def testProcessPoolMatchesSingleProcess(self):
+    expected = self.RunBenchmark()
+    self.assertEqual(len(expected), 3)
+    self.assertEqual(expected['127.0.0.1'][1][0][0],
+                     ('www.example.com.', 'A', mocks.LOOPBACK_ANSWER, None))
+    self.assertEqual(self.RunBenchmark(processes=2), expected)
+    self.assertEqual(self.RunBenchmark(processes=2, engine='async'), expected)
+
+  def testProcessPoolIsSharedByTestRuns(self):
+    pools = []
+    executor = concurrent.futures.ProcessPoolExecutor
+
+    def _CountingExecutor(*args, **kwargs):
+      pools.append(executor(*args, **kwargs))
+      return pools[-1]
+
+    benchmark.concurrent.futures.ProcessPoolExecutor = _CountingExecutor
+    try:
+      shape = self.RunBenchmark(processes=2)
+    finally:
+      benchmark.concurrent.futures.ProcessPoolExecutor = executor
+    self.assertEqual(len(shape['127.0.0.1'][1]), 2)
+    self.assertEqual(len(pools), 1)
+    # Shut down once the benchmark is over.
+    self.assertRaises(RuntimeError, pools[0].submit, len, ())
+
+  def testOnResultStreams(self):
+    for server in self.servers:
+      server.delay = 0.05
+    ns_list = nameserver_list.NameServers()
+    for server in self.servers:
+      ns_list.append(server.NameServer())
+    for engine in ('threads', 'async'):
+      seen = []
+      bmark = benchmark.Benchmark(ns_list, run_count=2, engine=engine, max_in_flight=1,
+                                  on_result=lambda ns, result: seen.append((time.time(), ns, result)))
+      results = bmark.Run(self.RECORDS)
+      finished = time.time()
+      # Once for each result, as it arrives rather than at the end of the run.
+      self.assertEqual(len(seen), 18)
+      self.assertTrue(finished - seen[0][0] > 0.3, engine)
+      for ns in ns_list:
+        streamed = sorted(x[2][0] for x in seen if x[1] is ns)
+        self.assertEqual(streamed, sorted(x[0] for run in results[ns] for x in run))
 
 
 if __name__ == '__main__':
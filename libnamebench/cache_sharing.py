@@ -0,0 +1,124 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pick which nameservers are worth testing for a shared cache.
+
+Testing every pair of servers for a shared cache takes O(n^2) queries. Replicas
+nearly always have something in common that is cheap to find out, so servers
+are grouped by:
+
+  - node ids they have reported
+  - ASN
+  - network (/24 for IPv4, /48 for IPv6)
+  - version string, within the same /16
+  - a shared wildcard probe: every server looks up the same fresh hostname.
+    The first server of a shared cache to ask gets the full TTL, and the
+    others get that entry back from cache, so their answers expire at the
+    same moment.
+
+Only servers that share a group are tested against each other.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import bisect
+import ipaddress
+import random
+
+from . import health_checks
+
+# Probe answers that expire within this many seconds of each other may come
+# from the same cache (TTLs only have a one second resolution).
+PROBE_EXPIRY_SLACK = 1.5
+
+
+def NewProbeHostname():
+  """A hostname no cache should have seen yet, for StoreWildcardProbe()."""
+  return 'namebench%s.%s' % (random.randint(1, 2**32), random.choice(health_checks.WILDCARD_DOMAINS))
+
+
+def _NetworkKeys(ip):
+  """Return the (narrow, wide) networks an IP is in, as strings."""
+  try:
+    address = ipaddress.ip_address(ip)
+  except ValueError:
+    return (None, None)
+  if address.version == 4:
+    prefixes = (24, 16)
+  else:
+    prefixes = (48, 32)
+  return tuple([str(ipaddress.ip_network('%s/%s' % (ip, x), strict=False)) for x in prefixes])
+
+
+def GroupKeys(ns):
+  """The groups a nameserver belongs to (list of tuples)."""
+  (network, wide_network) = _NetworkKeys(ns.ip)
+  keys = [('node_id', x) for x in ns.node_ids]
+  if ns.asn:
+    keys.append(('asn', ns.asn))
+  if network:
+    keys.append(('network', network))
+  version = ns.known_version
+  if version and wide_network:
+    keys.append(('version', version, wide_network))
+  return keys
+
+
+def _ProbePairs(servers):
+  """Yield pairs of servers whose wildcard probe answers could share a cache."""
+  probes = [(ns.wildcard_probe[1] + ns.wildcard_probe[0], ns.wildcard_probe[0], ns)
+            for ns in servers if ns.wildcard_probe]
+  if not probes:
+    return
+  full_ttl = max([ttl for (unused_expiry, ttl, unused_ns) in probes])
+  probes.sort(key=lambda x: x[0])
+  expiries = [x[0] for x in probes]
+  for (expiry, ttl, ns) in probes:
+    # A full TTL means this server fetched the answer itself.
+    if ttl >= full_ttl:
+      continue
+    start = bisect.bisect_left(expiries, expiry - PROBE_EXPIRY_SLACK)
+    end = bisect.bisect_right(expiries, expiry + PROBE_EXPIRY_SLACK)
+    for (unused_expiry, unused_ttl, other_ns) in probes[start:end]:
+      if other_ns is not ns:
+        yield (ns, other_ns)
+
+
+def CandidatePairs(servers):
+  """Which servers should be tested for sharing a cache.
+
+  Args:
+    servers: list of nameservers, in the order pairs should be tested
+
+  Returns:
+    list of (ns, other_ns) tuples, in both orders, as expected by
+    NameServers.RunCacheCollusionThreads().
+  """
+  groups = {}
+  for ns in servers:
+    for key in GroupKeys(ns):
+      groups.setdefault(key, []).append(ns)
+
+  pairs = set()
+  for members in groups.values():
+    for ns in members:
+      for other_ns in members:
+        if ns is not other_ns:
+          pairs.add((ns, other_ns))
+  for (ns, other_ns) in _ProbePairs(servers):
+    pairs.add((ns, other_ns))
+    pairs.add((other_ns, ns))
+
+  position = dict((ns, i) for (i, ns) in enumerate(servers))
+  return sorted(pairs, key=lambda x: (position[x[1]], position[x[0]]))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the cache_sharing module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import unittest
+
+from . import cache_sharing
+from . import nameserver
+
+
+def _Server(ip, asn=None, probe=None):
+  ns = nameserver.NameServer(ip, name=ip, asn=asn)
+  ns.wildcard_probe = probe
+  return ns
+
+
+class CandidatePairsTest(unittest.TestCase):
+  def testUnrelatedServers(self):
+    servers = [_Server('10.0.1.1'), _Server('10.1.1.1'), _Server('192.168.0.1')]
+    self.assertEqual(cache_sharing.CandidatePairs(servers), [])
+
+  def testSameNetworkOrAsn(self):
+    (a, b, c, d) = (_Server('10.0.1.1'), _Server('10.0.1.2'), _Server('10.9.0.1', asn=15169),
+                    _Server('172.16.0.1', asn=15169))
+    pairs = cache_sharing.CandidatePairs([a, b, c, d])
+    self.assertEqual(pairs, [(b, a), (a, b), (d, c), (c, d)])
+
+  def testWildcardProbe(self):
+    # b got a's cached answer two seconds after a fetched it; c fetched its own.
+    a = _Server('10.0.1.1', probe=(300, 1000.0))
+    b = _Server('10.1.1.1', probe=(298, 1002.0))
+    c = _Server('10.2.1.1', probe=(300, 1002.0))
+    self.assertEqual(sorted(cache_sharing.CandidatePairs([a, b, c]), key=lambda x: (x[0].ip, x[1].ip)),
+                     [(a, b), (b, a)])
+
+
+if __name__ == '__main__':
+  unittest.main()
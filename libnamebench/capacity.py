@@ -0,0 +1,190 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Find how much load each nameserver can take before its latency falls apart.
+
+The sweep drives the open-loop (qps) benchmark at a geometrically increasing
+rate. After each step, a server whose p99 latency or timeout rate breaks the
+SLO drops out, and the last rate it kept up with is its capacity.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+from . import benchmark
+from . import nameserver_list
+from . import result_store
+from . import util
+
+DEFAULT_START_QPS = 50
+DEFAULT_STEP_MULTIPLIER = 1.5
+DEFAULT_MAX_QPS = 20000
+DEFAULT_STEP_DURATION = 5
+DEFAULT_P99_SLO = 250
+DEFAULT_MAX_TIMEOUT_RATE = 1.0
+
+
+class CapacityStep(object):
+  """Latency and timeout figures for one server at one offered rate."""
+
+  def __init__(self, qps, durations, timeouts):
+    """Constructor.
+
+    Args:
+      qps: offered queries per second (float)
+      durations: durations of answered queries, in ms (list of floats)
+      timeouts: how many queries went unanswered (int)
+    """
+    self.qps = qps
+    self.query_count = len(durations) + timeouts
+    self.p50 = util.CalculatePercentile(durations, 50)
+    self.p99 = util.CalculatePercentile(durations, 99)
+    if self.query_count:
+      self.timeout_rate = timeouts * 100.0 / self.query_count
+    else:
+      self.timeout_rate = 0.0
+    self.passed = None
+
+  def __repr__(self):
+    return ('<CapacityStep %sqps p50=%.1fms p99=%.1fms timeouts=%.1f%% passed=%s>' %
+            (self.qps, self.p50 or 0, self.p99 or 0, self.timeout_rate, self.passed))
+
+
+class CapacitySweep(object):
+  """Ramp the offered load on each enabled nameserver until it breaks its SLO."""
+
+  def __init__(self, nameservers, start_qps=DEFAULT_START_QPS, step_multiplier=DEFAULT_STEP_MULTIPLIER,
+               max_qps=DEFAULT_MAX_QPS, step_duration=DEFAULT_STEP_DURATION,
+               p99_slo=DEFAULT_P99_SLO, max_timeout_rate=DEFAULT_MAX_TIMEOUT_RATE,
+               max_in_flight=None, qps_schedule='fixed', status_callback=None):
+    """Constructor.
+
+    Args:
+      nameservers: a NameServers object
+      start_qps: Rate of the first step (float)
+      step_multiplier: How much to raise the rate by at each step (float, > 1)
+      max_qps: Stop ramping past this rate (float)
+      step_duration: How long each step lasts (seconds)
+      p99_slo: Highest acceptable p99 latency (ms)
+      max_timeout_rate: Highest acceptable percentage of unanswered queries (float)
+      max_in_flight: How many queries the async engine keeps outstanding (int)
+      qps_schedule: How to space queries (fixed, poisson)
+      status_callback: Where to send msg() updates to.
+    """
+    if step_multiplier <= 1:
+      raise ValueError('step_multiplier must be greater than 1 (got %s)' % step_multiplier)
+    self.nameservers = nameservers
+    self.start_qps = start_qps
+    self.step_multiplier = step_multiplier
+    self.max_qps = max_qps
+    self.step_duration = step_duration
+    self.p99_slo = p99_slo
+    self.max_timeout_rate = max_timeout_rate
+    self.max_in_flight = max_in_flight
+    self.qps_schedule = qps_schedule
+    self.status_callback = status_callback
+    # ns -> list of CapacityStep
+    self.steps = {}
+
+  def msg(self, msg, **kwargs):
+    if self.status_callback:
+      self.status_callback(msg, **kwargs)
+
+  def Run(self, test_records):
+    """Run the sweep.
+
+    All servers still within their SLO are loaded at the same time, each with
+    its own send schedule.
+
+    Args:
+      test_records: a list of tuples in the form of (request_type, hostname)
+
+    Returns:
+      A dictionary of the maximum sustainable qps (None if even the first step
+      failed), keyed by nameserver.
+    """
+    remaining = list(self.nameservers.enabled_servers)
+    for ns in remaining:
+      self.steps[ns] = []
+
+    qps = float(self.start_qps)
+    while remaining and qps <= self.max_qps:
+      self.msg('Offering %.0f qps to %s servers' % (qps, len(remaining)))
+      step_results = self._RunStep(remaining, qps, test_records)
+      for ns in list(remaining):
+        step = self._ScoreStep(qps, step_results.get(ns, []))
+        self.steps[ns].append(step)
+        if not step.passed:
+          self.msg('%s broke its SLO at %.0f qps: p99=%.1fms, %.1f%% timeouts' %
+                   (ns, qps, step.p99 or 0, step.timeout_rate))
+          remaining.remove(ns)
+      qps *= self.step_multiplier
+
+    return self.MaxSustainableQps()
+
+  def _RunStep(self, servers, qps, test_records):
+    """Offer one rate to a set of servers for step_duration seconds."""
+    query_count = max(1, int(qps * self.step_duration))
+    records = (test_records * (query_count // len(test_records) + 1))[:query_count]
+    subset = nameserver_list.NameServers()
+    for ns in servers:
+      subset.append(ns)
+    bmark = benchmark.Benchmark(subset, run_count=1, query_count=query_count,
+                                engine='async', max_in_flight=self.max_in_flight,
+                                qps=qps, qps_schedule=self.qps_schedule,
+                                status_callback=self.status_callback)
+    results = bmark.Run(records)
+    lags = [sent - intended for log in bmark.send_logs for (_, _, _, intended, sent) in log]
+    if lags and util.NanosecondsToMilliseconds(util.CalculateListAverage(lags)) > 1000.0 / qps:
+      self.msg('Sends fell behind schedule at %.0f qps: results may reflect the limits of this '
+               'machine rather than the nameservers.' % qps)
+    return dict((ns, runs[0]) for (ns, runs) in results.items())
+
+  def _ScoreStep(self, qps, test_run):
+    """Turn one server's results for a step into a CapacityStep."""
+    if test_run:
+      durations = [duration for (duration, answer_count) in zip(test_run.durations, test_run.answer_counts)
+                   if answer_count != result_store.NO_RESPONSE]
+      timeouts = test_run.failure_count
+    else:
+      (durations, timeouts) = ([], 0)
+    step = CapacityStep(qps, durations, timeouts)
+    step.passed = bool(durations) and step.p99 <= self.p99_slo and step.timeout_rate <= self.max_timeout_rate
+    return step
+
+  def MaxSustainableQps(self):
+    """The highest rate each server kept within its SLO (None if none)."""
+    capacity = {}
+    for ns in self.steps:
+      passed = [x.qps for x in self.steps[ns] if x.passed]
+      if passed:
+        capacity[ns] = max(passed)
+      else:
+        capacity[ns] = None
+    return capacity
+
+  def CreateReport(self):
+    """Plain-text summary of the sweep, highest capacity first."""
+    capacity = self.MaxSustainableQps()
+    lines = ['%-15.15s %-18.18s %10s %10s %10s %9s' % ('IP', 'Name', 'Max QPS', 'p50 (ms)', 'p99 (ms)', 'Timeouts')]
+    for ns in sorted(capacity, key=lambda x: capacity[x] or 0, reverse=True):
+      passed = [x for x in self.steps[ns] if x.passed]
+      if passed:
+        step = passed[-1]
+        lines.append('%-15.15s %-18.18s %10.0f %10.1f %10.1f %8.1f%%' %
+                     (ns.ip, ns.name, step.qps, step.p50, step.p99, step.timeout_rate))
+      else:
+        lines.append('%-15.15s %-18.18s %10s %10s %10s %9s' % (ns.ip, ns.name, '-', '-', '-', '-'))
+    lines.append('')
+    lines.append('SLO: p99 <= %sms, timeouts <= %s%%' % (self.p99_slo, self.max_timeout_rate))
+    return '\n'.join(lines)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the capacity module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import sys
+import unittest
+
+from . import capacity
+from . import config
+from . import nameserver
+from . import nameserver_list
+from . import result_store
+
+
+class StubBenchmark(object):
+  """Stands in for benchmark.Benchmark, answering with a latency model.
+
+  Each server's model maps the offered qps to (latency in ms, fraction of
+  queries that time out).
+  """
+
+  models = {}
+  offered = []
+
+  def __init__(self, nameservers, qps=None, **unused_kwargs):
+    self.nameservers = nameservers
+    self.qps = qps
+    self.send_logs = []
+    StubBenchmark.offered.append((qps, len(nameservers)))
+
+  def Run(self, test_records):
+    results = result_store.ResultStore(keep_responses=False)
+    for ns in self.nameservers:
+      (latency, timeout_fraction) = self.models[ns.ip](self.qps)
+      run = results.AddRun(ns)
+      timeouts = int(len(test_records) * timeout_fraction)
+      for (index, (request_type, hostname)) in enumerate(test_records):
+        if index < timeouts:
+          run.append((hostname, request_type, 2000000000, None, 'Timeout'))
+        else:
+          response = result_store.StoredResponse(0, 1, 60)
+          run.append((hostname, request_type, int(latency * 1000000), response, None))
+    return results
+
+
+class CapacitySweepTest(unittest.TestCase):
+  def setUp(self):
+    self.saved_benchmark = capacity.benchmark.Benchmark
+    capacity.benchmark.Benchmark = StubBenchmark
+    StubBenchmark.offered = []
+    StubBenchmark.models = {
+        # Latency takes off past 200 qps.
+        '127.0.0.1': lambda qps: (qps > 200 and 400.0 or 20.0, 0.0),
+        # Starts dropping queries past 500 qps.
+        '127.0.0.2': lambda qps: (10.0, qps > 500 and 0.05 or 0.0),
+        # Never keeps up.
+        '127.0.0.3': lambda qps: (1000.0, 0.5),
+    }
+    self.servers = nameserver_list.NameServers()
+    for ip in sorted(StubBenchmark.models):
+      self.servers.append(nameserver.NameServer(ip))
+
+  def tearDown(self):
+    capacity.benchmark.Benchmark = self.saved_benchmark
+
+  def testKnee(self):
+    sweep = capacity.CapacitySweep(self.servers, start_qps=100, step_multiplier=2, max_qps=5000,
+                                   step_duration=0.2)
+    records = [('A', 'www%s.example.com.' % x) for x in range(10)]
+    capacity_qps = dict((ns.ip, qps) for (ns, qps) in sweep.Run(records).items())
+    self.assertEqual(capacity_qps, {'127.0.0.1': 200, '127.0.0.2': 400, '127.0.0.3': None})
+    # Servers drop out of the sweep once they break the SLO.
+    self.assertEqual(StubBenchmark.offered, [(100, 3), (200, 2), (400, 2), (800, 1)])
+    self.assertEqual([x.passed for x in sweep.steps[self.servers[0]]], [True, True, False])
+    self.assertTrue('200' in sweep.CreateReport())
+
+  def testSloDefaults(self):
+    saved_argv = sys.argv
+    sys.argv = ['namebench.py']
+    try:
+      options = config.ParseCommandLineArguments()
+    finally:
+      sys.argv = saved_argv
+    self.assertEqual(options.max_qps, capacity.DEFAULT_MAX_QPS)
+    self.assertEqual(options.slo_p99, capacity.DEFAULT_P99_SLO)
+    self.assertEqual(options.max_timeout_rate, capacity.DEFAULT_MAX_TIMEOUT_RATE)
+
+
+if __name__ == '__main__':
+  unittest.main()
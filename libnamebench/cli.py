@@ -28,6 +28,7 @@ import sys
 from . import base_ui
 from . import conn_quality
 from . import nameserver_list
+from . import result_spool
 
 
 class NameBenchCli(base_ui.BaseUI):
@@ -122,11 +123,16 @@ class NameBenchCli(base_ui.BaseUI):
       print('')
 
       print('')
+      if self.options.capacity:
+        self.RunCapacitySweep()
+        print("\n%s\n" % self.capacity_sweep.CreateReport())
+        return
       self.PrepareBenchmark()
       self.RunAndOpenReports()
     except (nameserver_list.OutgoingUdpInterception,
             nameserver_list.TooFewNameservers,
-            conn_quality.OfflineConnection):
+            conn_quality.OfflineConnection,
+            result_spool.InvalidCheckpoint):
       (exc_type, exception) = sys.exc_info()[0:2]
       self.UpdateStatus("%s - %s" % (exc_type, exception), error=True)
 
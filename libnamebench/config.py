@@ -19,10 +19,8 @@ __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 
 
 import configparser
-import csv
 import optparse
 import os.path
-import re
 from io import StringIO
 import tempfile
 
@@ -32,9 +30,11 @@ import nb_third_party
 import httplib2
 
 from . import addr_util
+from . import capacity
 from . import data_sources
 from . import nameserver
 from . import nameserver_list
+from . import server_db
 from . import sys_nameservers
 from . import util
 from . import version
@@ -77,9 +77,14 @@ def ParseCommandLineArguments(default_config_file='config/namebench.cfg'):
   parser = optparse.OptionParser()
   parser.add_option('-6', '--ipv6_only', dest='ipv6_only', action='store_true', help='Only include IPv6 name servers')
   parser.add_option('-4', '--ipv4_only', dest='ipv4_only', action='store_true', help='Only include IPv4 name servers')
+  parser.add_option('--adaptive', dest='adaptive', action='store_true', help='Stop querying servers once they are clearly slower than the leader')
   parser.add_option('-b', '--censorship-checks', dest='enable_censorship_checks', action='store_true', help='Enable censorship checks')
+  parser.add_option('--capacity', dest='capacity', action='store_true', help='Find the maximum sustainable qps of each nameserver instead of benchmarking')
   parser.add_option('-c', '--country', dest='country', default=None, help='Set country (overrides GeoIP)')
+  parser.add_option('--discard_responses', dest='discard_responses', action='store_true', help='Only keep a summary of each reply (saves memory, drops answer text from the CSV)')
+  parser.add_option('-e', '--engine', dest='benchmark_engine', help='Benchmark query engine to use (threads, async)')
   parser.add_option('-H', '--skip-health-checks', dest='skip_health_checks', action='store_true', default=False, help='Skip health checks')
+  parser.add_option('--fixed_timeouts', dest='fixed_timeouts', action='store_true', help='Send each query once, rather than resending it when it takes much longer than the server\'s usual RTT')
   parser.add_option('-G', '--hide_results', dest='hide_results', action='store_true',  help='Upload results, but keep them hidden from indexes.')
   parser.add_option('-i', '--input', dest='input_source', help=('Import hostnames from an filename or application (%s)' % ', '.join(import_types)))
   parser.add_option('-I', '--ips', dest='servers', default=[], help='A list of ips to test (can also be passed as arguments)')
@@ -87,20 +92,31 @@ def ParseCommandLineArguments(default_config_file='config/namebench.cfg'):
   parser.add_option('-J', '--benchmark_threads', dest='benchmark_thread_count', type='int', help='# of benchmark threads to use')
   parser.add_option('-k', '--distance_km', dest='distance', default=1250, help='Distance in km for determining if server is nearby')
   parser.add_option('-K', '--overload_distance_km', dest='overload_distance', default=250, help='Like -k, but used if the country already has >350 servers.')
+  parser.add_option('--kernel_timestamps', dest='kernel_timestamps', action='store_true', help='Time queries with kernel receive timestamps (Linux)')
   parser.add_option('-m', '--select_mode', dest='select_mode', default='automatic', help='Selection algorithm to use (weighted, random, chunk)')
   parser.add_option('-M', '--max_servers_to_check', dest='max_servers_to_check', default=350, help='Maximum number of servers to inspect')
+  parser.add_option('--max_in_flight', dest='max_in_flight', type='int', help='# of queries the async engine keeps outstanding')
+  parser.add_option('--max_qps', dest='max_qps', type='float', default=capacity.DEFAULT_MAX_QPS, help='Highest rate the --capacity sweep offers')
+  parser.add_option('--max_timeout_rate', dest='max_timeout_rate', type='float', default=capacity.DEFAULT_MAX_TIMEOUT_RATE, help='SLO for --capacity: highest acceptable timeout percentage')
   parser.add_option('-n', '--num_servers', dest='num_servers', type='int', help='Number of nameservers to include in test')
   parser.add_option('-o', '--output', dest='output_file', default=None, help='Filename to write output to')
   parser.add_option('-O', '--csv_output', dest='csv_file', default=None, help='Filename to write query details to (CSV)')
+  parser.add_option('--processes', dest='benchmark_processes', type='int', help='# of processes to shard benchmark servers across')
   parser.add_option('-p', '--psn')   # Silly Mac OS X adding -psn_0_xxxx
   parser.add_option('-P', '--ping_timeout', dest='ping_timeout', type='float', help='# of seconds ping requests timeout in.')
   parser.add_option('-q', '--query_count', dest='query_count', type='int', help='Number of queries per run.')
+  parser.add_option('--qps', dest='qps', type='float', help='Open-loop queries per second to send to each nameserver (implies -e async)')
+  parser.add_option('--qps_schedule', dest='qps_schedule', default='fixed', help='How to space --qps queries (fixed, poisson)')
   parser.add_option('-r', '--runs', dest='run_count', default=1, type='int', help='Number of test runs to perform on each nameserver.')
+  parser.add_option('--resume', dest='resume', action='store_true', help='Resume the interrupted benchmark that was spooling to --spool')
   parser.add_option('-s', '--sets', dest='server_sets', default=[], help='Comma-separated list of sets to test (%s)' % SETS_TO_TAGS_MAP.keys())
+  parser.add_option('--slo_p99', dest='slo_p99', type='float', default=capacity.DEFAULT_P99_SLO, help='SLO for --capacity: highest acceptable p99 latency (ms)')
+  parser.add_option('--spool', dest='spool_file', default=None, help='File to append each result to as it arrives (.csv for CSV, otherwise JSON lines)')
+  parser.add_option('--spool_only', dest='spool_only', action='store_true', help='Keep only per-run totals in memory, and build the report and CSV from --spool')
   parser.add_option('-T', '--template', dest='template', default='html', help='Template to use for output generation (ascii, html, resolv.conf)')
   parser.add_option('-U', '--site_url', dest='site_url', help='URL to upload results to (http://namebench.appspot.com/)')
   parser.add_option('-u', '--upload_results', dest='upload_results', action='store_true', help='Upload anonymized results to SITE_URL (False)')
-  parser.add_option('-V', '--invalidate_cache', dest='invalidate_cache', action='store_true', help='Force health cache to be invalidated')
+  parser.add_option('-V', '--invalidate_cache', dest='invalidate_cache', action='store_true', help='Force health and hostname caches to be invalidated')
   parser.add_option('-w', '--open_webbrowser', dest='open_webbrowser', action='store_true', help='Opens the final report in your browser')
   parser.add_option('-x', '--no_gui', dest='no_gui', action='store_true', help='Disable GUI')
   parser.add_option('-Y', '--health_timeout', dest='health_timeout', type='float', help='health check timeout (in seconds)')
@@ -123,9 +139,36 @@ def ParseCommandLineArguments(default_config_file='config/namebench.cfg'):
 
   return options
 
-def GetNameServerData(filename='config/servers.csv'):
+def GetNameServerData(filename='config/servers.csv', include_tags=None, require_tags=None,
+                      country_code=None, asn=None, domain=None, latitude=None, longitude=None,
+                      max_distance=None):
+  """Load the nameservers that could pass a tag filter, plus the system servers.
+
+  Servers are read from a compiled copy of the server list (see server_db),
+  falling back to parsing the CSV file if it can not be used.
+
+  Args:
+    filename: server list (CSV)
+    include_tags, require_tags: as passed to NameServers.FilterByTag(). No
+      tags loads every server.
+    country_code, asn, domain, latitude, longitude: where the client is, for
+      tags that depend on it.
+    max_distance: the furthest a nearby server may be (km)
+
+  Returns:
+    NameServers object
+  """
   server_file = util.FindDataFile(filename)
-  ns_data = _ParseNameServerListing(open(server_file))
+  db = server_db.Open(server_file)
+  if db:
+    ns_data = nameserver_list.NameServers()
+    for row in db.Select(include_tags, require_tags, country_code=country_code, asn=asn,
+                         domain=domain, latitude=latitude, longitude=longitude,
+                         max_distance=max_distance):
+      ns_data.append(db.Server(row))
+    db.Close()
+  else:
+    ns_data = _ParseNameServerListing(open(server_file))
 
   # Add the system servers for later reference.
   for i, ip in enumerate(sys_nameservers.GetCurrentNameServers()):
@@ -138,43 +181,9 @@ def GetNameServerData(filename='config/servers.csv'):
   return ns_data
 
 def _ParseNameServerListing(fp):
-  fields = ['ip', 'tags', 'provider', 'instance', 'hostname', 'location',
-            'coords', 'asn', 'list_note', 'urls']
-  reader = csv.DictReader(fp, fieldnames=fields)
   ns_data = nameserver_list.NameServers()
-
-  for row in reader:
-    if row['instance']:
-      name = "%s (%s)" % (row['provider'], row['instance'])
-    else:
-      name = row['provider']
-
-    if row['coords']:
-      lat, lon = row['coords'].split(',')
-    else:
-      lat = lon = None
-
-    as_match = re.match(r'AS(\d+)(.*)', row['asn'])
-    if as_match:
-      asn, network_owner = as_match.groups()
-      network_owner = network_owner.lstrip(' ').rstrip(' ')
-    else:
-      asn = network_owner = None
-
-    ns_data.append(nameserver.NameServer(
-        row['ip'],
-        name=name,
-        tags=row['tags'].split(),
-        provider=row['provider'],
-        instance=row['instance'],
-        location=row['location'],
-        latitude=lat,
-        longitude=lon,
-        asn=asn,
-        hostname=row['hostname'],
-        network_owner=network_owner
-    ))
-
+  for server in server_db.ParseServerRows(fp):
+    ns_data.append(nameserver.NameServer(**server))
   return ns_data
 
 def GetSanityChecks():
@@ -269,7 +278,7 @@ def MergeConfigurationFileOptions(options):
         value = general[option]
       setattr(options, option, value)
 
-  for key in ('input_file', 'output_file', 'csv_file', 'input_source'):
+  for key in ('input_file', 'output_file', 'csv_file', 'spool_file', 'input_source'):
     value = getattr(options, key, None)
     if value:
       setattr(options, key, os.path.expanduser(value))
@@ -0,0 +1,282 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Wire-format helpers that keep dnspython out of the timed query path.
+
+The same (record, type) pairs are queried against every server in every run,
+so each request is encoded once into a QueryTemplate, and only a fresh query
+id is patched in per send. Replies are wrapped in a WireResponse, which only
+decodes the header until something asks for more.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import functools
+import random
+import struct
+
+# external dependencies (from nb_third_party)
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+
+TEMPLATE_CACHE_SIZE = 8192
+HEADER_LENGTH = 12
+
+
+def QuestionFromWire(wire):
+  """Return the question section of a DNS message for routing purposes.
+
+  Args:
+    wire: DNS message in wire format (bytes)
+
+  Returns:
+    The question section with the name lower-cased (bytes), b'' if the message
+    carries no question, or None if it could not be parsed.
+  """
+  if len(wire) < HEADER_LENGTH:
+    return None
+  if not struct.unpack('!H', wire[4:6])[0]:
+    return b''
+  pos = HEADER_LENGTH
+  try:
+    while wire[pos]:
+      # Compression pointers end a name, and should not be found in questions.
+      if wire[pos] & 0xC0:
+        pos += 1
+        break
+      pos += wire[pos] + 1
+    name_end = pos + 1
+  except IndexError:
+    return None
+  if name_end + 4 > len(wire):
+    return None
+  return wire[HEADER_LENGTH:name_end].lower() + wire[name_end:name_end + 4]
+
+
+def GetQueryTemplate(name, rdtype, rdclass=dns.rdataclass.IN, flags=dns.flags.RD, cache=True):
+  """Return the QueryTemplate for a question, cached unless told otherwise.
+
+  Names that are only ever queried once, such as those with a random label,
+  should pass cache=False so that they do not push out the templates that
+  are sent again.
+
+  Args:
+    name: DNS record name to query (string)
+    rdtype: record type, as text (A, TXT) or an int
+    rdclass: record class, as text (IN, CHAOS) or an int
+    flags: header flags to send (int)
+    cache: whether to keep the template for later requests (boolean)
+
+  Returns:
+    QueryTemplate
+
+  Raises:
+    ValueError, dns.exception.SyntaxError: if the question cannot be encoded.
+  """
+  if not cache:
+    return QueryTemplate(name, rdtype, rdclass=rdclass, flags=flags)
+  return _CachedQueryTemplate(name, rdtype, rdclass, flags)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _CachedQueryTemplate(name, rdtype, rdclass, flags):
+  return QueryTemplate(name, rdtype, rdclass=rdclass, flags=flags)
+
+
+class QueryTemplate(object):
+  """A pre-encoded query, waiting for a query id."""
+
+  def __init__(self, name, rdtype, rdclass=dns.rdataclass.IN, flags=dns.flags.RD):
+    self.name = dns.name.from_text(name)
+    self.rdtype = dns.rdatatype.RdataType.make(rdtype)
+    self.rdclass = dns.rdataclass.RdataClass.make(rdclass)
+    self.flags = flags
+    message = dns.message.make_query(self.name, self.rdtype, self.rdclass)
+    message.flags = flags
+    message.id = 0
+    self.message = message
+    self.wire = message.to_wire()
+    self.question_wire = QuestionFromWire(self.wire)
+
+  def NewRequest(self):
+    """Return a WireRequest for this template with a fresh 16-bit id."""
+    return WireRequest(self, random.getrandbits(16))
+
+
+class WireRequest(object):
+  """A single encoded query, handed to NameServer.Query().
+
+  It quacks enough like a dns.message.Message (id, question, to_wire,
+  is_response) for Query() overrides, such as mocks, to keep working.
+  """
+
+  def __init__(self, template, query_id):
+    self.template = template
+    self.id = query_id
+
+  @property
+  def question(self):
+    return self.template.message.question
+
+  def to_wire(self):
+    return struct.pack('!H', self.id) + self.template.wire[2:]
+
+  def is_response(self, response):
+    """Does a WireResponse (or dns.message.Message) answer this request?"""
+    if response.id != self.id or not response.flags & dns.flags.QR:
+      return False
+    if isinstance(response, WireResponse):
+      question = response.question_wire
+    else:
+      question = response.question
+    # Error replies do not always carry the question.
+    if not question:
+      return True
+    if isinstance(response, WireResponse):
+      return question == self.template.question_wire
+    return question == self.question
+
+
+def _SkipName(wire, pos):
+  """Return the offset just past an encoded (possibly compressed) name."""
+  while True:
+    length = wire[pos]
+    if not length:
+      return pos + 1
+    elif length & 0xC0:
+      return pos + 2
+    pos += length + 1
+
+
+def _FindWireError(wire):
+  """Check that the sections of a DNS message fill it exactly, without decoding them.
+
+  Returns:
+    the exception dns.message.from_wire() raises for a truncated message or
+    one with trailing junk, or None if the layout is sound.
+  """
+  counts = struct.unpack('!HHHH', wire[4:HEADER_LENGTH])
+  pos = HEADER_LENGTH
+  try:
+    for _ in range(counts[0]):
+      pos = _SkipName(wire, pos) + 4
+    for _ in range(sum(counts[1:])):
+      pos = _SkipName(wire, pos) + 8
+      pos += 2 + struct.unpack('!H', wire[pos:pos + 2])[0]
+  except (IndexError, struct.error):
+    return dns.exception.FormError()
+  if pos > len(wire):
+    return dns.exception.FormError()
+  elif pos < len(wire):
+    return dns.message.TrailingJunk()
+  return None
+
+
+class WireResponse(object):
+  """A DNS reply that is decoded lazily.
+
+  Only the 12-byte header is unpacked up front, which is all the timing path
+  and most consumers need (id, flags, rcode and answer count). The TTL of the
+  first answer is found by skipping over the question section on request, and
+  a full dns.message.Message is only built when an attribute it alone provides
+  (answer, question, authority, ...) is asked for.
+
+  Replies that can not be decoded are treated as empty, with the reason in
+  parse_error. CheckWire() finds the common cases without a full decode.
+  """
+
+  def __init__(self, wire, message=None, duration_ns=None, send_count=1):
+    """Constructor.
+
+    Args:
+      wire: DNS reply in wire format (bytes)
+      message: an already decoded dns.message.Message for this reply, if any.
+      duration_ns: round-trip time measured by the transport (int), if any.
+      send_count: how many times the request was sent before this arrived.
+    """
+    if len(wire) < HEADER_LENGTH:
+      raise dns.message.ShortHeader()
+    self.wire = wire
+    (self.id, self.flags, self.question_count, self.answer_count,
+     unused_authority_count, unused_additional_count) = struct.unpack('!HHHHHH', wire[:HEADER_LENGTH])
+    self.duration_ns = duration_ns
+    self.send_count = send_count
+    self.parse_error = None
+    self._ttl = None
+    self._message = message
+
+  def rcode(self):
+    return self.flags & 0x000F
+
+  def CheckWire(self):
+    """Check the layout of the reply (see _FindWireError).
+
+    Returns:
+      parse_error: why the reply can not be decoded (string), or None.
+    """
+    if self.parse_error is None and self._message is None:
+      error = _FindWireError(self.wire)
+      if error:
+        self._SetParseError(error)
+    return self.parse_error
+
+  def _SetParseError(self, exc):
+    # Treat undecodable replies as empty, rather than failing far away
+    # from the query that received them.
+    self.parse_error = '%s %s' % (exc.__class__.__name__, exc)
+    self.answer_count = 0
+    self._ttl = -1
+    if self._message is None:
+      self._message = dns.message.Message(id=self.id)
+      self._message.flags = self.flags
+
+  @property
+  def question_wire(self):
+    return QuestionFromWire(self.wire)
+
+  @property
+  def ttl(self):
+    """TTL of the first answer record, or -1 if there is none."""
+    if self._ttl is None:
+      self._ttl = -1
+      if self.answer_count:
+        try:
+          pos = HEADER_LENGTH
+          for _ in range(self.question_count):
+            pos = _SkipName(self.wire, pos) + 4
+          pos = _SkipName(self.wire, pos) + 4
+          self._ttl = struct.unpack('!I', self.wire[pos:pos + 4])[0]
+        except (IndexError, struct.error):
+          pass
+    return self._ttl
+
+  @property
+  def message(self):
+    """The fully decoded dns.message.Message (built on first use)."""
+    if self._message is None:
+      try:
+        self._message = dns.message.from_wire(self.wire)
+      except dns.exception.DNSException as exc:
+        self._SetParseError(exc)
+    return self._message
+
+  def __getattr__(self, name):
+    # Only called for attributes we do not have: hand them to the full message.
+    if name.startswith('__') or name in ('wire', '_message'):
+      raise AttributeError(name)
+    return getattr(self.message, name)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the dns_wire module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import unittest
+
+import dns.message
+import dns.rrset
+
+from . import dns_wire
+
+
+def _MakeReply(request, ttl=159, answers=('66.211.169.65', '66.211.169.2')):
+  query = dns.message.from_wire(request.to_wire())
+  reply = dns.message.make_response(query)
+  if answers:
+    reply.answer.append(dns.rrset.from_text(query.question[0].name, ttl, 'IN', 'A', *answers))
+  return reply.to_wire()
+
+
+class QueryTemplateTest(unittest.TestCase):
+  def testTemplateIsCached(self):
+    template = dns_wire.GetQueryTemplate('www.paypal.com.', 'A')
+    self.assertTrue(template is dns_wire.GetQueryTemplate('www.paypal.com.', 'A'))
+    self.assertFalse(template is dns_wire.GetQueryTemplate('www.paypal.com.', 'AAAA'))
+
+  def testUncachedTemplate(self):
+    cached = dns_wire._CachedQueryTemplate.cache_info().currsize
+    template = dns_wire.GetQueryTemplate('x0.4711.example.com.', 'A', cache=False)
+    self.assertFalse(template is dns_wire.GetQueryTemplate('x0.4711.example.com.', 'A', cache=False))
+    self.assertEqual(dns_wire._CachedQueryTemplate.cache_info().currsize, cached)
+    self.assertEqual(str(dns.message.from_wire(template.NewRequest().to_wire()).question[0]),
+                     'x0.4711.example.com. IN A')
+
+  def testNewRequestOnlyChangesId(self):
+    template = dns_wire.GetQueryTemplate('www.paypal.com.', 'A')
+    request = template.NewRequest()
+    wire = request.to_wire()
+    self.assertEqual(wire[2:], template.wire[2:])
+    parsed = dns.message.from_wire(wire)
+    self.assertEqual(parsed.id, request.id)
+    self.assertEqual(str(parsed.question[0]), 'www.paypal.com. IN A')
+
+  def testIsResponse(self):
+    request = dns_wire.GetQueryTemplate('www.paypal.com.', 'A').NewRequest()
+    response = dns_wire.WireResponse(_MakeReply(request))
+    self.assertTrue(request.is_response(response))
+    other = dns_wire.GetQueryTemplate('www.google.com.', 'A').NewRequest()
+    other.id = request.id
+    self.assertFalse(other.is_response(response))
+
+
+class WireResponseTest(unittest.TestCase):
+  def testHeaderFields(self):
+    request = dns_wire.GetQueryTemplate('www.paypal.com.', 'A').NewRequest()
+    response = dns_wire.WireResponse(_MakeReply(request))
+    self.assertEqual(response.id, request.id)
+    self.assertEqual(response.rcode(), 0)
+    self.assertEqual(response.answer_count, 2)
+    self.assertEqual(response.ttl, 159)
+    # Nothing so far should have needed a full decode.
+    self.assertEqual(response._message, None)
+
+  def testFullMessageOnDemand(self):
+    request = dns_wire.GetQueryTemplate('www.paypal.com.', 'A').NewRequest()
+    response = dns_wire.WireResponse(_MakeReply(request))
+    self.assertEqual(len(response.answer), 1)
+    self.assertEqual(response.answer[0].ttl, 159)
+
+  def testNoAnswer(self):
+    request = dns_wire.GetQueryTemplate('www.paypal.com.', 'A').NewRequest()
+    response = dns_wire.WireResponse(_MakeReply(request, answers=None))
+    self.assertEqual(response.answer_count, 0)
+    self.assertEqual(response.ttl, -1)
+
+  def testTruncatedReply(self):
+    request = dns_wire.GetQueryTemplate('www.paypal.com.', 'A').NewRequest()
+    response = dns_wire.WireResponse(_MakeReply(request)[:40])
+    self.assertEqual(response.answer, [])
+    self.assertEqual(response.answer_count, 0)
+    self.assertTrue(response.parse_error)
+
+  def testCheckWire(self):
+    request = dns_wire.GetQueryTemplate('www.paypal.com.', 'A').NewRequest()
+    wire = _MakeReply(request)
+    self.assertEqual(dns_wire.WireResponse(wire).CheckWire(), None)
+    self.assertEqual(dns_wire.WireResponse(_MakeReply(request, answers=None)).CheckWire(), None)
+
+    response = dns_wire.WireResponse(wire + b'junk')
+    self.assertTrue(response.CheckWire().startswith('TrailingJunk'))
+    self.assertEqual(response.answer_count, 0)
+    self.assertEqual(response.ttl, -1)
+    self.assertEqual(response.answer, [])
+
+    for length in (len(wire) - 1, 40, 20):
+      response = dns_wire.WireResponse(wire[:length])
+      self.assertTrue(response.CheckWire().startswith('FormError'), length)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,132 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Find which nameservers are near a point, without measuring the distance to all of them.
+
+Coordinates are bucketed into a grid of GRID_CELL_DEGREES cells. A radius
+query only measures the distance to points in the cells that the circle can
+reach, all at once (with numpy, if it is installed). Distances match
+util.DistanceBetweenCoordinates(), but use the haversine formula, which does
+not lose precision for nearby points.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import math
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+GRID_CELL_DEGREES = 2.0
+# Kilometers per radian of arc: 60 nautical miles per degree, as in
+# util.DistanceBetweenCoordinates().
+KM_PER_RADIAN = math.degrees(1) * 60 * 1.852
+KM_PER_DEGREE = 60 * 1.852
+# Use numpy for batches of at least this many points.
+MIN_NUMPY_BATCH = 64
+
+
+def CellKey(latitude, longitude, cell_degrees=GRID_CELL_DEGREES):
+  """The grid cell (row, column) that a coordinate pair is in."""
+  row = int(math.floor((min(latitude, 89.999999) + 90) / cell_degrees))
+  column = int(math.floor(((longitude + 180) % 360) / cell_degrees))
+  return (row, column)
+
+
+def CellsWithin(latitude, longitude, max_distance, cell_degrees=GRID_CELL_DEGREES):
+  """The grid cells that points within max_distance (km) of a coordinate pair may be in."""
+  row_count = int(math.ceil(180 / cell_degrees))
+  column_count = int(math.ceil(360 / cell_degrees))
+  lat_span = max_distance / KM_PER_DEGREE
+  south = max(latitude - lat_span, -90.0)
+  north = min(latitude + lat_span, 90.0)
+  (first_row, center_column) = CellKey(south, longitude, cell_degrees)
+  last_row = CellKey(north, longitude, cell_degrees)[0]
+
+  # Circles of latitude shrink towards the poles, so the longitude span is set
+  # by the latitude in the band that is furthest from the equator.
+  widest_cos = math.cos(math.radians(max(abs(south), abs(north))))
+  if north >= 90 or south <= -90 or lat_span * 2 >= 180 or widest_cos * 180 <= lat_span:
+    columns = range(column_count)
+  else:
+    lon_span = min(lat_span / widest_cos, 180.0)
+    column_span = int(math.ceil(lon_span / cell_degrees)) + 1
+    if column_span * 2 + 1 >= column_count:
+      columns = range(column_count)
+    else:
+      columns = [(center_column + x) % column_count for x in range(-column_span, column_span + 1)]
+  return [(row, column) for row in range(first_row, min(last_row, row_count - 1) + 1) for column in columns]
+
+
+def BatchDistances(latitude, longitude, latitudes, longitudes):
+  """Distances (km) from one coordinate pair to many (lists of degrees)."""
+  lat_r = math.radians(latitude)
+  lon_r = math.radians(longitude)
+  if numpy is not None and len(latitudes) >= MIN_NUMPY_BATCH:
+    lats = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    lons = numpy.radians(numpy.asarray(longitudes, dtype=float))
+    hav = (numpy.sin((lats - lat_r) / 2) ** 2 +
+           math.cos(lat_r) * numpy.cos(lats) * numpy.sin((lons - lon_r) / 2) ** 2)
+    return list(2 * numpy.arcsin(numpy.sqrt(numpy.minimum(hav, 1.0))) * KM_PER_RADIAN)
+
+  cos_lat = math.cos(lat_r)
+  distances = []
+  for (other_lat, other_lon) in zip(latitudes, longitudes):
+    other_lat_r = math.radians(other_lat)
+    hav = (math.sin((other_lat_r - lat_r) / 2) ** 2 +
+           cos_lat * math.cos(other_lat_r) * math.sin((math.radians(other_lon) - lon_r) / 2) ** 2)
+    distances.append(2 * math.asin(math.sqrt(min(hav, 1.0))) * KM_PER_RADIAN)
+  return distances
+
+
+class GeoGrid(object):
+  """Items bucketed by their coordinates, for radius and nearest-k queries."""
+
+  def __init__(self, cell_degrees=GRID_CELL_DEGREES):
+    self.cell_degrees = cell_degrees
+    # (row, column) -> list of (latitude, longitude, item)
+    self.cells = {}
+    self.count = 0
+
+  def Add(self, item, latitude, longitude):
+    key = CellKey(latitude, longitude, self.cell_degrees)
+    self.cells.setdefault(key, []).append((latitude, longitude, item))
+    self.count += 1
+
+  def Within(self, latitude, longitude, max_distance):
+    """Items less than max_distance (km) away, nearest first.
+
+    Returns:
+      list of (distance, item) tuples
+    """
+    points = []
+    for key in CellsWithin(latitude, longitude, max_distance, self.cell_degrees):
+      points.extend(self.cells.get(key, []))
+    if not points:
+      return []
+    distances = BatchDistances(latitude, longitude, [x[0] for x in points], [x[1] for x in points])
+    found = [(distance, point[2]) for (distance, point) in zip(distances, points) if distance < max_distance]
+    found.sort(key=lambda x: x[0])
+    return found
+
+  def Nearest(self, latitude, longitude, count):
+    """The count items nearest to a coordinate pair, as (distance, item) tuples."""
+    max_distance = self.cell_degrees * KM_PER_DEGREE
+    while True:
+      found = self.Within(latitude, longitude, max_distance)
+      if len(found) >= count or max_distance > math.pi * KM_PER_RADIAN:
+        return found[:count]
+      max_distance *= 2
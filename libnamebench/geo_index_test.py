@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the geo_index module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import random
+import unittest
+
+from . import geo_index
+from . import util
+
+
+class GeoGridTest(unittest.TestCase):
+  def setUp(self):
+    rand = random.Random(42)
+    self.points = [(rand.uniform(-90, 90), rand.uniform(-180, 180)) for x in range(2000)]
+    # Clusters near a pole and on both sides of the date line.
+    self.points.extend([(89.5, rand.uniform(-180, 180)) for x in range(20)])
+    self.points.extend([(rand.uniform(-5, 5), rand.choice([-179.9, 179.9])) for x in range(20)])
+    self.grid = geo_index.GeoGrid()
+    for (i, (lat, lon)) in enumerate(self.points):
+      self.grid.Add(i, lat, lon)
+
+  def BruteForce(self, lat, lon):
+    return sorted((util.DistanceBetweenCoordinates(lat, lon, x[0], x[1]), i) for (i, x) in enumerate(self.points))
+
+  def testBatchDistances(self):
+    lats = [x[0] for x in self.points[:100]]
+    lons = [x[1] for x in self.points[:100]]
+    for (distance, (lat, lon)) in zip(geo_index.BatchDistances(40.7, -74.0, lats, lons), self.points):
+      self.assertAlmostEqual(distance, util.DistanceBetweenCoordinates(40.7, -74.0, lat, lon), places=3)
+
+  def testWithin(self):
+    for (lat, lon) in [(37.4, -122.1), (89.0, 10.0), (0.0, 179.5), (-60.0, -5.0)]:
+      for max_distance in (50, 250, 1250, 5000, 25000):
+        expected = [i for (distance, i) in self.BruteForce(lat, lon) if distance < max_distance - 0.01]
+        found = self.grid.Within(lat, lon, max_distance)
+        self.assertEqual(set(expected) - set(x[1] for x in found), set())
+        distances = [x[0] for x in found]
+        self.assertEqual(distances, sorted(distances))
+        self.assertTrue(all(x < max_distance for x in distances))
+
+  def testNearest(self):
+    expected = [i for (distance, i) in self.BruteForce(51.5, -0.1)[:10]]
+    self.assertEqual([i for (distance, i) in self.grid.Nearest(51.5, -0.1, 10)], expected)
+    self.assertEqual(len(self.grid.Nearest(0, 0, 5000)), len(self.points))
+
+
+if __name__ == '__main__':
+  unittest.main()
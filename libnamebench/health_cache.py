@@ -0,0 +1,96 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk cache of nameserver health check outcomes.
+
+Health checks depend on where they are run from, so entries are keyed by the
+client network as well as the nameserver IP, and expire after a while.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import os
+import os.path
+import time
+
+# external dependencies (from third_party)
+import simplejson
+
+from . import util
+
+DEFAULT_TTL = 4 * 3600
+CACHE_FILENAME = 'namebench_health_cache.json'
+# Bump this whenever the format of a cached HealthState() changes.
+CACHE_VERSION = 1
+
+
+def DefaultCachePath():
+  return os.path.join(util.CacheDirectory(), CACHE_FILENAME)
+
+
+class HealthCache(object):
+  """Health check outcomes, keyed by client network and nameserver IP."""
+
+  def __init__(self, path=None, ttl=DEFAULT_TTL):
+    """Constructor.
+
+    Args:
+      path: cache file (defaults to DefaultCachePath())
+      ttl: how long entries stay valid (seconds)
+    """
+    self.path = path or DefaultCachePath()
+    self.ttl = ttl
+    self.entries = {}
+    self.Load()
+
+  def _Key(self, ns, client_network):
+    return '%s/%s' % (client_network, ns.ip)
+
+  def Load(self):
+    """Read the cache file, skipping expired entries. A broken file is ignored."""
+    self.entries = {}
+    try:
+      with open(self.path) as fp:
+        data = simplejson.load(fp)
+    except (IOError, ValueError):
+      return
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+      return
+    now = time.time()
+    for (key, entry) in data.get('entries', {}).items():
+      if now - entry['stored'] < self.ttl:
+        self.entries[key] = entry
+
+  def Save(self):
+    tmp_path = self.path + '.tmp'
+    with open(tmp_path, 'w') as fp:
+      simplejson.dump({'version': CACHE_VERSION, 'entries': self.entries}, fp)
+    os.replace(tmp_path, self.path)
+
+  def Clear(self):
+    """Forget every entry, including those on disk."""
+    self.entries = {}
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def Get(self, ns, client_network):
+    """Return the cached HealthState() of a nameserver, or None."""
+    entry = self.entries.get(self._Key(ns, client_network))
+    if entry and time.time() - entry['stored'] < self.ttl:
+      return entry['state']
+    return None
+
+  def Put(self, ns, client_network):
+    """Cache the current HealthState() of a nameserver."""
+    self.entries[self._Key(ns, client_network)] = {'stored': time.time(), 'state': ns.HealthState()}
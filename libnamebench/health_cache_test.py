@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the health_cache module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import health_cache
+from . import nameserver
+
+
+class HealthCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'health.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testRoundTrip(self):
+    ns = nameserver.NameServer('192.0.2.1', name='test')
+    ns.checks = [('TestARootServerResponse', False, None, 12.5), ('TestNodeId', False, False, 0.0)]
+    ns.warnings.add('www.google.com appears incorrect')
+    ns._node_ids.add('node1.example')
+    cache = health_cache.HealthCache(path=self.path)
+    cache.Put(ns, '198.51.100')
+    cache.Save()
+
+    restored = nameserver.NameServer('192.0.2.1', name='test')
+    cache = health_cache.HealthCache(path=self.path)
+    self.assertEqual(cache.Get(restored, '203.0.113'), None)
+    restored.RestoreHealthState(cache.Get(restored, '198.51.100'))
+    self.assertEqual(restored.checks, ns.checks)
+    self.assertEqual(restored.check_average, ns.check_average)
+    self.assertEqual(restored.warnings, ns.warnings)
+    self.assertEqual(restored.node_ids, ['node1.example'])
+    self.assertFalse(restored.is_disabled)
+
+  def testDisabledAndExpired(self):
+    ns = nameserver.NameServer('192.0.2.1', name='test')
+    ns.DisableWithMessage('Failed 8 tests')
+    cache = health_cache.HealthCache(path=self.path)
+    cache.Put(ns, 'net')
+    cache.Save()
+
+    restored = nameserver.NameServer('192.0.2.1', name='test')
+    restored.RestoreHealthState(health_cache.HealthCache(path=self.path).Get(restored, 'net'))
+    self.assertTrue(restored.is_disabled)
+    self.assertEqual(restored.disabled_msg, 'Failed 8 tests')
+    self.assertEqual(health_cache.HealthCache(path=self.path, ttl=0).Get(restored, 'net'), None)
+
+  def testClear(self):
+    cache = health_cache.HealthCache(path=self.path)
+    cache.Put(nameserver.NameServer('192.0.2.1'), 'net')
+    cache.Save()
+    cache.Clear()
+    self.assertFalse(os.path.exists(self.path))
+    self.assertEqual(health_cache.HealthCache(path=self.path).entries, {})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -34,11 +34,17 @@ CENSORSHIP_TIMEOUT = 30
 MAX_STORE_ATTEMPTS = 4
 TOTAL_WILDCARDS_TO_STORE = 3
 
+# The availability (ping) check.
+ROOT_SERVER_RECORD = 'a.root-servers.net.'
+ROOT_SERVER_ADDRESS = '198.41.0.4'
+
 FATAL_RCODES = ['REFUSED', 'NOTAUTH']
 
 class NameServerHealthChecks(object):
   """Health checks for a nameserver."""
 
+  __slots__ = ()
+
   def TestAnswers(self, record_type, record, expected, critical=False, timeout=None):
     """Test to see that an answer returns correct IP's.
 
@@ -52,18 +58,32 @@ class NameServerHealthChecks(object):
     Returns:
       (is_broken, error_msg, duration)
     """
-    is_broken = False
-    unmatched_answers = []
     if not timeout:
       timeout = self.health_timeout
     (response, duration, error_msg) = self.TimedRequest(record_type, record, timeout)
+    return self.CheckAnswers(response, duration, error_msg, record, expected, critical=critical)
+
+  def CheckAnswers(self, response, duration, error_msg, record, expected, critical=False):
+    """Check the outcome of a request made for TestAnswers().
+
+    Args:
+      response, duration, error_msg: as returned by TimedRequest()
+      record: string that was queried for
+      expected: tuple of strings expected in all answers
+      critical: If this query fails, should it count against the server.
+
+    Returns:
+      (is_broken, error_msg, duration)
+    """
+    is_broken = False
+    unmatched_answers = []
     if response:
       response_code = rcode.to_text(response.rcode())
       if response_code in FATAL_RCODES:
         error_msg = 'Responded with: %s' % response_code
         if critical:
           is_broken = True
-      elif not response.answer:
+      elif not response.answer_count:
         # Avoid preferring broken DNS servers that respond quickly
         duration = util.SecondsToMilliseconds(self.health_timeout)
         error_msg = 'No answer (%s): %s' % (response_code, record)
@@ -133,7 +153,7 @@ class NameServerHealthChecks(object):
       if not error_msg:
         error_msg = 'No response'
       is_broken = True
-    elif response.answer:
+    elif response.answer_count:
       error_msg = 'NXDOMAIN Hijacking' + warning_suffix
 
     return (is_broken, error_msg, duration)
@@ -143,7 +163,21 @@ class NameServerHealthChecks(object):
     return self.TestNegativeResponse(prefix='www')
 
   def TestARootServerResponse(self):
-    return self.TestAnswers('A', 'a.root-servers.net.', '198.41.0.4', critical=True)
+    return self.TestAnswers('A', ROOT_SERVER_RECORD, ROOT_SERVER_ADDRESS, critical=True)
+
+  def CheckPingResponse(self, response, duration, error_msg):
+    """Record the outcome of a TestARootServerResponse request sent elsewhere.
+
+    This is the fast_check of CheckHealth(), for a request that was sent as
+    part of a sweep across many nameservers (see NameServers.PingNameServers).
+
+    Returns:
+      Whether the nameserver is now disabled.
+    """
+    (is_broken, warning, duration) = self.CheckAnswers(response, duration, error_msg, ROOT_SERVER_RECORD,
+                                                       ROOT_SERVER_ADDRESS, critical=True)
+    self._RecordCheck('TestARootServerResponse', is_broken, warning, duration, is_fatal=True)
+    return self.is_disabled
 
   def StoreWildcardCache(self):
     """Store a set of wildcard records."""
@@ -159,11 +193,25 @@ class NameServerHealthChecks(object):
       hostname = 'namebench%s.%s' % (random.randint(1, 2**32), domain)
       attempted.append(hostname)
       response = self.TimedRequest('A', hostname, timeout=timeout)[0]
-      if response and response.answer:
+      if response and response.answer_count:
         self.cache_checks.append((hostname, response, self.timer()))
       else:
         sys.stdout.write('x')
 
+  def StoreWildcardProbe(self, hostname):
+    """Look up a wildcard hostname that every nameserver is asked for.
+
+    The TTL and time of the answer are kept in wildcard_probe, for
+    cache_sharing.CandidatePairs() to compare.
+    """
+    timeout = self.health_timeout * SHARED_CACHE_TIMEOUT_MULTIPLIER
+    response = self.TimedRequest('A', hostname, timeout=timeout)[0]
+    if response and response.answer_count:
+      self.wildcard_probe = (response.ttl, self.timer())
+    else:
+      self.wildcard_probe = None
+    return self.wildcard_probe
+
   def TestSharedCache(self, other_ns):
     """Is this nameserver sharing a cache with another nameserver?
 
@@ -191,13 +239,13 @@ class NameServerHealthChecks(object):
     for (ref_hostname, ref_response, ref_timestamp) in other_ns.cache_checks:
       response = self.TimedRequest('A', ref_hostname, timeout=timeout)[0]
       # Retry once - this *may* cause false positives however, as the TTL may be updated.
-      if not response or not response.answer:
+      if not response or not response.answer_count:
         sys.stdout.write('x')
         response = self.TimedRequest('A', ref_hostname, timeout=timeout)[0]
 
-      if response and response.answer:
-        ref_ttl = ref_response.answer[0].ttl
-        ttl = response.answer[0].ttl
+      if response and response.answer_count:
+        ref_ttl = ref_response.ttl
+        ttl = response.ttl
         delta = abs(ref_ttl - ttl)
         query_age = self.timer() - ref_timestamp
         delta_age_delta = abs(query_age - delta)
@@ -255,15 +303,18 @@ class NameServerHealthChecks(object):
       else:
         test_name = function.__name__
 
-      self.checks.append((test_name, is_broken, warning, duration))
-      if is_broken:
-        self.AddFailure('%s: %s' % (test_name, warning), fatal=is_fatal)
-      if warning:
-        # Special case for NXDOMAIN de-duplication
-        if not ('NXDOMAIN' in warning and 'NXDOMAIN Hijacking' in self.warnings):
-          self.AddWarning(warning)
+      self._RecordCheck(test_name, is_broken, warning, duration, is_fatal=is_fatal)
       if self.is_disabled:
         break
 
     return self.is_disabled
 
+  def _RecordCheck(self, test_name, is_broken, warning, duration, is_fatal=False):
+    self.checks.append((test_name, is_broken, warning, duration))
+    if is_broken:
+      self.AddFailure('%s: %s' % (test_name, warning), fatal=is_fatal)
+    if warning:
+      # Special case for NXDOMAIN de-duplication
+      if not ('NXDOMAIN' in warning and 'NXDOMAIN Hijacking' in self.warnings):
+        self.AddWarning(warning)
+
@@ -16,12 +16,17 @@
 
 __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 
+import socket
+import threading
 import time
+from . import dns_wire
 from . import nameserver
 
 # external dependencies (from third_party)
 import dns.message
 import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
 import dns.query
 
 GOOD_IP = '127.0.0.1'
@@ -29,13 +34,14 @@ SLOW_IP = '9.9.9.9'
 PERFECT_IP = '127.127.127.127'
 NO_RESPONSE_IP = '10.0.0.1'
 BROKEN_IP = '192.168.0.1'
+LOOPBACK_ANSWER = '192.0.2.53'
 
 class MockNameServer(nameserver.NameServer):
   """Act like Nameserver, but do not issue any actual queries!"""
 
   def FakeAnswer(self, request, no_answer=False):
     if not request:
-      request = self.CreateRequest('www.com', 'A', dns.rdataclass.IN)
+      request = dns_wire.GetQueryTemplate('www.com.', 'A').NewRequest()
 
     response_text = """id 999
 opcode QUERY
@@ -59,10 +65,10 @@ ppns2.phx.paypal.com. 73170 IN A 66.211.168.227"""
     msg = dns.message.from_text(response_text)
     msg.question = request.question
     if no_answer:
-      msg.answer = None
-    return msg
+      msg.answer = []
+    return dns_wire.WireResponse(msg.to_wire(), message=msg)
 
-  def Query(self, request, timeout):
+  def Query(self, request, timeout, retransmit_timeout=None):
     """Return a falsified DNS response."""
     question = str(request.question[0])
     if self.ip == BROKEN_IP:
@@ -80,3 +86,61 @@ ppns2.phx.paypal.com. 73170 IN A 66.211.168.227"""
     elif self.ip == SLOW_IP:
       time.sleep(0.03)
     return answer
+
+
+class LoopbackDnsServer(threading.Thread):
+  """A DNS server on a loopback port, for tests that need real sockets.
+
+  Every query is answered with LOOPBACK_ANSWER (an A record), after delay
+  seconds. The first drop_count queries are not answered at all.
+  """
+
+  def __init__(self, ip='127.0.0.1', delay=0, drop_count=0):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.ip = ip
+    self.delay = delay
+    self.drop_count = drop_count
+    self.received = 0
+    self.closed = False
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sock.bind((ip, 0))
+    self.sock.settimeout(0.1)
+    self.port = self.sock.getsockname()[1]
+    self.start()
+
+  def NameServer(self, **kwargs):
+    """A NameServer that sends its queries here."""
+    return nameserver.NameServer(self.ip, port=self.port, **kwargs)
+
+  def run(self):
+    while not self.closed:
+      try:
+        (wire, address) = self.sock.recvfrom(4096)
+      except socket.timeout:
+        continue
+      except (OSError, ValueError):
+        return
+      self.received += 1
+      if self.received <= self.drop_count:
+        continue
+      request = dns.message.from_wire(wire)
+      response = dns.message.make_response(request)
+      question = request.question[0]
+      if question.rdtype == dns.rdatatype.A:
+        response.answer.append(dns.rrset.from_text(question.name, 60, 'IN', 'A', LOOPBACK_ANSWER))
+      if self.delay:
+        threading.Timer(self.delay, self._Reply, (response.to_wire(), address)).start()
+      else:
+        self._Reply(response.to_wire(), address)
+
+  def _Reply(self, wire, address):
+    try:
+      self.sock.sendto(wire, address)
+    except (OSError, ValueError):
+      pass
+
+  def Close(self):
+    self.closed = True
+    self.join()
+    self.sock.close()
@@ -20,8 +20,11 @@ __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 import random
 import re
 import socket
+import collections.abc
 import sys
+import threading
 import time
+import weakref
 
 # external dependencies (from nb_third_party)
 import dns.exception
@@ -31,13 +34,15 @@ import dns.query
 import dns.rcode
 import dns.rdataclass
 import dns.rdatatype
-import dns.resolver
-import dns.reversename
 import dns.version
 
 from . import health_checks
 from . import provider_extensions
 from . import addr_util
+from . import dns_wire
+from . import reverse_dns
+from . import rtt
+from . import transport
 from . import util
 
 # Look for buggy system versions of namebench
@@ -55,6 +60,8 @@ FAILURE_PRONE_RATE = 10
 
 # In order of most likely to be important.
 PROVIDER_TAGS = ['isp', 'network', 'likely-isp', 'dhcp']
+KEEPER_TAGS = ['preferred', 'dhcp', 'system', 'specified']
+BAD_TAGS = ['rejected', 'blacklist']
 
 # EVIL IMPORT-TIME SIDE EFFECT
 BEST_TIMER_FUNCTION = util.GetMostAccurateTimerFunction()
@@ -63,7 +70,7 @@ BEST_TIMER_FUNCTION = util.GetMostAccurateTimerFunction()
 def ResponseToAscii(response):
   if not response:
     return None
-  if response.answer:
+  if response.answer_count:
     answers = [', '.join(map(str, x.items)) for x in response.answer]
     return ' -> '.join(answers).rstrip('"').lstrip('"')
   else:
@@ -79,21 +86,226 @@ class BrokenSystemClock(Exception):
     return repr(self.value)
 
 
+# Tags are interned as bits, see TagBit().
+_tag_bits = {}
+_tag_names = []
+_tag_lock = threading.Lock()
+
+
+def TagBit(tag):
+  """The bit that stands for a tag, allocating one for a new tag."""
+  bit = _tag_bits.get(tag)
+  if bit is None:
+    with _tag_lock:
+      bit = _tag_bits.get(tag)
+      if bit is None:
+        bit = 1 << len(_tag_names)
+        _tag_names.append(tag)
+        _tag_bits[tag] = bit
+  return bit
+
+
+def TagMask(tags):
+  """The bitmask for a collection of tags."""
+  mask = 0
+  for tag in tags:
+    mask |= TagBit(tag)
+  return mask
+
+
+def _TagNames(mask):
+  """The tags in a bitmask (generator)."""
+  while mask:
+    lowest = mask & -mask
+    yield _tag_names[lowest.bit_length() - 1]
+    mask ^= lowest
+
+
+class TagSet(collections.abc.MutableSet):
+  """The tags of a nameserver, stored as a bitmask, which tells observers about changes.
+
+  It behaves as a set of strings. NameServers uses the notifications to keep
+  its per-tag and per-state indexes current. Observers are called with
+  (owner, added_tags, removed_tags), and are only weakly referenced.
+
+  Tag bits are allocated per process, so a TagSet is pickled as its tag
+  names. Observers are not pickled: whatever indexes the unpickled server
+  registers its own (NameServers does so when the server is appended).
+  """
+
+  __slots__ = ('mask', 'owner', '_observers')
+
+  def __init__(self, tags=(), owner=None):
+    self.mask = TagMask(tags)
+    self.owner = owner
+    self._observers = None
+
+  def AddObserver(self, callback):
+    if self._observers is None:
+      self._observers = []
+    self._observers.append(weakref.WeakMethod(callback))
+
+  def RemoveObserver(self, callback):
+    if self._observers:
+      self._observers = [x for x in self._observers if x() not in (None, callback)]
+
+  def HasAny(self, mask):
+    return bool(self.mask & mask)
+
+  def _SetMask(self, mask):
+    """Change the bitmask, and tell the observers what changed."""
+    before = self.mask
+    self.mask = mask
+    if before == mask or not self._observers:
+      return
+    added = set(_TagNames(mask & ~before))
+    removed = set(_TagNames(before & ~mask))
+    for ref in list(self._observers):
+      callback = ref()
+      if callback:
+        callback(self.owner, added, removed)
+      else:
+        self._observers.remove(ref)
+
+  def __reduce__(self):
+    return (TagSet, (sorted(self), self.owner))
+
+  @classmethod
+  def _from_iterable(cls, tags):
+    # Results of set operators (&, |, -) are plain sets.
+    return set(tags)
+
+  def __contains__(self, tag):
+    return bool(self.mask & _tag_bits.get(tag, 0))
+
+  def __iter__(self):
+    return _TagNames(self.mask)
+
+  def __len__(self):
+    return bin(self.mask).count('1')
+
+  def __repr__(self):
+    return 'TagSet(%r)' % sorted(self)
+
+  def add(self, tag):
+    self._SetMask(self.mask | TagBit(tag))
+
+  def discard(self, tag):
+    self._SetMask(self.mask & ~_tag_bits.get(tag, 0))
+
+  def clear(self):
+    self._SetMask(0)
+
+  def update(self, *others):
+    mask = self.mask
+    for tags in others:
+      mask |= TagMask(tags)
+    self._SetMask(mask)
+
+  def difference_update(self, *others):
+    mask = self.mask
+    for tags in others:
+      mask &= ~TagMask(tags)
+    self._SetMask(mask)
+
+  def intersection_update(self, *others):
+    mask = self.mask
+    for tags in others:
+      mask &= TagMask(tags)
+    self._SetMask(mask)
+
+  def intersection(self, *others):
+    mask = self.mask
+    for tags in others:
+      mask &= TagMask(tags)
+    return set(_TagNames(mask))
+
+  def copy(self):
+    return set(self)
+
+  def __ior__(self, other):
+    self.update(other)
+    return self
+
+  def __iand__(self, other):
+    self.intersection_update(other)
+    return self
+
+  def __isub__(self, other):
+    self.difference_update(other)
+    return self
+
+  def __ixor__(self, other):
+    self._SetMask(self.mask ^ TagMask(other))
+    return self
+
+
+_KEEPER_MASK = TagMask(KEEPER_TAGS)
+_BAD_MASK = TagMask(BAD_TAGS)
+_HIDDEN_MASK = TagBit('hidden')
+_DISABLED_MASK = TagBit('disabled')
+
+
+class _LazySlot(object):
+  """A container attribute that is only allocated when it is first used.
+
+  Most of the servers we load are never tested, so they should not carry
+  empty lists and dictionaries around.
+  """
+
+  def __init__(self, slot_name, factory):
+    self.slot_name = slot_name
+    self.factory = factory
+    self.slot = None
+
+  def __set_name__(self, owner, name):
+    self.slot = owner.__dict__[self.slot_name]
+
+  def __get__(self, ns, owner=None):
+    if ns is None:
+      return self
+    value = self.slot.__get__(ns, owner)
+    if value is None:
+      value = self.factory()
+      self.slot.__set__(ns, value)
+    return value
+
+  def __set__(self, ns, value):
+    self.slot.__set__(ns, value)
+
+
 class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameServerProvider):
   """Hold information about a particular nameserver."""
 
+  __slots__ = ('ip', 'port', 'name', 'dhcp_position', 'system_position', '_tags', 'provider', 'instance',
+               'location', 'country_code', 'latitude', 'longitude', 'asn', 'network_owner',
+               '_hostname', 'timeout', 'health_timeout', 'ping_timeout', 'adaptive_timeouts',
+               '_rtt', '_version', '_node_id_set', '_external_ip_set', 'disabled_msg',
+               '_warnings', '_shared_with', '_checks', '_cache_checks', '_error_map',
+               'failed_test_count', 'share_check_count', 'wildcard_probe', 'is_slower_replica',
+               'request_count', 'failure_count', '__weakref__')
+
+  rtt = _LazySlot('_rtt', rtt.RttEstimator)
+  warnings = _LazySlot('_warnings', set)
+  shared_with = _LazySlot('_shared_with', set)
+  checks = _LazySlot('_checks', list)
+  cache_checks = _LazySlot('_cache_checks', list)
+  error_map = _LazySlot('_error_map', dict)
+  _node_ids = _LazySlot('_node_id_set', set)
+  _external_ips = _LazySlot('_external_ip_set', set)
+
+  timer = staticmethod(BEST_TIMER_FUNCTION)
+
   def __init__(self, ip, hostname=None, name=None, tags=None, provider=None,
                instance=None, location=None, latitude=None, longitude=None, asn=None,
-               network_owner=None, dhcp_position=None, system_position=None):
+               network_owner=None, dhcp_position=None, system_position=None, port=53):
     self.ip = ip
+    self.port = port
     self.name = name
     self.dhcp_position = dhcp_position
     self.system_position = system_position
 
-    if tags:
-      self.tags = set(tags)
-    else:
-      self.tags = set()
+    self.tags = tags or ()
     self.provider = provider
     self.instance = instance
     self.location = location
@@ -113,11 +325,14 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
     self.timeout = 5
     self.health_timeout = 5
     self.ping_timeout = 1
+    # Drive the timeout of benchmark queries from the measured RTT.
+    self.adaptive_timeouts = True
+    self._rtt = None
+    self.disabled_msg = None
     self.ResetTestStatus()
     self._version = None
-    self._node_ids = set()
-
-    self.timer = BEST_TIMER_FUNCTION
+    self._node_id_set = None
+    self._external_ip_set = None
 
     if ':' in self.ip:
       self.tags.add('ipv6')
@@ -134,9 +349,18 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
     elif self.is_bad:
       self.DisableWithMessage("Known bad address.")
 
-  def AddNetworkTags(self, domain, provider, asn, country_code):
+  def AddNetworkTags(self, domain, provider, asn, country_code, hostname_domain=None):
+    """Tag this server if it is in the client's network or ISP.
+
+    Args:
+      domain: the client's domain
+      provider: the client's provider (first label of its domain)
+      asn: the client's ASN
+      country_code: the client's country
+      hostname_domain: the domain of our hostname, if it is already known
+    """
     if self.hostname:
-      my_domain = addr_util.GetDomainFromHostname(self.hostname)
+      my_domain = hostname_domain or addr_util.GetDomainFromHostname(self.hostname)
       hostname = self.hostname.lower()
     else:
       my_domain = 'UNKNOWN'
@@ -160,40 +384,93 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
 
   def ResetTestStatus(self):
     """Reset testing status of this host."""
-    self.warnings = set()
-    self.shared_with = set()
+    self._warnings = None
+    self._shared_with = None
     if self.is_disabled:
       self.tags.remove('disabled')
-    self.checks = []
+    self._checks = None
     self.failed_test_count = 0
     self.share_check_count = 0
-    self.cache_checks = []
+    self._cache_checks = None
+    self.wildcard_probe = None
     self.is_slower_replica = False
     self.ResetErrorCounts()
 
+  def HealthState(self):
+    """The outcome of this server's health checks, as JSON-friendly data (see health_cache)."""
+    checks = []
+    for (test_name, is_broken, warning, duration) in self.checks:
+      if warning not in (None, False):
+        warning = str(warning)
+      checks.append([test_name, bool(is_broken), warning, duration])
+    return {
+        'checks': checks,
+        'warnings': sorted(map(str, self.warnings)),
+        'disabled_msg': self.is_disabled and (self.disabled_msg or 'Disabled') or None,
+        'hidden': self.is_hidden,
+        'node_ids': sorted([x for x in self._node_ids if x]),
+        'hostname': self._hostname,
+        'version': self._version,
+        'shared_with': sorted([x.ip for x in self.shared_with]),
+    }
+
+  def RestoreHealthState(self, state, restore_hidden=True):
+    """Restore the outcome of earlier health checks (see HealthState).
+
+    Args:
+      state: dictionary from HealthState()
+      restore_hidden: whether to hide the server again if it was hidden.
+        Hiding depends on the rest of the server list, unlike the other state.
+    """
+    self.ResetTestStatus()
+    self.checks = [tuple(x) for x in state['checks']]
+    self.warnings = set(state['warnings'])
+    self._node_ids = set(state['node_ids'])
+    if state['hostname'] is not None:
+      self._hostname = state['hostname']
+    if state['version'] is not None:
+      self._version = state['version']
+    if state['disabled_msg']:
+      self.DisableWithMessage(state['disabled_msg'])
+    if restore_hidden and state['hidden']:
+      self.tags.add('hidden')
+
   def ResetErrorCounts(self):
     """NOTE: This gets called by benchmark.Run()!"""
 
     self.request_count = 0
     self.failure_count = 0
-    self.error_map = {}
+    self._error_map = None
+
+  @property
+  def retransmit_timeout(self):
+    """When to resend a query that does not ask for a specific timeout (seconds).
+
+    None if it should be sent once: the query is still waited on for the
+    full timeout either way, so a slow answer is not lost.
+    """
+    if self.adaptive_timeouts:
+      rto = self.rtt.Timeout(self.timeout)
+      if rto < self.timeout:
+        return rto
+    return None
 
   @property
   def is_keeper(self):
-    return bool(self.MatchesTags(['preferred', 'dhcp', 'system', 'specified']))
+    return bool(self._tags.mask & _KEEPER_MASK)
 
   @property
   def is_bad(self):
-    if not self.is_keeper and self.MatchesTags(['rejected', 'blacklist']):
+    if not self._tags.mask & _KEEPER_MASK and self._tags.mask & _BAD_MASK:
       return True
 
   @property
   def is_hidden(self):
-    return self.HasTag('hidden')
+    return bool(self._tags.mask & _HIDDEN_MASK)
 
   @property
   def is_disabled(self):
-    return self.HasTag('disabled')
+    return bool(self._tags.mask & _DISABLED_MASK)
 
   @property
   def check_average(self):
@@ -255,12 +532,35 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
       my_notes.extend(self.errors)
     return my_notes
 
+  @property
+  def tags(self):
+    return self._tags
+
+  @tags.setter
+  def tags(self, tags):
+    """Replace the tags in place, so that observers of the TagSet hear about it."""
+    if getattr(self, '_tags', None) is None:
+      self._tags = TagSet(tags, owner=self)
+    else:
+      tags = set(tags)
+      self._tags.intersection_update(tags)
+      self._tags.update(tags)
+
   @property
   def hostname(self):
     if self._hostname is None and not self.is_disabled:
       self.UpdateHostname()
     return self._hostname
 
+  @hostname.setter
+  def hostname(self, hostname):
+    self._hostname = hostname
+
+  @property
+  def has_hostname(self):
+    """Whether the hostname is known already (from the server list, or a lookup)."""
+    return self._hostname is not None
+
   def UpdateHostname(self):
     if not self.is_disabled:
       self._hostname = self.GetReverseIp(self.ip)
@@ -270,7 +570,11 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
   def version(self):
     if self._version is None and not self.is_disabled:
       self.GetVersion()
+    return self.known_version
 
+  @property
+  def known_version(self):
+    """Like version, but never queries the server for it."""
     if not self._version:
       return None
 
@@ -344,7 +648,7 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
 
   def HasTag(self, tag):
     """Matches one tag."""
-    return tag in self.tags
+    return tag in self._tags
 
   def MatchesTags(self, tags):
     """Matches many tags."""
@@ -392,13 +696,9 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
       self.tags.add('hidden')
     self.disabled_msg = message
 
-  def CreateRequest(self, record, request_type, return_type):
-    """Function to work around any dnspython make_query quirks."""
-    return dns.message.make_query(record, request_type, return_type)
-
-  def Query(self, request, timeout):
-#    print "%s -> %s" % (request, self)
-    return dns.query.udp(request, self.ip, timeout, 53)
+  def Query(self, request, timeout, retransmit_timeout=None):
+    return transport.GetTransport().Query(request, self.ip, timeout, port=self.port,
+                                          retransmit_timeout=retransmit_timeout)
 
   def TimedRequest(self, type_string, record_string, timeout=None, rdataclass=None):
     """Make a DNS Get, returning the reply and duration it took.
@@ -411,112 +711,172 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
 
     Returns:
       A tuple of (response, duration in ms [float], error_msg)
+    """
+    (response, duration_ns, error_msg) = self.TimedRequestNs(type_string, record_string,
+                                                             timeout=timeout, rdataclass=rdataclass)
+    return (response, util.NanosecondsToMilliseconds(duration_ns), error_msg)
+
+  def TimedRequestNs(self, type_string, record_string, timeout=None, rdataclass=None,
+                     cache_template=True):
+    """Make a DNS Get, returning the reply and duration it took in nanoseconds.
+
+    Args:
+      type_string: DNS record type to query (string)
+      record_string: DNS record name to query (string)
+      timeout: optional timeout (float). Without one, the query waits for
+        self.timeout, and is resent after retransmit_timeout.
+      rdataclass: optional result class (defaults to rdataclass.IN)
+      cache_template: whether the query is likely to be sent again, so worth
+        caching in encoded form (see dns_wire.GetQueryTemplate).
+
+    Returns:
+      A tuple of (response, duration in nanoseconds [int], error_msg)
 
     In the case of a DNS response timeout, the response object will be None.
     """
     if not rdataclass:
       rdataclass = dns.rdataclass.IN
-    else:
-      rdataclass = dns.rdataclass.from_text(rdataclass)
-
-    request_type = dns.rdatatype.from_text(type_string)
-    record = dns.name.from_text(record_string, None)
-    request = None
     self.request_count += 1
 
     try:
-      request = self.CreateRequest(record, request_type, rdataclass)
-    except ValueError:
-      if not request:
-        return (None, 0, util.GetLastExceptionString())
+      request = dns_wire.GetQueryTemplate(record_string, type_string, rdataclass,
+                                          cache=cache_template).NewRequest()
+    except (ValueError, dns.exception.SyntaxError):
+      return (None, 0, util.GetLastExceptionString())
 
+    retransmit_timeout = None
     if not timeout:
       timeout = self.timeout
+      retransmit_timeout = self.retransmit_timeout
 
     error_msg = None
-    had_exception = False
-    duration = None
+    start_ns = time.monotonic_ns()
     try:
-      start_time = self.timer()
-      response = self.Query(request, timeout)
-      duration = self.timer() - start_time
-    except dns.exception.Timeout as exc:
-      had_exception = True
+      response = self.Query(request, timeout, retransmit_timeout=retransmit_timeout)
+    # Pass these exceptions up the food chain
+    except (KeyboardInterrupt, SystemExit, SystemError) as exc:
+      raise exc
+    except:
       response = None
-    except (dns.query.BadResponse, dns.message.TrailingJunk,
-            dns.query.UnexpectedSource) as exc:
-      had_exception = True
+      error_msg = self.ErrorMessageForLastException(type_string, record_string)
+    duration_ns = time.monotonic_ns() - start_ns
+    return self.FinishTimedRequest(response, duration_ns, error_msg)
+
+  def ErrorMessageForLastException(self, type_string, record_string):
+    """Turn the exception currently being handled into an error message.
+
+    Must be called from within an except block. Also keeps the per-server
+    error_map tally up to date.
+
+    Args:
+      type_string: DNS record type that was queried (string)
+      record_string: DNS record name that was queried (string)
+
+    Returns:
+      error message (string)
+    """
+    exc = sys.exc_info()[1]
+    error_msg = None
+    if isinstance(exc, dns.exception.Timeout):
+      pass
+    elif isinstance(exc, (dns.query.BadResponse, dns.message.TrailingJunk,
+                          dns.query.UnexpectedSource)):
       error_msg = util.GetLastExceptionString()
-      response = None
     # This is pretty normal if someone runs namebench offline.
-    except socket.error:
-      had_exception = True
-      response = None
+    elif isinstance(exc, socket.error):
       if ':' in self.ip:
         error_msg = 'socket error: IPv6 may not be available.'
       else:
         error_msg = util.GetLastExceptionString()
-    # Pass these exceptions up the food chain
-    except (KeyboardInterrupt, SystemExit, SystemError) as exc:
-      raise exc
-    except:
-      had_exception = True
+    else:
       error_msg = util.GetLastExceptionString()
       print("* Unusual error with %s:%s on %s: %s" % (type_string, record_string, self, error_msg))
-      response = None
 
-    if not response:
-      self.failure_count += 1
+    if not error_msg:
+      error_msg = '%s: %s' % (record_string, util.GetLastExceptionString())
 
-    if not duration:
-      duration = self.timer() - start_time
+    self._CountError(util.GetLastExceptionString())
+    return error_msg
 
-    if had_exception and not error_msg:
-      error_msg = '%s: %s' % (record_string, util.GetLastExceptionString())
+  def TimeoutErrorMessage(self, record_string):
+    """The error message for a query that got no reply in time.
 
-    if error_msg:
-      key = util.GetLastExceptionString()
-      self.error_map[key] = self.error_map.setdefault(key, 0) + 1
+    Matches what ErrorMessageForLastException() returns for a
+    dns.exception.Timeout, for callers that time queries out themselves.
+    """
+    error = 'Timeout %s' % dns.exception.Timeout()
+    self._CountError(error)
+    return '%s: %s' % (record_string, error)
+
+  def _CountError(self, error):
+    self.error_map[error] = self.error_map.setdefault(error, 0) + 1
+
+  def FinishTimedRequest(self, response, duration_ns, error_msg, send_lag_ns=0):
+    """Update failure counts and the RTT estimate for a raw query outcome.
+
+    If the transport timed the query itself (kernel timestamps), its duration
+    is used in place of the one measured by the caller.
 
-    if duration < 0:
+    Args:
+      response: DNS response object, or None
+      duration_ns: how long the request took, as measured by the caller (int nanoseconds)
+      error_msg: error message from ErrorMessageForLastException (or None)
+      send_lag_ns: how long after its intended send time the request went out
+        (open-loop mode). It is added to the duration, to correct for
+        coordinated omission.
+
+    Returns:
+      A tuple of (response, duration in nanoseconds [int], error_msg)
+
+    A reply that can not be decoded counts as a failure, with no response.
+    """
+    if isinstance(response, dns_wire.WireResponse) and response.CheckWire():
+      # It did arrive, so this says nothing about the retransmit timeout.
+      error_msg = response.parse_error
+      self._CountError(error_msg)
+      self.failure_count += 1
+      response = None
+    elif not response:
+      self.failure_count += 1
+      self.rtt.Backoff()
+    else:
+      if getattr(response, 'duration_ns', None) is not None:
+        duration_ns = response.duration_ns
+      # Karn's algorithm: the reply to a resent query may answer any copy of
+      # it, so it is no RTT sample, but the retransmit timeout was too short.
+      if getattr(response, 'send_count', 1) > 1:
+        self.rtt.Backoff()
+      else:
+        self.rtt.AddSample(duration_ns / 1000000000.0)
+
+    duration_ns += send_lag_ns
+    if duration_ns < 0:
       raise BrokenSystemClock('The time on your machine appears to be going backwards. '
                               'We cannot accurately benchmark due to this error. '
-                              '(timer=%s, duration=%s)' % (self.timer, duration))
-    return (response, util.SecondsToMilliseconds(duration), error_msg)
+                              '(duration_ns=%s)' % duration_ns)
+    return (response, int(duration_ns), error_msg)
 
   def GetVersion(self):
     version = ''
     (response, duration, _) = self.TimedRequest('TXT', 'version.bind.', rdataclass='CHAOS',
                                                         timeout=self.health_timeout)
-    if response and response.answer:
+    if response and response.answer_count:
       response_string = ResponseToAscii(response)
       version = response_string
 
     self._version = version
     return (self._version, duration)
 
-  def GetReverseIp(self, ip, retries_left=2):
-    """Request a hostname for a given IP address."""
-    try:
-      print("reverse: %s -> %s" % (ip, self))
-      answer = dns.resolver.query(dns.reversename.from_address(ip), 'PTR')
-    except dns.resolver.NXDOMAIN:
-      return ip
-    except:
-      if retries_left:
-        print("* Failed to get hostname for %s (retries left: %s): %s" % (ip, retries_left, util.GetLastExceptionString()))
-        return self.GetReverseIp(ip, retries_left=retries_left-1)
-      else:
-        return ip
+  def GetReverseIp(self, ip):
+    """Request a hostname for a given IP address (the IP if it has none).
 
-    if answer:
-      return answer[0].to_text().rstrip('.')
-    else:
-      return ip
+    See reverse_dns.LookupHostnames() to look up many at once.
+    """
+    return reverse_dns.LookupHostnames([ip], save=False)[ip]
 
   def GetTxtRecordWithDuration(self, record, retries_left=2):
     (response, duration, _) = self.TimedRequest('TXT', record, timeout=self.health_timeout)
-    if response and response.answer:
+    if response and response.answer_count:
       # In Python 3 / newer dnspython, items is not a list but needs to be accessed differently
       txt_items = list(response.answer[0].items)
       if txt_items:
@@ -529,7 +889,7 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
   def GetIpFromNameWithDuration(self, name):
     """Get an IP for a given name with a duration."""
     (response, duration, _) = self.TimedRequest('A', name, timeout=self.health_timeout)
-    if response and response.answer:
+    if response and response.answer_count:
       # In Python 3 / newer dnspython, items needs to be converted to list
       items = list(response.answer[0].items)
       if items:
@@ -557,9 +917,9 @@ class NameServer(health_checks.NameServerHealthChecks, provider_extensions.NameS
       (node, duration) = self.GetOpenDnsNodeWithDuration()
     else:
       (response, duration, _) = self.TimedRequest('TXT', 'hostname.bind.', rdataclass='CHAOS')
-      if not response or not response.answer:
+      if not response or not response.answer_count:
         (response, duration, _) = self.TimedRequest('TXT', 'id.server.', rdataclass='CHAOS')
-      if response and response.answer:
+      if response and response.answer_count:
         node = ResponseToAscii(response)
 
     return (node, duration)
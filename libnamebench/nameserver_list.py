@@ -18,6 +18,7 @@ __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 
 import datetime
 import operator
+import socket
 import queue
 import random
 import sys
@@ -25,10 +26,17 @@ import threading
 import time
 
 # 3rd party libraries
+import dns.exception
 import dns.resolver
 from . import conn_quality
 from . import addr_util
+from . import cache_sharing
+from . import dns_wire
+from . import geo_index
+from . import health_checks
 from . import nameserver
+from . import reverse_dns
+from . import transport
 from . import util
 
 NS_CACHE_SLACK = 2
@@ -41,6 +49,9 @@ TOO_DISTANT_MULTIPLIER = 4.75
 
 DEFAULT_MAX_SERVERS_TO_CHECK = 350
 
+# How often to update the status (in seconds) while results stream in.
+STATUS_INTERVAL = 0.5
+
 
 # If we can't ping more than this, go into slowmode.
 MIN_PINGABLE_PERCENT = 5
@@ -51,6 +62,15 @@ SLOW_MODE_THREAD_COUNT = 6
 DEFAULT_THREAD_COUNT = 35
 MAX_INITIAL_HEALTH_THREAD_COUNT = 35
 
+# Server states that NameServers keeps an index of (see _ServerStates).
+STATE_VIEWS = ('visible', 'enabled', 'disabled', 'enabled_keepers', 'enabled_supplemental',
+               'supplemental')
+
+# Availability checks for this many servers or more are sent from a single
+# socket (see SweepNameServers), at no more than PING_SWEEP_QPS.
+PING_SWEEP_MIN_SERVERS = 20
+PING_SWEEP_QPS = 1000
+
 class OutgoingUdpInterception(Exception):
 
   def __init__(self, value):
@@ -76,14 +96,21 @@ class ThreadFailure(Exception):
 
 
 class QueryThreads(threading.Thread):
-  """Quickly see which nameservers are awake."""
+  """Quickly see which nameservers are awake.
 
-  def __init__(self, input_queue, results_queue, action_type, checks=None):
+  action_type may also be a list of action types, which are run one after
+  another on each nameserver (until it is disabled), so that a server does not
+  have to wait for every other server to finish a check before it starts the
+  next one.
+  """
+
+  def __init__(self, input_queue, results_queue, action_type, checks=None, probe_hostname=None):
     threading.Thread.__init__(self)
     self.input = input_queue
     self.action_type = action_type
     self.results = results_queue
     self.checks = checks
+    self.probe_hostname = probe_hostname
     self.halt = False
 
   def stop(self):
@@ -110,33 +137,79 @@ class QueryThreads(threading.Thread):
         except queue.Empty:
           return
 
-        if ns.is_disabled:
-          self.results.put(None)
-          continue
-        if self.action_type == 'ping':
-          self.results.put(ns.CheckHealth(fast_check=True))
-        elif self.action_type == 'health':
-          self.results.put(ns.CheckHealth(sanity_checks=self.checks))
-        elif self.action_type == 'final':
-          self.results.put(ns.CheckHealth(sanity_checks=self.checks, final_check=True))
-        elif self.action_type == 'port_behavior':
-          self.results.put(ns.CheckHealth(sanity_checks=self.checks, port_check=True))
-        elif self.action_type == 'censorship':
-          self.results.put(ns.CheckCensorship(self.checks))
-        elif self.action_type == 'store_wildcards':
-          self.results.put(ns.StoreWildcardCache())
-        elif self.action_type == 'node_id':
-          self.results.put(ns.UpdateNodeIds())
-        elif self.action_type == 'update_hostname':
-          self.results.put(ns.UpdateHostname())
+        if isinstance(self.action_type, str):
+          action_types = [self.action_type]
         else:
-          raise ValueError('Invalid action type: %s' % self.action_type)
+          action_types = self.action_type
+        for action_type in action_types:
+          if ns.is_disabled:
+            self.results.put(None)
+          else:
+            self.results.put(self._RunAction(action_type, ns))
+
+  def _RunAction(self, action_type, ns):
+    """Run a single (non-wildcard_check) action on a nameserver."""
+    if action_type == 'ping':
+      return ns.CheckHealth(fast_check=True)
+    elif action_type == 'health':
+      return ns.CheckHealth(sanity_checks=self.checks)
+    elif action_type == 'final':
+      return ns.CheckHealth(sanity_checks=self.checks, final_check=True)
+    elif action_type == 'port_behavior':
+      return ns.CheckHealth(sanity_checks=self.checks, port_check=True)
+    elif action_type == 'censorship':
+      return ns.CheckCensorship(self.checks)
+    elif action_type == 'store_wildcards':
+      return ns.StoreWildcardCache()
+    elif action_type == 'wildcard_probe':
+      return ns.StoreWildcardProbe(self.probe_hostname)
+    elif action_type == 'node_id':
+      return ns.UpdateNodeIds()
+    elif action_type == 'update_hostname':
+      return ns.UpdateHostname()
+    else:
+      raise ValueError('Invalid action type: %s' % action_type)
+
+
+def _ServerStates(ns):
+  """Which of the STATE_VIEWS a nameserver belongs in (set)."""
+  states = set()
+  is_keeper = ns.is_keeper
+  if not is_keeper:
+    states.add('supplemental')
+  if not ns.is_hidden:
+    states.add('visible')
+    if ns.is_disabled:
+      states.add('disabled')
+    else:
+      states.add('enabled')
+      if is_keeper:
+        states.add('enabled_keepers')
+      else:
+        states.add('enabled_supplemental')
+  return states
 
 
 class NameServers(list):
+  """A list of unique nameservers, indexed by tag and state.
+
+  Servers are indexed as they are appended, and the indexes follow changes to
+  their tags (see nameserver.TagSet). Servers should only be added with
+  append() or extend(), and the list should not be reordered.
+  """
 
   def __init__(self, thread_count=DEFAULT_THREAD_COUNT, max_servers_to_check=DEFAULT_MAX_SERVERS_TO_CHECK):
-    self._ips = set()
+    self._by_ip = {}
+    self._positions = {}
+    # tag -> set of servers, and state (see STATE_VIEWS) -> set of servers
+    self._tag_index = {}
+    self._state_index = dict((x, set()) for x in STATE_VIEWS)
+    self._server_states = {}
+    # (tag or state) -> tuple of its servers in list order, until it changes
+    self._views = {}
+    # geo_index.GeoGrid of the servers with coordinates, built when first needed
+    self._geo_grid = None
+    self._index_lock = threading.RLock()
     self.thread_count = thread_count
     super(NameServers, self).__init__()
 
@@ -146,30 +219,72 @@ class NameServers(list):
     self.client_domain = None
     self.client_asn = None
     self.max_servers_to_check = max_servers_to_check
+    # Called with each query thread result as it arrives (see _LaunchQueryThreads)
+    self.on_result = None
+
+  def __reduce__(self):
+    """Pickle the settings and the servers, but not the indexes or callbacks.
+
+    The servers are appended again on unpickle, which rebuilds the indexes
+    and registers this list as an observer of their tags.
+    """
+    state = dict((k, v) for (k, v) in self.__dict__.items()
+                 if not k.startswith('_') and k not in ('status_callback', 'on_result'))
+    return (self.__class__, (), state, iter(self))
+
+  def _View(self, key, members):
+    """The servers in an index as a tuple, in list order (cached until it changes)."""
+    with self._index_lock:
+      view = self._views.get(key)
+      if view is None:
+        view = tuple(sorted(members, key=self._positions.__getitem__))
+        self._views[key] = view
+      return view
+
+  def _IndexServer(self, ns, added, removed):
+    """Update the indexes for a server whose tags changed (a TagSet observer)."""
+    with self._index_lock:
+      if ns not in self._positions:
+        return
+      for tag in added:
+        self._tag_index.setdefault(tag, set()).add(ns)
+        self._views.pop(('tag', tag), None)
+      for tag in removed:
+        self._tag_index.get(tag, set()).discard(ns)
+        self._views.pop(('tag', tag), None)
+      old_states = self._server_states.get(ns, set())
+      new_states = _ServerStates(ns)
+      for state in old_states ^ new_states:
+        if state in new_states:
+          self._state_index[state].add(ns)
+        else:
+          self._state_index[state].discard(ns)
+        self._views.pop(('state', state), None)
+      self._server_states[ns] = new_states
 
   @property
   def visible_servers(self):
-    return [x for x in self if not x.is_hidden]
+    return self._View(('state', 'visible'), self._state_index['visible'])
 
   @property
   def enabled_servers(self):
-    return [x for x in self.visible_servers if not x.is_disabled]
+    return self._View(('state', 'enabled'), self._state_index['enabled'])
 
   @property
   def disabled_servers(self):
-    return [x for x in self.visible_servers if x.is_disabled]
+    return self._View(('state', 'disabled'), self._state_index['disabled'])
 
   @property
   def enabled_keepers(self):
-    return [x for x in self.enabled_servers if x.is_keeper]
+    return self._View(('state', 'enabled_keepers'), self._state_index['enabled_keepers'])
 
   @property
   def enabled_supplemental(self):
-    return [x for x in self.enabled_servers if not x.is_keeper]
+    return self._View(('state', 'enabled_supplemental'), self._state_index['enabled_supplemental'])
 
   @property
   def supplemental_servers(self):
-    return [x for x in self if not x.is_keeper]
+    return self._View(('state', 'supplemental'), self._state_index['supplemental'])
 
   @property
   def country_servers(self):
@@ -177,11 +292,11 @@ class NameServers(list):
 
   # Return a list of servers that match a particular tag
   def HasTag(self, tag):
-    return [x for x in self if x.HasTag(tag)]
+    return self._View(('tag', tag), self._tag_index.get(tag, ()))
 
   # Return a list of servers that match a particular tag
   def HasVisibleTag(self, tag):
-    return [x for x in self.visible_servers if x.HasTag(tag)]
+    return [x for x in self.HasTag(tag) if not x.is_hidden]
 
   def SortEnabledByFastest(self):
     """Return a list of healthy servers in fastest-first order."""
@@ -198,7 +313,7 @@ class NameServers(list):
       print('%s [%s/%s]' % (msg, count, total))
 
   def _GetObjectForIP(self, ip):
-    return [x for x in self if x.ip == ip][0]
+    return self._by_ip[ip]
 
   def _MergeNameServerData(self, ns):
     existing = self._GetObjectForIP(ns.ip)
@@ -210,13 +325,31 @@ class NameServers(list):
 
   def append(self, ns):
     """Add a nameserver to the list, guaranteeing uniqueness."""
-    if ns.ip in self._ips:
+    if ns.ip in self._by_ip:
       self._MergeNameServerData(ns)
     else:
-      super(NameServers, self).append(ns)
-      self._ips.add(ns.ip)
+      with self._index_lock:
+        self._positions[ns] = len(self)
+        super(NameServers, self).append(ns)
+        self._by_ip[ns.ip] = ns
+        self._geo_grid = None
+        ns.tags.AddObserver(self._IndexServer)
+        self._IndexServer(ns, set(ns.tags), set())
 
-  def SetTimeouts(self, timeout, ping_timeout, health_timeout):
+  def extend(self, servers):
+    for ns in servers:
+      self.append(ns)
+
+  def SetTimeouts(self, timeout, ping_timeout, health_timeout, adaptive_timeouts=True):
+    """Set timeouts (in seconds) for all nameservers.
+
+    Args:
+      timeout: benchmark query timeout
+      ping_timeout: ping timeout
+      health_timeout: health check timeout
+      adaptive_timeouts: resend benchmark queries after a timeout derived from
+        each server's RTT, while still waiting for up to timeout
+    """
     if len(self.enabled_servers) > 1:
       cq = conn_quality.ConnectionQuality(status_callback=self.status_callback)
       (intercepted, avg_latency, max_latency) = cq.CheckConnectionQuality()[0:3]
@@ -240,6 +373,7 @@ class NameServers(list):
       ns.timeout = timeout
       ns.ping_timeout = ping_timeout
       ns.health_timeout = health_timeout
+      ns.adaptive_timeouts = adaptive_timeouts
 
   def SetClientLocation(self, latitude, longitude, client_country):
     self.client_latitude = latitude
@@ -270,14 +404,68 @@ class NameServers(list):
       self.msg("%s of %s nameservers have tags: %s" %
                (len(self.visible_servers), len(self), ', '.join(include_tags)))
 
-  def HasEnoughInCountryServers():
+  def RestoreServerSet(self, servers):
+    """Enable exactly the given servers, adding any that are not in the list.
+
+    Args:
+      servers: list of (ip, name) tuples
+    """
+    for (ip, name) in servers:
+      if ip not in self._by_ip:
+        self.append(nameserver.NameServer(ip, name=name))
+    wanted = set([ip for (ip, unused_name) in servers])
+    for ns in self:
+      if ns.ip in wanted:
+        ns.tags.discard('disabled')
+        ns.tags.discard('hidden')
+      elif not ns.is_hidden:
+        ns.tags.add('hidden')
+    self.msg('Restored %s nameservers from the checkpoint' % len(self.enabled_servers))
+
+  def RestoreCachedHealth(self, cache, client_network):
+    """Restore health check outcomes from a health_cache.HealthCache.
+
+    If every visible server has a cached outcome, all of it is restored and
+    no health checks are needed. Otherwise only servers that were disabled
+    are restored (so they are not checked again), and the rest need checking.
+
+    Returns:
+      True if every visible server was restored.
+    """
+    servers = self.visible_servers
+    states = dict((ns, cache.Get(ns, client_network)) for ns in servers)
+    complete = bool(servers) and None not in states.values()
+    restored = [ns for ns in servers if states[ns] and (complete or states[ns]['disabled_msg'])]
+    by_ip = dict((ns.ip, ns) for ns in self)
+    for ns in restored:
+      ns.RestoreHealthState(states[ns], restore_hidden=complete)
+      ns.shared_with = set([by_ip[x] for x in states[ns]['shared_with'] if x in by_ip])
+    if restored:
+      self.msg('Restored cached health checks for %s of %s servers' % (len(restored), len(servers)))
+    return complete
+
+  def HasEnoughInCountryServers(self):
     return len(self.country_servers) > self.max_servers_to_check
 
+  def _GeoGrid(self):
+    """The geo_index.GeoGrid of servers with coordinates (built once per server list)."""
+    with self._index_lock:
+      if not self._geo_grid:
+        grid = geo_index.GeoGrid()
+        for ns in self:
+          try:
+            grid.Add(ns, float(ns.latitude), float(ns.longitude))
+          except (TypeError, ValueError):
+            continue
+        self._geo_grid = grid
+      return self._geo_grid
+
   def NearbyServers(self, max_distance):
-    srv_by_dist = sorted([(x.DistanceFromCoordinates(self.client_latitude, self.client_longitude), x)
-                          for x in self.HasVisibleTag('regional')], key=operator.itemgetter(0))
-    for distance, ns in srv_by_dist:
-      if distance < float(max_distance):
+    """Yield the visible regional servers within max_distance (km) of the client, nearest first."""
+    found = self._GeoGrid().Within(float(self.client_latitude), float(self.client_longitude),
+                                   float(max_distance))
+    for (distance, ns) in found:
+      if 'regional' in ns.tags and not ns.is_hidden:
         yield ns
 
   def AddNetworkTags(self):
@@ -287,8 +475,11 @@ class NameServers(list):
     else:
       provider = None
 
+    self.UpdateHostnames(self)
+    domains = addr_util.GetDomainsFromHostnames([x.hostname for x in self if x.hostname])
     for ns in self:
-      ns.AddNetworkTags(self.client_domain, provider, self.client_asn, self.client_country)
+      ns.AddNetworkTags(self.client_domain, provider, self.client_asn, self.client_country,
+                        hostname_domain=domains.get(ns.hostname))
 
 
   def AddLocalityTags(self, max_distance):
@@ -352,7 +543,7 @@ class NameServers(list):
     # - Half of them should be the "nearest" nameservers
     # - Half of them should be the "fastest average" nameservers
     self.msg("Hiding all but %s servers" % target_count)
-    keepers = self.enabled_keepers
+    keepers = list(self.enabled_keepers)
     isp_keeper = self._FastestByLocalProvider()
     if isp_keeper:
       self.msg("%s is the fastest DNS server provided by your ISP." % isp_keeper)
@@ -398,22 +589,30 @@ class NameServers(list):
       self._DemoteSecondaryGlobalNameServers()
       self.HideSlowSupplementalServers(int(max_servers * NS_CACHE_SLACK))
 
+    # Some node id checks depend on the hostname.
+    self.UpdateHostnames()
+
+    # From here on, each server moves through a chain of checks at its own
+    # pace. We only wait for every server where a decision needs all of them.
     if len(self.enabled_servers) > 1:
-      self.RunNodeIdThreads()
-      self.CheckCacheCollusion()
-      self.RunNodeIdThreads()
+      self.RunPipelineThreads(['node_id', 'store_wildcards', 'wildcard_probe'], 'Checking node ids',
+                              probe_hostname=cache_sharing.NewProbeHostname())
+      self.CheckCacheCollusion(store_wildcards=False)
       self.HideSlowSupplementalServers(max_servers)
 
-    self.RunFinalHealthCheckThreads(sanity_checks['secondary'])
-    self.RunNodeIdThreads()
+    # Node ids were updated in the first chain, so only the final checks can
+    # change them. Disabled servers skip the rest of their chain, so hiding
+    # broken IPv6 servers can wait until the end.
+    chain = ['final', 'node_id']
+    if len(self.enabled_servers) > 1:
+      chain.extend(['store_wildcards', 'wildcard_probe'])
+    self.RunPipelineThreads(chain, 'Running final health checks', checks=sanity_checks['secondary'],
+                            probe_hostname=cache_sharing.NewProbeHostname())
     self.HideBrokenIPV6Servers()
 
     # One more time!
     if len(self.enabled_servers) > 1:
-      self.RunNodeIdThreads()
-      self.CheckCacheCollusion()
-
-    self.RunHostnameThreads()
+      self.CheckCacheCollusion(store_wildcards=False)
 
     if not self.enabled_servers:
       raise TooFewNameservers('None of the nameservers tested are healthy')
@@ -458,20 +657,27 @@ class NameServers(list):
     """Reset the testng status of all disabled hosts."""
     return [ns.ResetTestStatus() for ns in self]
 
-  def CheckCacheCollusion(self):
-    """Mark if any nameservers share cache, especially if they are slower."""
-    self.RunWildcardStoreThreads()
+  def CheckCacheCollusion(self, store_wildcards=True):
+    """Mark if any nameservers share cache, especially if they are slower.
+
+    Args:
+      store_wildcards: whether to store wildcard cache values first (False if
+        that has already been done, e.g. by RunPipelineThreads).
+    """
+    if store_wildcards:
+      self.RunWildcardStoreThreads()
+
+    good_nameservers = [x for x in self.SortEnabledByFastest()]
+    test_combos = cache_sharing.CandidatePairs(good_nameservers)
+    pair_count = len(good_nameservers) * (len(good_nameservers) - 1)
+    self.msg('%s of %s server pairs may share a cache' % (len(test_combos), pair_count))
+    if not test_combos:
+      return
+
     sleepy_time = 4
     self.msg("Waiting %ss for TTL's to decrement." % sleepy_time)
     time.sleep(sleepy_time)
 
-    test_combos = []
-    good_nameservers = [x for x in self.SortEnabledByFastest()]
-    for ns in good_nameservers:
-      for compare_ns in good_nameservers:
-        if ns != compare_ns:
-          test_combos.append((compare_ns, ns))
-
     results = self.RunCacheCollusionThreads(test_combos)
     while not results.empty():
       (ns, shared_ns) = results.get()
@@ -501,14 +707,17 @@ class NameServers(list):
           faster.warnings.add('Replica of %s [%s]' % (slower.name, slower.ip))
 
   def _LaunchQueryThreads(self, action_type, status_message, items,
-                          thread_count=None, **kwargs):
+                          thread_count=None, on_result=None, **kwargs):
     """Launch query threads for a given action type.
 
     Args:
-      action_type: a string describing an action type to pass
+      action_type: a string describing an action type to pass (or a list of
+        them, to run one after the other on each item)
       status_message: Status to show during updates.
       items: A list of items to pass to the queue
       thread_count: How many threads to use (int)
+      on_result: optional function, called (from this thread) with each result
+        as soon as it arrives. Defaults to self.on_result.
       kwargs: Arguments to pass to QueryThreads()
 
     Returns:
@@ -520,11 +729,18 @@ class NameServers(list):
     threads = []
     input_queue = queue.Queue()
     results_queue = queue.Queue()
+    finished_queue = queue.Queue()
+    on_result = on_result or self.on_result
 
     # items are usually nameservers
+    items = list(items)
     random.shuffle(items)
     for item in items:
       input_queue.put(item)
+    if isinstance(action_type, str):
+      result_count = len(items)
+    else:
+      result_count = len(items) * len(action_type)
 
     if not thread_count:
       thread_count = self.thread_count
@@ -533,7 +749,7 @@ class NameServers(list):
 
     status_message += ' (%s threads)' % thread_count
 
-    self.msg(status_message, count=0, total=len(items))
+    self.msg(status_message, count=0, total=result_count)
     for _ in range(0, thread_count):
       thread = QueryThreads(input_queue, results_queue, action_type, **kwargs)
       try:
@@ -546,18 +762,32 @@ class NameServers(list):
         raise ThreadFailure()
       threads.append(thread)
 
-    while results_queue.qsize() != len(items):
-      self.msg(status_message, count=results_queue.qsize(), total=len(items))
-      time.sleep(0.5)
-
-    self.msg(status_message, count=results_queue.qsize(), total=len(items))
+    last_update = time.time()
+    while finished_queue.qsize() != result_count:
+      try:
+        result = results_queue.get(timeout=STATUS_INTERVAL)
+      except queue.Empty:
+        # Only give up if every thread has died without answering.
+        if not [x for x in threads if x.is_alive()] and results_queue.empty():
+          break
+      else:
+        finished_queue.put(result)
+        if on_result:
+          on_result(result)
+      # Also refresh the status while waiting, so that a slow check does not
+      # leave the last burst of results unreported.
+      if time.time() - last_update >= STATUS_INTERVAL:
+        last_update = time.time()
+        self.msg(status_message, count=finished_queue.qsize(), total=result_count)
+
+    self.msg(status_message, count=finished_queue.qsize(), total=result_count)
     for thread in threads:
       thread.join()
 
     if not self.enabled_servers:
       raise TooFewNameservers('None of the %s nameservers tested are healthy' % len(self.visible_servers))
 
-    return results_queue
+    return finished_queue
 
   def RunCacheCollusionThreads(self, test_combos):
     """Schedule and manage threading for cache collusion checks."""
@@ -567,8 +797,21 @@ class NameServers(list):
     """Quickly ping nameservers to see which are available."""
     start = datetime.datetime.now()
     test_servers = list(self.enabled_servers)
+    results = None
+    if len(test_servers) >= PING_SWEEP_MIN_SERVERS:
+      try:
+        results = self.SweepNameServers(test_servers)
+      except (KeyboardInterrupt, SystemExit):
+        raise
+      except:
+        self.msg('Ping sweep failed (%s), checking with threads instead.' % util.GetLastExceptionString())
+        # Start over: the sweep may already have disabled (and hidden) some.
+        for ns in test_servers:
+          ns.ResetTestStatus()
+          ns.tags.discard('hidden')
     try:
-      results = self._LaunchQueryThreads('ping', 'Checking nameserver availability', test_servers)
+      if results is None:
+        results = self._LaunchQueryThreads('ping', 'Checking nameserver availability', test_servers)
     except ThreadFailure:
       self.msg("It looks like you couldn't handle %s threads, trying again with %s (slow)" % (self.thread_count, SLOW_MODE_THREAD_COUNT))
       self.thread_count = SLOW_MODE_THREAD_COUNT
@@ -588,6 +831,69 @@ class NameServers(list):
     return results
 
 
+  def SweepNameServers(self, servers, qps=PING_SWEEP_QPS):
+    """Run the availability (ping) check on many nameservers from one socket.
+
+    Rather than a thread per outstanding query, every request is sent from a
+    single non-blocking socket, paced at qps, and the replies are collected as
+    they arrive. A server that has not answered once its health_timeout has
+    passed is marked as failing the check, as CheckHealth(fast_check=True)
+    would.
+
+    Args:
+      servers: list of nameservers to check
+      qps: how many requests to send per second (int)
+
+    Returns:
+      list of [ns, is_disabled] pairs, in the order the servers were given.
+    """
+    sweep = transport.UdpTransport(sockets_per_family=1, kernel_timestamps=True)
+    interval_ns = int(1000000000 / qps)
+    sent = []
+    self.msg('Checking nameserver availability', count=0, total=len(servers))
+    try:
+      next_send_ns = time.monotonic_ns()
+      for ns in servers:
+        delay_ns = next_send_ns - time.monotonic_ns()
+        if delay_ns > 0:
+          time.sleep(delay_ns / 1000000000.0)
+        next_send_ns += interval_ns
+        request = dns_wire.GetQueryTemplate(health_checks.ROOT_SERVER_RECORD, 'A').NewRequest()
+        ns.request_count += 1
+        start_ns = time.monotonic_ns()
+        try:
+          pending = sweep.Send(request.to_wire(), ns.ip, port=ns.port)
+        except socket.error:
+          error_msg = ns.ErrorMessageForLastException('A', health_checks.ROOT_SERVER_RECORD)
+          pending = None
+        else:
+          error_msg = None
+        sent.append((ns, request, pending, start_ns, error_msg))
+
+      results = []
+      for (ns, request, pending, start_ns, error_msg) in sent:
+        response = None
+        if pending:
+          remaining = (start_ns - time.monotonic_ns()) / 1000000000.0 + ns.health_timeout
+          if pending.event.wait(max(remaining, 0)):
+            response = dns_wire.WireResponse(pending.reply, duration_ns=pending.duration_ns)
+            request.id = response.id
+            if not request.is_response(response):
+              response = None
+              error_msg = 'Reply from %s does not answer our request' % ns.ip
+          else:
+            sweep.Cancel(pending)
+            error_msg = ns.TimeoutErrorMessage(health_checks.ROOT_SERVER_RECORD)
+        # The transport timed replies itself, this is only used for failures.
+        duration_ns = time.monotonic_ns() - start_ns
+        (response, duration_ns, error_msg) = ns.FinishTimedRequest(response, duration_ns, error_msg)
+        duration = util.NanosecondsToMilliseconds(duration_ns)
+        results.append([ns, ns.CheckPingResponse(response, duration, error_msg)])
+        self.msg('Checking nameserver availability', count=len(results), total=len(servers))
+    finally:
+      sweep.Close()
+    return results
+
   def GetHealthyPercentage(self, compare_to=None):
     if not compare_to:
       compare_to = self.visible_servers
@@ -626,15 +932,45 @@ class NameServers(list):
              (len(self.enabled_servers), len(test_servers)))
     return results
 
+  def RunPipelineThreads(self, action_types, status_msg, checks=None, probe_hostname=None):
+    """Run a chain of checks on each enabled server, without waiting between them.
+
+    Args:
+      action_types: list of QueryThreads action types, in order
+      status_msg: what to call the chain in status updates
+      checks: sanity checks for the health check actions
+      probe_hostname: hostname for the wildcard_probe action
+
+    Returns:
+      results_queue: Results from each action.
+    """
+    status_msg = '%s on %s servers (%s)' % (status_msg, len(self.enabled_servers), ', '.join(action_types))
+    return self._LaunchQueryThreads(action_types, status_msg, list(self.enabled_servers), checks=checks,
+                                    probe_hostname=probe_hostname)
+
   def RunNodeIdThreads(self):
     """Update node id status on all servers."""
     status_msg = 'Checking node ids on %s servers' % len(self.enabled_servers)
     return self._LaunchQueryThreads('node_id', status_msg, list(self.enabled_servers))
 
-  def RunHostnameThreads(self):
-    """Update node id status on all servers."""
-    status_msg = 'Updating hostnames on %s servers' % len(self.enabled_servers)
-    return self._LaunchQueryThreads('update_hostname', status_msg, list(self.enabled_servers))
+  def UpdateHostnames(self, servers=None):
+    """Look up the hostnames of many servers at once (see reverse_dns).
+
+    Only servers without a hostname are looked up, so that the ones from the
+    server list are kept.
+
+    Args:
+      servers: nameservers to update (defaults to the enabled servers)
+    """
+    if servers is None:
+      servers = self.enabled_servers
+    servers = [x for x in servers if not x.has_hostname and not x.is_disabled]
+    if not servers:
+      return
+    self.msg('Updating hostnames on %s servers' % len(servers))
+    hostnames = reverse_dns.LookupHostnames([x.ip for x in servers])
+    for ns in servers:
+      ns.hostname = hostnames[ns.ip]
 
   def RunFinalHealthCheckThreads(self, checks):
     """Quickly ping nameservers to see which are healthy."""
@@ -652,7 +988,8 @@ class NameServers(list):
     return self._LaunchQueryThreads('port_behavior', status_msg, list(self.enabled_servers))
 
   def RunWildcardStoreThreads(self):
-    """Store a wildcard cache value for all nameservers (using threads)."""
+    """Store a wildcard cache value (and probe) for all nameservers (using threads)."""
     status_msg = 'Waiting for wildcard cache queries from %s servers' % len(self.enabled_servers)
-    return self._LaunchQueryThreads('store_wildcards', status_msg, list(self.enabled_servers))
+    return self._LaunchQueryThreads(['store_wildcards', 'wildcard_probe'], status_msg, list(self.enabled_servers),
+                                    probe_hostname=cache_sharing.NewProbeHostname())
 
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the nameserver_list module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import queue
+import random
+import threading
+import time
+import unittest
+
+from . import mocks
+from . import nameserver
+from . import nameserver_list
+
+
+class NameServersTest(unittest.TestCase):
+  def setUp(self):
+    self.nameservers = nameserver_list.NameServers()
+    for i in range(1, 60):
+      tags = []
+      if i % 7 == 0:
+        tags.append('preferred')
+      self.nameservers.append(nameserver.NameServer('192.0.2.%s' % i, tags=tags))
+
+  def assertIndexesMatch(self):
+    servers = list(self.nameservers)
+    self.assertEqual(list(self.nameservers.visible_servers), [x for x in servers if not x.is_hidden])
+    self.assertEqual(list(self.nameservers.enabled_servers),
+                     [x for x in servers if not x.is_hidden and not x.is_disabled])
+    self.assertEqual(list(self.nameservers.disabled_servers),
+                     [x for x in servers if not x.is_hidden and x.is_disabled])
+    self.assertEqual(list(self.nameservers.enabled_keepers),
+                     [x for x in servers if not x.is_hidden and not x.is_disabled and x.is_keeper])
+    self.assertEqual(list(self.nameservers.enabled_supplemental),
+                     [x for x in servers if not x.is_hidden and not x.is_disabled and not x.is_keeper])
+    self.assertEqual(list(self.nameservers.supplemental_servers), [x for x in servers if not x.is_keeper])
+    for tag in ('preferred', 'hidden', 'ipv4', 'nearby'):
+      self.assertEqual(list(self.nameservers.HasTag(tag)), [x for x in servers if x.HasTag(tag)])
+
+  def testIndexesFollowTags(self):
+    self.assertIndexesMatch()
+    rand = random.Random(1)
+    servers = list(self.nameservers)
+    for _ in range(300):
+      ns = rand.choice(servers)
+      action = rand.randint(0, 4)
+      if action == 0:
+        ns.tags.add(rand.choice(['hidden', 'nearby', 'system']))
+      elif action == 1:
+        ns.tags.discard(rand.choice(['hidden', 'disabled', 'nearby', 'system']))
+      elif action == 2:
+        ns.DisableWithMessage('broken')
+      elif action == 3:
+        ns.ResetTestStatus()
+      else:
+        ns.tags = ['ipv4', rand.choice(['nearby', 'preferred'])]
+      self.assertIndexesMatch()
+
+  def testHideSlowSupplementalServers(self):
+    nameservers = nameserver_list.NameServers()
+    nameservers.status_callback = lambda *args, **kwargs: None
+    for i in range(1, 6):
+      tags = []
+      if i == 1:
+        tags.append('preferred')
+      elif i == 2:
+        tags.append('isp')
+      nameservers.append(nameserver.NameServer('192.0.2.%s' % i, tags=tags))
+    nameservers.HideSlowSupplementalServers(3)
+    visible = [x.ip for x in nameservers.visible_servers]
+    self.assertTrue('192.0.2.1' in visible and '192.0.2.2' in visible)
+    self.assertFalse('192.0.2.5' in visible)
+    # The view handed out before hiding was not changed in place.
+    self.assertEqual(len(nameservers.enabled_keepers), 1)
+
+  def testUpdateHostnamesKeepsListedOnes(self):
+    listed = nameserver.NameServer('192.0.2.101', hostname='ns1.example.net')
+    unknown = nameserver.NameServer('192.0.2.102')
+    broken = nameserver.NameServer('192.0.2.103')
+    broken.DisableWithMessage('broken')
+    looked_up = []
+    self.nameservers.status_callback = lambda *args, **kwargs: None
+
+    def _LookupHostnames(ips):
+      looked_up.extend(ips)
+      return dict((ip, 'ptr-%s.example.com' % ip) for ip in ips)
+
+    saved_lookup = nameserver_list.reverse_dns.LookupHostnames
+    nameserver_list.reverse_dns.LookupHostnames = _LookupHostnames
+    try:
+      self.nameservers.UpdateHostnames([listed, unknown, broken])
+    finally:
+      nameserver_list.reverse_dns.LookupHostnames = saved_lookup
+    self.assertEqual(looked_up, ['192.0.2.102'])
+    self.assertEqual(listed.hostname, 'ns1.example.net')
+    self.assertEqual(unknown.hostname, 'ptr-192.0.2.102.example.com')
+
+  def testAppendMerges(self):
+    self.nameservers.append(nameserver.NameServer('192.0.2.1', tags=['nearby']))
+    self.assertEqual(len(self.nameservers), 59)
+    self.assertEqual([x.ip for x in self.nameservers.HasTag('nearby')], ['192.0.2.1'])
+
+
+class StubQueryThreads(threading.Thread):
+  """Stands in for nameserver_list.QueryThreads.
+
+  Answers each item with (item, action) for each action, sleeping for the
+  next entry of delays first. A thread with answer=False dies without answering.
+  """
+
+  delays = []
+  answer = True
+
+  def __init__(self, input_queue, results_queue, action_type, **unused_kwargs):
+    threading.Thread.__init__(self)
+    self.input = input_queue
+    self.results = results_queue
+    self.action_type = action_type
+
+  def stop(self):
+    pass
+
+  def run(self):
+    delays = list(self.delays)
+    while not self.input.empty() and self.answer:
+      item = self.input.get_nowait()
+      if isinstance(self.action_type, str):
+        actions = [self.action_type]
+      else:
+        actions = self.action_type
+      for action in actions:
+        if delays:
+          time.sleep(delays.pop(0))
+        self.results.put((item, action))
+
+
+class QueryThreadsLoopTest(unittest.TestCase):
+  def setUp(self):
+    self.saved_threads = nameserver_list.QueryThreads
+    self.saved_interval = nameserver_list.STATUS_INTERVAL
+    nameserver_list.QueryThreads = StubQueryThreads
+    nameserver_list.STATUS_INTERVAL = 0.05
+    StubQueryThreads.delays = []
+    StubQueryThreads.answer = True
+    self.counts = []
+    self.nameservers = nameserver_list.NameServers()
+    self.nameservers.status_callback = self._Status
+    for i in range(1, 4):
+      self.nameservers.append(nameserver.NameServer('192.0.2.%s' % i))
+
+  def tearDown(self):
+    nameserver_list.QueryThreads = self.saved_threads
+    nameserver_list.STATUS_INTERVAL = self.saved_interval
+
+  def _Status(self, unused_msg, count=None, total=None, **unused_kwargs):
+    self.counts.append((count, total))
+
+  def testStatusWhileWaiting(self):
+    # The first result arrives at once, and the rest only after a pause.
+    StubQueryThreads.delays = [0, 0.4]
+    finished = self.nameservers._LaunchQueryThreads('ping', 'Checking', self.nameservers,
+                                                    thread_count=1)
+    self.assertEqual(finished.qsize(), 3)
+    self.assertEqual(self.counts[0], (0, 3))
+    self.assertEqual(self.counts[-1], (3, 3))
+    # The count is refreshed during the pause, rather than only once the
+    # next result arrives.
+    self.assertTrue(self.counts.count((1, 3)) >= 2)
+
+  def testOnResult(self):
+    StubQueryThreads.delays = [0, 0.4]
+    seen = []
+    finished = self.nameservers._LaunchQueryThreads(
+        'ping', 'Checking', self.nameservers, thread_count=1,
+        on_result=lambda result: seen.append((time.time(), result)))
+    returned = time.time()
+    self.assertEqual(sorted(x[1][0].ip for x in seen), sorted(x.ip for x in self.nameservers))
+    self.assertEqual(finished.qsize(), 3)
+    # The first result is handed on straight away, not after the pause.
+    self.assertTrue(returned - seen[0][0] >= 0.3)
+
+  def testActionList(self):
+    finished = self.nameservers._LaunchQueryThreads(['ping', 'final'], 'Checking',
+                                                    self.nameservers, thread_count=2)
+    self.assertEqual(finished.qsize(), 6)
+    self.assertEqual(self.counts[-1], (6, 6))
+
+  def testDeadThreads(self):
+    StubQueryThreads.answer = False
+    started = time.time()
+    finished = self.nameservers._LaunchQueryThreads('ping', 'Checking', self.nameservers,
+                                                    thread_count=2)
+    self.assertEqual(finished.qsize(), 0)
+    self.assertTrue(time.time() - started < 1)
+
+
+class RecordingServer(object):
+  """Records which checks QueryThreads runs on it, and fails one on request."""
+
+  def __init__(self, name, fail_on=None):
+    self.name = name
+    self.fail_on = fail_on
+    self.is_disabled = False
+    self.calls = []
+
+  def _Record(self, action_type):
+    self.calls.append(action_type)
+    if action_type == self.fail_on:
+      self.is_disabled = True
+    return (self, action_type)
+
+  def CheckHealth(self, sanity_checks=None, final_check=False, **unused_kwargs):
+    return self._Record(final_check and 'final' or 'health')
+
+  def UpdateNodeIds(self):
+    return self._Record('node_id')
+
+  def StoreWildcardCache(self):
+    return self._Record('store_wildcards')
+
+  def StoreWildcardProbe(self, unused_hostname):
+    return self._Record('wildcard_probe')
+
+
+class PipelineTest(unittest.TestCase):
+  def _RunChain(self, servers, action_types):
+    input_queue = queue.Queue()
+    results_queue = queue.Queue()
+    for ns in servers:
+      input_queue.put(ns)
+    thread = nameserver_list.QueryThreads(input_queue, results_queue, action_types)
+    thread.run()
+    return [results_queue.get_nowait() for _ in range(results_queue.qsize())]
+
+  def testCheckOrder(self):
+    servers = [RecordingServer('a'), RecordingServer('b')]
+    chain = ['final', 'node_id', 'store_wildcards', 'wildcard_probe']
+    results = self._RunChain(servers, chain)
+    self.assertEqual(len(results), 8)
+    for ns in servers:
+      self.assertEqual(ns.calls, chain)
+
+  def testFailureStopsChain(self):
+    broken = RecordingServer('broken', fail_on='final')
+    healthy = RecordingServer('healthy')
+    results = self._RunChain([broken, healthy], ['final', 'node_id', 'store_wildcards'])
+    self.assertEqual(broken.calls, ['final'])
+    self.assertEqual(healthy.calls, ['final', 'node_id', 'store_wildcards'])
+    # The skipped checks still answer, so the caller's count adds up.
+    self.assertEqual(len(results), 6)
+    self.assertEqual(results.count(None), 2)
+
+  def testHealthChains(self):
+    chains = []
+
+    class ChainRecorder(nameserver_list.NameServers):
+      def RunPipelineThreads(self, action_types, status_msg, **unused_kwargs):
+        chains.append(list(action_types))
+
+    nameservers = ChainRecorder()
+    for i in range(1, 4):
+      nameservers.append(nameserver.NameServer('192.0.2.%s' % i))
+    for name in ('PingNameServers', 'RunHealthCheckThreads', 'UpdateHostnames', 'CheckCacheCollusion',
+                 'HideSlowSupplementalServers', 'HideBrokenIPV6Servers'):
+      setattr(nameservers, name, lambda *args, **kwargs: None)
+    nameservers.CheckHealth(sanity_checks={'primary': [], 'secondary': []})
+    self.assertEqual(chains, [['node_id', 'store_wildcards', 'wildcard_probe'],
+                              ['final', 'node_id', 'store_wildcards', 'wildcard_probe']])
+    for chain in chains:
+      self.assertEqual(len(chain), len(set(chain)))
+
+
+class SweepTest(unittest.TestCase):
+  """Availability checks against DNS servers on a loopback address."""
+
+  def setUp(self):
+    self.servers = [mocks.LoopbackDnsServer()]
+    try:
+      self.servers.append(mocks.LoopbackDnsServer(ip='127.0.0.7', drop_count=1000000))
+    except OSError:
+      self.tearDown()
+      raise unittest.SkipTest('Needs 127.0.0.0/8 to be routed to loopback')
+    self.nameservers = nameserver_list.NameServers()
+    self.nameservers.status_callback = lambda *args, **kwargs: None
+    self.healthy = self.servers[0].NameServer()
+    self.silent = self.servers[1].NameServer()
+    for ns in (self.healthy, self.silent):
+      ns.health_timeout = 0.3
+
+  def tearDown(self):
+    for server in self.servers:
+      server.Close()
+
+  def testSweep(self):
+    started = time.time()
+    results = self.nameservers.SweepNameServers([self.healthy, self.silent])
+    self.assertEqual(results, [[self.healthy, False], [self.silent, True]])
+    # The silent server is given up on after its health_timeout.
+    self.assertTrue(time.time() - started < 1)
+    self.assertEqual([x.received for x in self.servers], [1, 1])
+    self.assertEqual(self.healthy.failure_count, 0)
+    self.assertEqual(self.silent.failure_count, 1)
+    self.assertTrue('Timeout' in self.silent.disabled_msg)
+    self.assertEqual(list(self.silent.error_map), ['Timeout The DNS operation timed out.'])
+
+  def testPingFallsBackToThreads(self):
+    saved_min_servers = nameserver_list.PING_SWEEP_MIN_SERVERS
+    nameserver_list.PING_SWEEP_MIN_SERVERS = 1
+
+    def _BrokenSweep(servers):
+      servers[0].DisableWithMessage('half-finished sweep')
+      raise ValueError('no sockets left')
+
+    self.nameservers.SweepNameServers = _BrokenSweep
+    self.nameservers.append(self.healthy)
+    self.nameservers.append(self.silent)
+    try:
+      self.nameservers.PingNameServers()
+    finally:
+      nameserver_list.PING_SWEEP_MIN_SERVERS = saved_min_servers
+    # The threads start over, rather than keeping what the sweep did.
+    self.assertEqual(list(self.nameservers.enabled_servers), [self.healthy])
+    self.assertEqual(self.servers[0].received, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -17,9 +17,20 @@
 
 __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 
+import pickle
+import unittest
+
+from . import async_engine
 from . import mocks
 from . import nameserver
-import unittest
+from . import nameserver_list
+
+class JunkDnsServer(mocks.LoopbackDnsServer):
+  """Answers with junk after the end of each reply."""
+
+  def _Reply(self, wire, address):
+    mocks.LoopbackDnsServer._Reply(self, wire + b'junk', address)
+
 
 class TestNameserver(unittest.TestCase):
   def testInit(self):
@@ -174,6 +185,89 @@ class TestNameserver(unittest.TestCase):
     self.assertEquals(slower, None)
     self.assertEquals(faster, None)
 
+  def testTagSet(self):
+    changes = []
+
+    class Observer(object):
+      def Changed(self, owner, added, removed):
+        changes.append((owner, added, removed))
+
+    observer = Observer()
+    tags = nameserver.TagSet(['preferred'], owner='owner')
+    tags.AddObserver(observer.Changed)
+    tags.add('hidden')
+    tags.add('hidden')
+    tags.update(['ipv4', 'preferred'])
+    tags.discard('preferred')
+    self.assertEquals(set(tags), set(['hidden', 'ipv4']))
+    self.assertEquals(tags & set(['ipv4', 'nearby']), set(['ipv4']))
+    self.assertTrue('hidden' in tags and 'unknown-tag' not in tags)
+    self.assertEquals(changes, [('owner', set(['hidden']), set()), ('owner', set(['ipv4']), set()),
+                                ('owner', set(), set(['preferred']))])
+
+  def testPickleWithObservers(self):
+    ns_list = nameserver_list.NameServers()
+    ns = nameserver.NameServer('192.0.2.1', tags=['preferred'])
+    ns_list.append(ns)
+    copy = pickle.loads(pickle.dumps(ns))
+    self.assertEquals(copy.ip, ns.ip)
+    self.assertEquals(set(copy.tags), set(ns.tags))
+    self.assertTrue(copy.tags.owner is copy)
+    # The original is still indexed.
+    ns.tags.add('hidden')
+    self.assertEquals(ns_list.visible_servers, ())
+
+    ns_list = pickle.loads(pickle.dumps(ns_list))
+    ns_list[0].tags.add('nearby')
+    self.assertEquals([x.ip for x in ns_list.HasTag('nearby')], ['192.0.2.1'])
+
+  def testLateReplyCounts(self):
+    # Answers take longer than the retransmit timeout, but less than the timeout.
+    try:
+      server = mocks.LoopbackDnsServer(delay=0.7)
+    except OSError:
+      self.skipTest('No loopback networking')
+    ns = server.NameServer()
+    ns.timeout = 2
+    for unused_count in range(10):
+      ns.rtt.AddSample(0.01)
+    self.assertEquals(ns.retransmit_timeout, 0.5)
+    (response, duration, error_msg) = ns.TimedRequest('A', 'www.example.com.')
+    (async_result,) = async_engine.AsyncQueryEngine().Run([(ns, 'A', 'www.example.org.')])
+    server.Close()
+    self.assertEquals(error_msg, None)
+    self.assertEquals(response.send_count, 2)
+    self.assertTrue(700 <= duration < 2000, duration)
+    self.assertEquals(async_result[5], None)
+    self.assertEquals(nameserver.ResponseToAscii(async_result[3]), mocks.LOOPBACK_ANSWER)
+    self.assertEquals(ns.failure_count, 0)
+
+  def testMalformedReplyFails(self):
+    try:
+      server = JunkDnsServer()
+    except OSError:
+      self.skipTest('No loopback networking')
+    ns = server.NameServer()
+    ns.timeout = 1
+    (response, unused_duration, error_msg) = ns.TimedRequest('A', 'www.example.com.')
+    (async_result,) = async_engine.AsyncQueryEngine().Run([(ns, 'A', 'www.example.org.')])
+    server.Close()
+    self.assertEquals(response, None)
+    self.assertTrue(error_msg.startswith('TrailingJunk'), error_msg)
+    self.assertEquals(async_result[3], None)
+    self.assertEquals(async_result[5], error_msg)
+    self.assertEquals(ns.failure_count, 2)
+    self.assertEquals(ns.error_map, {error_msg: 2})
+
+  def testTagPredicates(self):
+    ns = nameserver.NameServer('192.0.2.1', tags=['system', 'blacklist'])
+    self.assertTrue(ns.is_keeper)
+    self.assertFalse(ns.is_bad)
+    self.assertFalse(ns.is_disabled)
+    ns = nameserver.NameServer('192.0.2.2', tags=['blacklist'])
+    self.assertTrue(ns.is_bad)
+    self.assertTrue(ns.is_disabled and ns.is_hidden)
+
 
 if __name__ == '__main__':
   unittest.main()
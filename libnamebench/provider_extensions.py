@@ -24,6 +24,8 @@ __author__ = 'tstromberg@google.com (Thomas Stromberg)'
 class NameServerProvider(object):
 
   """Inherited by nameserver."""
+
+  __slots__ = ()
   
   # myresolver.info
   def GetMyResolverIpWithDuration(self):
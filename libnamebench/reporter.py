@@ -28,6 +28,7 @@ from . import addr_util
 from . import charts
 from . import nameserver
 from . import nameserver_list
+from . import result_spool
 from . import url_map
 from . import util
 
@@ -39,16 +40,19 @@ class ReportGenerator(object):
   """Generate reports - ASCII, HTML, etc."""
 
   def __init__(self, config, nameservers, results, index=None, geodata=None,
-               status_callback=None):
+               status_callback=None, spool_path=None):
     """Constructor.
 
     Args:
       config: A dictionary of configuration information.
       nameservers: A list of nameserver objects to include in the report.
-      results: A dictionary of results from Benchmark.Run()
+      results: A result_store.ResultStore from Benchmark.Run()
       index: A dictionary of results for index hosts.
       geodata: A dictionary of geographic information.
       status_callback: where to send msg() calls.
+      spool_path: result spool the results were also written to. If set, the
+        detailed CSV is copied from it rather than from results. Spool-only
+        results also read their durations back from it.
     """
     self.nameservers = nameservers
     self.results = results
@@ -56,8 +60,10 @@ class ReportGenerator(object):
     self.config = config
     self.geodata = geodata
     self.status_callback = status_callback
+    self.spool_path = spool_path
     self.cached_averages = {}
     self.cached_summary = None
+    self.spooled_durations = None
 
   def msg(self, msg, **kwargs):
     if self.status_callback:
@@ -77,12 +83,10 @@ class ReportGenerator(object):
       run_averages = []
 
       for test_run in self.results[ns]:
-        # x: record, req_type, duration, response
         total_count = len(test_run)
-        failure_count += len([x for x in test_run if not x[3]])
-        nx_count += len([x for x in test_run if x[3] and not x[3].answer])
-        duration = sum([x[2] for x in test_run])
-        run_averages.append(duration / len(test_run))
+        failure_count += test_run.failure_count
+        nx_count += test_run.nx_count
+        run_averages.append(util.NanosecondsToMilliseconds(test_run.duration_sum_ns) / len(test_run))
 
       # This appears to be a safe use of averaging averages
       overall_average = util.CalculateListAverage(run_averages)
@@ -95,26 +99,13 @@ class ReportGenerator(object):
 
   def FastestAndSlowestDurationForNameServer(self, ns):
     """For a given nameserver, find the fastest/slowest non-error durations."""
-
-    fastest_duration = 2**32
-    slowest_duration = -1
-
-    durations = []
-    for test_run_results in self.results[ns]:
-      for (unused_host, unused_type, duration, response, unused_error) in test_run_results:
-        durations.append(duration)
-        if response and response.answer:
-          if duration < fastest_duration:
-            fastest_duration = duration
-        if duration > slowest_duration:
-          slowest_duration = duration
-
+    runs = self.results[ns]
+    fastest = [x.fastest_answer_ns for x in runs if x.fastest_answer_ns is not None]
     # If we have no error-free durations, settle for anything.
-    if fastest_duration == 2**32:
-      fastest_duration = min(durations)
-    if slowest_duration == -1:
-      slowest_duration = max(durations)
-    return (fastest_duration, slowest_duration)
+    if not fastest:
+      fastest = [x.fastest_ns for x in runs if x.fastest_ns is not None]
+    slowest = [x.slowest_ns for x in runs if x.slowest_ns is not None]
+    return (util.NanosecondsToMilliseconds(min(fastest)), util.NanosecondsToMilliseconds(max(slowest)))
 
   def FastestNameServerResult(self):
     """Process all runs for all hosts, yielding an average for each host."""
@@ -274,11 +265,24 @@ class ReportGenerator(object):
     duration_data = []
     for ns in self.results:
       durations = []
-      for test_run_results in self.results[ns]:
-        durations += [x[2] for x in test_run_results]
+      for run_durations in self._RunDurations(ns):
+        durations.extend(run_durations)
       duration_data.append((ns, durations))
     return duration_data
 
+  def _RunDurations(self, ns):
+    """Durations (ms) of each test run for a nameserver.
+
+    Spool-only results only kept their totals, so the durations are read back
+    from the spool (once, for all nameservers).
+    """
+    if not getattr(self.results, 'spool_only', False):
+      return [test_run.durations for test_run in self.results[ns]]
+    if self.spooled_durations is None:
+      self.spooled_durations = result_spool.ReadDurations(self.spool_path)
+    return [[util.NanosecondsToMilliseconds(x) for x in self.spooled_durations.get((ns.ip, run), [])]
+            for run in range(len(self.results[ns]))]
+
   def _GenerateNameServerSummary(self):
     if self.cached_summary:
       return self.cached_summary
@@ -308,6 +312,7 @@ class ReportGenerator(object):
           'duration_min': float(ns.fastest_check_duration),
           'is_reference': False,
           'is_disabled': ns.is_disabled,
+          'is_eliminated': ns.HasTag('eliminated'),
           'check_average': ns.check_average,
           'error_count': ns.error_count,
           'timeout_count': ns.timeout_count,
@@ -319,9 +324,8 @@ class ReportGenerator(object):
     for (ns, unused_avg, run_averages, fastest, slowest, unused_failures, nx_count, unused_total) in sorted_averages:
       placed_at += 1
 
-      durations = []
-      for _ in self.results[ns]:
-        durations.append([x[2] for x in self.results[ns][0]])
+      first_run = self._RunDurations(ns)[0]
+      durations = [list(first_run) for _ in self.results[ns]]
 
       nsdata[ns].update({
           'position': placed_at,
@@ -366,9 +370,9 @@ class ReportGenerator(object):
     # Get the meat out of the index data.
     index = []
     if ns in self.index:
-      for host, req_type, duration, response, unused_x in self.index[ns]:
+      for host, req_type, duration_ns, response, unused_x in self.index[ns]:
         answer_count, ttl = self._ResponseToCountTtlText(response)[0:2]
-        index.append((host, req_type, duration, answer_count, ttl,
+        index.append((host, req_type, util.NanosecondsToMilliseconds(duration_ns), answer_count, ttl,
                       nameserver.ResponseToAscii(response)))
     return index
 
@@ -423,10 +427,10 @@ class ReportGenerator(object):
     answer_count = -1
     ttl = -1
     if response:
-      if response.answer:
-        answer_count = len(response.answer)
-        ttl = response.answer[0].ttl
-      answer_text = nameserver.ResponseToAscii(response)
+      if response.answer_count:
+        answer_count = response.answer_count
+        ttl = response.ttl
+      answer_text = getattr(response, 'answer_text', None) or nameserver.ResponseToAscii(response)
     return (answer_count, ttl, answer_text)
 
   def SaveResultsToCsv(self, filename):
@@ -444,13 +448,25 @@ class ReportGenerator(object):
     output.writerow(['IP', 'Name', 'Test_Num', 'Record',
                      'Record_Type', 'Duration', 'TTL', 'Answer_Count',
                      'Response'])
-    for ns in self.results:
-      self.msg('Saving detailed data for %s' % ns, debug=True)
-      for (test_run, test_results) in enumerate(self.results[ns]):
-        for (record, req_type, duration, response, error_msg) in test_results:
-          (answer_count, ttl, answer_text) = self._ResponseToCountTtlText(response)
-          output.writerow([ns.ip, ns.name, test_run, record, req_type, duration,
-                           ttl, answer_count, answer_text, error_msg])
+    if self.spool_path:
+      self.msg('Copying detailed data from %s' % self.spool_path, debug=True)
+      for row in result_spool.ReadSpool(self.spool_path):
+        if row['answer_count'] > 0:
+          (answer_count, ttl) = (row['answer_count'], row['ttl'])
+        else:
+          (answer_count, ttl) = (-1, -1)
+        output.writerow([row['ip'], row['name'], row['run'], row['hostname'], row['request_type'],
+                         util.NanosecondsToMilliseconds(row['duration_ns']), ttl, answer_count,
+                         result_spool.RowAnswerText(row) or '', row['error']])
+    else:
+      for ns in self.results:
+        self.msg('Saving detailed data for %s' % ns, debug=True)
+        for (test_run, test_results) in enumerate(self.results[ns]):
+          for (record, req_type, duration_ns, response, error_msg) in test_results:
+            (answer_count, ttl, answer_text) = self._ResponseToCountTtlText(response)
+            output.writerow([ns.ip, ns.name, test_run, record, req_type,
+                             util.NanosecondsToMilliseconds(duration_ns),
+                             ttl, answer_count, answer_text, error_msg])
     csv_file.close()
     self.msg('%s saved.' % filename, debug=True)
 
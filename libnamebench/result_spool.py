@@ -0,0 +1,286 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Append benchmark results to a file as they arrive.
+
+A spool holds one row per query, written in batches while the benchmark runs,
+so that an interrupted run leaves everything it finished on disk. Files ending
+in .csv are written as CSV, anything else as JSON lines. Replies are spooled
+as their wire-format bytes (base64), and only decoded when the spool is read
+back. Reports can be built from a spool afterwards, see LoadResults().
+
+A checkpoint file next to the spool records what the benchmark was asked to
+do (test records, servers and run count), so that an interrupted benchmark
+can be resumed against the same workload.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import array
+import base64
+import binascii
+import csv
+import io
+import os
+import os.path
+import sys
+import time
+
+# external dependencies (from third_party)
+import dns.exception
+import simplejson
+
+from . import dns_wire
+from . import nameserver
+from . import result_store
+
+# Columns of each row, in CSV order.
+FIELDS = ('ip', 'name', 'run', 'index', 'hostname', 'request_type', 'duration_ns',
+          'rcode', 'ttl', 'answer_count', 'wire', 'error')
+INTEGER_FIELDS = ('run', 'index', 'duration_ns', 'rcode', 'ttl', 'answer_count')
+
+# Write after this many rows, or once the oldest buffered row is this old
+# (in seconds), whichever comes first.
+DEFAULT_BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+class InvalidCheckpoint(Exception):
+  """Used when a checkpoint is missing or cannot be read."""
+
+  def __init__(self, value):
+    self.value = value
+
+  def __str__(self):
+    return str(self.value)
+
+
+def SpoolFormat(path):
+  """Which format a spool path is written in (csv or jsonl)."""
+  if path.lower().endswith('.csv'):
+    return 'csv'
+  return 'jsonl'
+
+
+class ResultSpool(object):
+  """Buffered, append-only writer of benchmark result rows."""
+
+  def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, append=False):
+    """Constructor.
+
+    Args:
+      path: file to write to
+      batch_size: how many rows to buffer between writes (int)
+      append: add to the rows already in path (when resuming), rather than
+        starting over.
+    """
+    self.path = path
+    self.format = SpoolFormat(path)
+    self.batch_size = batch_size
+    self.row_count = 0
+    self._pending = []
+    self._oldest_pending = None
+    if append:
+      needs_header = not os.path.exists(path) or not os.path.getsize(path)
+      self._fp = open(path, 'a', newline='')
+    else:
+      needs_header = True
+      self._fp = open(path, 'w', newline='')
+    if self.format == 'csv' and needs_header:
+      csv.writer(self._fp).writerow(FIELDS)
+
+  def Add(self, ns, run, index, result):
+    """Queue one result for writing.
+
+    Args:
+      ns: the nameserver it came from
+      run: test run number (int)
+      index: position of the query within the test run (int)
+      result: (hostname, request_type, duration_ns, response, error_msg) tuple
+    """
+    (hostname, request_type, duration_ns, response, error_msg) = result
+    wire = None
+    if response:
+      (rcode, ttl, answer_count) = (response.rcode(), response.ttl, response.answer_count)
+      raw = getattr(response, 'wire', None)
+      if raw is None and hasattr(response, 'to_wire'):
+        raw = response.to_wire()
+      if raw is not None:
+        wire = base64.b64encode(raw).decode('ascii')
+    else:
+      (rcode, ttl, answer_count) = (-1, -1, result_store.NO_RESPONSE)
+    self._pending.append((ns.ip, ns.name, run, index, hostname, request_type, duration_ns,
+                          rcode, ttl, answer_count, wire, error_msg))
+    self.row_count += 1
+    now = time.time()
+    if self._oldest_pending is None:
+      self._oldest_pending = now
+    if len(self._pending) >= self.batch_size or now - self._oldest_pending >= FLUSH_INTERVAL:
+      self.Flush()
+
+  def Flush(self):
+    """Write out all buffered rows."""
+    if not self._pending:
+      return
+    buf = io.StringIO()
+    if self.format == 'csv':
+      csv.writer(buf).writerows(self._pending)
+    else:
+      for row in self._pending:
+        buf.write(simplejson.dumps(dict(zip(FIELDS, row))))
+        buf.write('\n')
+    self._fp.write(buf.getvalue())
+    self._fp.flush()
+    self._pending = []
+    self._oldest_pending = None
+
+  def Close(self):
+    self.Flush()
+    self._fp.close()
+
+
+def ReadSpool(path):
+  """Yield each row of a spool file as a dictionary.
+
+  A partly-written last line (from a run that was killed mid-write) is
+  skipped.
+  """
+  with open(path, newline='') as fp:
+    if SpoolFormat(path) == 'csv':
+      for row in csv.DictReader(fp):
+        if None in row.values() or not row['duration_ns']:
+          continue
+        for field in INTEGER_FIELDS:
+          row[field] = int(row[field])
+        row['wire'] = row['wire'] or None
+        row['error'] = row['error'] or None
+        yield row
+    else:
+      for line in fp:
+        try:
+          yield simplejson.loads(line)
+        except ValueError:
+          continue
+
+
+def RowResponse(row):
+  """Decode the reply spooled in a row.
+
+  Returns:
+    dns_wire.WireResponse, a result_store.StoredResponse summary if the raw
+    reply was not spooled, or None if there was no reply.
+  """
+  if row['answer_count'] == result_store.NO_RESPONSE:
+    return None
+  if row['wire']:
+    try:
+      return dns_wire.WireResponse(base64.b64decode(row['wire']))
+    except (binascii.Error, ValueError, dns.exception.DNSException):
+      pass
+  return result_store.StoredResponse(row['rcode'], row['answer_count'], row['ttl'])
+
+
+def RowAnswerText(row):
+  """A summary of the answers in a row (see nameserver.ResponseToAscii), or None."""
+  response = RowResponse(row)
+  if response is None or isinstance(response, result_store.StoredResponse):
+    return None
+  return nameserver.ResponseToAscii(response)
+
+
+def ReadDurations(path):
+  """Read just the durations from a spool.
+
+  Returns:
+    dictionary of array.array('q') durations (ns), keyed by (ip, run).
+  """
+  durations = {}
+  for row in ReadSpool(path):
+    key = (row['ip'], row['run'])
+    if key not in durations:
+      durations[key] = array.array('q')
+    durations[key].append(row['duration_ns'])
+  return durations
+
+
+def LoadResults(path, nameservers=None, keep_responses=True):
+  """Rebuild benchmark results from a spool.
+
+  Args:
+    path: spool file
+    nameservers: nameserver objects to attribute rows to, matched by IP.
+      Servers that are not found are created from the spooled IP and name.
+    keep_responses: keep each raw reply (see result_store.ResultRun)
+
+  Returns:
+    A result_store.ResultStore
+  """
+  servers = dict((ns.ip, ns) for ns in nameservers or [])
+  results = result_store.ResultStore(keep_responses=keep_responses)
+  for row in ReadSpool(path):
+    ns = servers.get(row['ip'])
+    if not ns:
+      ns = nameserver.NameServer(row['ip'], name=row['name'])
+      servers[row['ip']] = ns
+    while len(results.get(ns, [])) <= row['run']:
+      results.AddRun(ns)
+    results[ns][row['run']].append((row['hostname'], row['request_type'], row['duration_ns'],
+                                    RowResponse(row), row['error']))
+  return results
+
+
+def CheckpointPath(path):
+  return path + CHECKPOINT_SUFFIX
+
+
+def SaveCheckpoint(path, test_records, nameservers, run_count):
+  """Record the workload of the benchmark spooling to path.
+
+  Args:
+    path: spool file
+    test_records: list of (request_type, hostname) tuples
+    nameservers: the nameservers being benchmarked
+    run_count: how many test runs each nameserver gets (int)
+  """
+  checkpoint = {
+      'test_records': [list(x) for x in test_records],
+      'servers': [[ns.ip, ns.name] for ns in nameservers],
+      'run_count': run_count,
+  }
+  tmp_path = CheckpointPath(path) + '.tmp'
+  with open(tmp_path, 'w') as fp:
+    simplejson.dump(checkpoint, fp)
+  os.replace(tmp_path, CheckpointPath(path))
+
+
+def LoadCheckpoint(path):
+  """Return the workload saved for the spool at path.
+
+  Returns:
+    dictionary with test_records (list of tuples), servers (list of
+    (ip, name) tuples) and run_count.
+
+  Raises:
+    InvalidCheckpoint: if there is no readable checkpoint.
+  """
+  try:
+    with open(CheckpointPath(path)) as fp:
+      checkpoint = simplejson.load(fp)
+  except (IOError, ValueError):
+    raise InvalidCheckpoint('No usable checkpoint for %s: %s' % (path, sys.exc_info()[1]))
+  checkpoint['test_records'] = [tuple(x) for x in checkpoint['test_records']]
+  checkpoint['servers'] = [tuple(x) for x in checkpoint['servers']]
+  return checkpoint
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the result_spool module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import mocks
+from . import nameserver
+from . import reporter
+from . import result_spool
+from . import result_store
+
+
+class ResultSpoolTest(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _RoundTrip(self, filename):
+    path = os.path.join(self.tempdir, filename)
+    ns = mocks.MockNameServer(mocks.GOOD_IP)
+    (response, unused_duration, unused_error) = ns.TimedRequest('A', 'www.paypal.com')
+    store = result_store.ResultStore(spool=result_spool.ResultSpool(path, batch_size=2))
+    run = store.AddRun(ns)
+    run.append(('www.paypal.com.', 'A', 12500000, response, None))
+    run.append(('www.google.com.', 'A', 3000000000, None, 'Timeout'))
+    store.AddRun(ns).append(('www.paypal.com.', 'A', 10000000, response, None))
+    store.spool.Close()
+
+    loaded = result_spool.LoadResults(path, [ns])
+    self.assertEqual(list(loaded), [ns])
+    self.assertEqual([list(x.durations_ns) for x in loaded[ns]], [[12500000, 3000000000], [10000000]])
+    self.assertEqual(loaded[ns][0].failure_count, 1)
+    # The raw reply is spooled, and decoded when read back.
+    loaded_response = loaded[ns][0][0][3]
+    self.assertEqual(loaded_response.answer_count, response.answer_count)
+    answers = sorted(nameserver.ResponseToAscii(response).split(', '))
+    self.assertEqual(sorted(nameserver.ResponseToAscii(loaded_response).split(', ')), answers)
+    self.assertEqual(loaded[ns][0][1][4], 'Timeout')
+    rows = list(result_spool.ReadSpool(path))
+    self.assertEqual(sorted(result_spool.RowAnswerText(rows[0]).split(', ')), answers)
+    self.assertEqual(result_spool.RowAnswerText(rows[1]), None)
+
+  def testJsonLines(self):
+    self._RoundTrip('results.jsonl')
+
+  def testCsv(self):
+    self._RoundTrip('results.csv')
+
+  def testAddDoesNotDecodeReplies(self):
+    path = os.path.join(self.tempdir, 'results.jsonl')
+    ns = mocks.MockNameServer(mocks.GOOD_IP)
+    (response, unused_duration, unused_error) = ns.TimedRequest('A', 'www.paypal.com')
+    spool = result_spool.ResultSpool(path)
+    saved = nameserver.ResponseToAscii
+    nameserver.ResponseToAscii = None
+    try:
+      spool.Add(ns, 0, 0, ('www.paypal.com.', 'A', 12500000, response, None))
+    finally:
+      nameserver.ResponseToAscii = saved
+    spool.Close()
+    self.assertEqual(len(list(result_spool.ReadSpool(path))), 1)
+
+  def testSpoolOnly(self):
+    self.assertRaises(ValueError, result_store.ResultStore, spool_only=True)
+    path = os.path.join(self.tempdir, 'results.csv')
+    ns = mocks.MockNameServer(mocks.GOOD_IP)
+    (response, unused_duration, unused_error) = ns.TimedRequest('A', 'www.paypal.com')
+    stores = []
+    for spool_only in (False, True):
+      spool = result_spool.ResultSpool(path + str(spool_only) + '.csv')
+      store = result_store.ResultStore(spool=spool, spool_only=spool_only)
+      for durations in ([12500000, 3000000000, 8000000], [10000000]):
+        run = store.AddRun(ns)
+        run.append(('www.paypal.com.', 'A', durations[0], response, None))
+        for duration in durations[1:]:
+          run.append(('www.google.com.', 'A', duration, None, 'Timeout'))
+      spool.Close()
+      stores.append(store)
+    (full, totals_only) = stores
+
+    run = totals_only[ns][0]
+    self.assertEqual(len(run), 3)
+    self.assertEqual((run.failure_count, run.nx_count), (2, 0))
+    self.assertEqual(run.duration_sum_ns, 3020500000)
+    self.assertEqual((run.fastest_answer_ns, run.fastest_ns, run.slowest_ns),
+                     (12500000, 8000000, 3000000000))
+    self.assertEqual(len(run.durations_ns), 0)
+    self.assertEqual(run.raw_responses, {})
+    self.assertRaises(result_store.RowsNotKept, run.__getitem__, 0)
+    self.assertEqual(totals_only.Lookup('A', 'www.paypal.com.'), {})
+
+    # Reports come out the same, with durations read back from the spool.
+    reports = [reporter.ReportGenerator({}, [ns], store, index={}, spool_path=store.spool.path)
+               for store in stores]
+    self.assertEqual(reports[0].ComputeAverages(), reports[1].ComputeAverages())
+    self.assertEqual(reports[0].DigestedResults(), reports[1].DigestedResults())
+    self.assertEqual(reports[1].DigestedResults()[0][1], [12.5, 3000.0, 8.0, 10.0])
+
+  def testTruncatedLastLine(self):
+    path = os.path.join(self.tempdir, 'results.jsonl')
+    ns = mocks.MockNameServer(mocks.GOOD_IP)
+    spool = result_spool.ResultSpool(path)
+    spool.Add(ns, 0, 0, ('www.paypal.com.', 'A', 12500000, None, 'Timeout'))
+    spool.Close()
+    with open(path, 'a') as fp:
+      fp.write('{"ip": "127.0')
+    self.assertEqual(len(list(result_spool.ReadSpool(path))), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
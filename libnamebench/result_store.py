@@ -0,0 +1,306 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact, column-oriented storage for benchmark results.
+
+Benchmark results used to be {ns: [[(hostname, type, duration, response,
+error_msg), ...], ...]}, with a decoded DNS message held for every query.
+A ResultStore keeps the same shape, but each test run is a ResultRun that
+stores its rows as typed arrays (strings are interned), and the raw reply is
+at most kept as wire-format bytes in a side table. Rows are rebuilt as tuples
+when asked for, while the reporter reads the columns directly.
+
+Durations are stored as integer nanoseconds, and only converted to
+milliseconds for display (see ResultRun.durations).
+
+In spool-only mode, rows are only written to the spool: each ResultRun just
+keeps running totals, and the report reads anything else back from the spool.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import array
+
+from . import dns_wire
+from . import util
+
+# answer_count for a query that got no response at all.
+NO_RESPONSE = -1
+
+
+class RowsNotKept(Exception):
+  """Used when asking a spool-only ResultRun for rows it only wrote to the spool."""
+
+  def __init__(self, value):
+    self.value = value
+
+  def __str__(self):
+    return str(self.value)
+
+
+class StoredResponse(object):
+  """The parts of a DNS response that a ResultRun keeps without the raw reply."""
+
+  def __init__(self, rcode, answer_count, ttl, answer_text=None):
+    self._rcode = rcode
+    self.answer_count = answer_count
+    self.ttl = ttl
+    # Answer records can only be rebuilt from a raw response, but a summary
+    # (see nameserver.ResponseToAscii) may have been kept.
+    self.answer = []
+    self.answer_text = answer_text
+
+  def rcode(self):
+    return self._rcode
+
+
+class StringTable(object):
+  """Interns strings (hostnames, record types, errors) as small integers."""
+
+  def __init__(self):
+    self._strings = [None]
+    self._ids = {None: 0}
+
+  def Add(self, string):
+    string_id = self._ids.get(string)
+    if string_id is None:
+      string_id = len(self._strings)
+      self._ids[string] = string_id
+      self._strings.append(string)
+    return string_id
+
+  def Get(self, string_id):
+    return self._strings[string_id]
+
+
+class ResultRun(object):
+  """One test run for one nameserver, stored column by column.
+
+  It can be used as the list of (hostname, request_type, duration_ns, response,
+  error_msg) tuples it replaces.
+  """
+
+  def __init__(self, strings, keep_responses=True, ns=None, number=0, spool=None,
+               record_index=None, spool_only=False):
+    """Constructor.
+
+    Args:
+      strings: StringTable to intern hostnames, types and errors in
+      keep_responses: keep each raw reply (bytes), so the response can be
+        fully decoded again later.
+      ns: the nameserver this run is for
+      number: which test run this is for the nameserver (int)
+      spool: result_spool.ResultSpool to also write each row to
+      record_index: dictionary to note the first row for each
+        (request_type, hostname) in, see ResultStore.Lookup().
+      spool_only: only write rows to the spool, keeping nothing but the
+        running totals in memory.
+    """
+    if spool_only and not spool:
+      raise ValueError('Spool-only results need a spool to write to.')
+    self._strings = strings
+    self.keep_responses = keep_responses
+    self.ns = ns
+    self.number = number
+    self.spool = spool
+    self.spool_only = spool_only
+    self.record_index = record_index
+    # Running totals, kept in both modes.
+    self.row_count = 0
+    self.failure_count = 0
+    self.nx_count = 0
+    self.duration_sum_ns = 0
+    self.fastest_ns = None
+    self.slowest_ns = None
+    # Fastest duration of a query that got answers.
+    self.fastest_answer_ns = None
+    self.hostnames = array.array('I')
+    self.request_types = array.array('I')
+    self.durations_ns = array.array('q')
+    self.rcodes = array.array('b')
+    self.ttls = array.array('q')
+    self.answer_counts = array.array('i')
+    self.errors = array.array('I')
+    # row number -> raw reply (bytes)
+    self.raw_responses = {}
+    # row number -> answer summary, for rows stored without a raw reply
+    self.answer_texts = {}
+
+  def append(self, result):
+    if self.spool:
+      self.spool.Add(self.ns, self.number, self.row_count, result)
+    self._Store(result)
+
+  def extend(self, results):
+    for result in results:
+      self.append(result)
+
+  def Restore(self, results):
+    """Add results that were stored before (e.g. in a spool), without spooling them again."""
+    for result in results:
+      self._Store(result)
+
+  def _Store(self, result):
+    (hostname, request_type, duration_ns, response, error_msg) = result
+    if response:
+      (rcode, answer_count, ttl) = (response.rcode(), response.answer_count, response.ttl)
+    else:
+      (rcode, answer_count, ttl) = (-1, NO_RESPONSE, -1)
+    self._UpdateTotals(duration_ns, answer_count)
+    if self.spool_only:
+      return
+
+    row = len(self.durations_ns)
+    if response:
+      if self.keep_responses and not isinstance(response, StoredResponse):
+        wire = getattr(response, 'wire', None)
+        if wire is None:
+          wire = response.to_wire()
+        self.raw_responses[row] = wire
+      elif getattr(response, 'answer_text', None):
+        self.answer_texts[row] = response.answer_text
+    self.hostnames.append(self._strings.Add(hostname))
+    self.request_types.append(self._strings.Add(request_type))
+    self.durations_ns.append(duration_ns)
+    self.rcodes.append(rcode)
+    self.ttls.append(ttl)
+    self.answer_counts.append(answer_count)
+    self.errors.append(self._strings.Add(error_msg))
+    if self.record_index is not None:
+      rows = self.record_index.setdefault((request_type, hostname), {})
+      rows.setdefault(self.ns, row)
+
+  def _UpdateTotals(self, duration_ns, answer_count):
+    self.row_count += 1
+    self.duration_sum_ns += duration_ns
+    if answer_count == NO_RESPONSE:
+      self.failure_count += 1
+    elif answer_count == 0:
+      self.nx_count += 1
+    elif self.fastest_answer_ns is None or duration_ns < self.fastest_answer_ns:
+      self.fastest_answer_ns = duration_ns
+    if self.fastest_ns is None or duration_ns < self.fastest_ns:
+      self.fastest_ns = duration_ns
+    if self.slowest_ns is None or duration_ns > self.slowest_ns:
+      self.slowest_ns = duration_ns
+
+  def _CheckRowsKept(self):
+    if self.spool_only:
+      raise RowsNotKept('Rows of %s test run %s are only in %s' %
+                        (self.ns, self.number, self.spool.path))
+
+  @property
+  def durations(self):
+    """Each query duration in milliseconds (floats), for display."""
+    self._CheckRowsKept()
+    return [util.NanosecondsToMilliseconds(x) for x in self.durations_ns]
+
+  def Response(self, row):
+    """Return the response for a row (None if there was none)."""
+    self._CheckRowsKept()
+    if self.answer_counts[row] == NO_RESPONSE:
+      return None
+    wire = self.raw_responses.get(row)
+    if wire is not None:
+      return dns_wire.WireResponse(wire)
+    return StoredResponse(self.rcodes[row], self.answer_counts[row], self.ttls[row],
+                          answer_text=self.answer_texts.get(row))
+
+  def __len__(self):
+    return self.row_count
+
+  def __getitem__(self, row):
+    self._CheckRowsKept()
+    if isinstance(row, slice):
+      return [self[x] for x in range(*row.indices(len(self)))]
+    if row < 0:
+      row += len(self)
+    if not 0 <= row < len(self):
+      raise IndexError('result row out of range')
+    return (self._strings.Get(self.hostnames[row]), self._strings.Get(self.request_types[row]),
+            self.durations_ns[row], self.Response(row), self._strings.Get(self.errors[row]))
+
+  def __iter__(self):
+    for row in range(len(self)):
+      yield self[row]
+
+
+class ResultStore(object):
+  """Benchmark results: a read-only mapping of nameserver to a list of ResultRun."""
+
+  def __init__(self, keep_responses=True, spool=None, spool_only=False):
+    """Constructor.
+
+    Args:
+      keep_responses: keep each raw reply (see ResultRun)
+      spool: result_spool.ResultSpool to also write every row to
+      spool_only: only keep running totals of each run in memory (see
+        ResultRun). Rows are then only available from the spool, and
+        Lookup() finds nothing.
+    """
+    if spool_only and not spool:
+      raise ValueError('Spool-only results need a spool to write to.')
+    self.keep_responses = keep_responses
+    self.spool = spool
+    self.spool_only = spool_only
+    self.strings = StringTable()
+    self._runs = {}
+    # (request_type, hostname) -> {ns: row in its first test run}
+    self._record_index = {}
+
+  def AddRun(self, ns):
+    """Start a new (empty) test run for a nameserver, and return it."""
+    runs = self._runs.setdefault(ns, [])
+    if runs:
+      record_index = None
+    else:
+      record_index = self._record_index
+    run = ResultRun(self.strings, keep_responses=self.keep_responses, ns=ns,
+                    number=len(runs), spool=self.spool, record_index=record_index,
+                    spool_only=self.spool_only)
+    runs.append(run)
+    return run
+
+  def Lookup(self, request_type, hostname):
+    """Find the results for a test record in each nameserver's first test run.
+
+    Returns:
+      dictionary of the first matching result, keyed by nameserver.
+    """
+    rows = self._record_index.get((request_type, hostname), {})
+    return dict((ns, self._runs[ns][0][row]) for (ns, row) in rows.items())
+
+  def __getitem__(self, ns):
+    return self._runs[ns]
+
+  def __contains__(self, ns):
+    return ns in self._runs
+
+  def __iter__(self):
+    return iter(self._runs)
+
+  def __len__(self):
+    return len(self._runs)
+
+  def get(self, ns, default=None):
+    return self._runs.get(ns, default)
+
+  def keys(self):
+    return self._runs.keys()
+
+  def values(self):
+    return self._runs.values()
+
+  def items(self):
+    return self._runs.items()
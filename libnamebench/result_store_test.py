@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the result_store module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import unittest
+
+from . import mocks
+from . import result_store
+
+
+def _MockResponse():
+  (response, unused_duration, unused_error) = mocks.MockNameServer(mocks.GOOD_IP).TimedRequest('A', 'www.paypal.com')
+  return response
+
+
+class ResultStoreTest(unittest.TestCase):
+  def testRowsRoundTrip(self):
+    store = result_store.ResultStore()
+    run = store.AddRun('ns1')
+    response = _MockResponse()
+    run.append(('www.paypal.com.', 'A', 12500000, response, None))
+    run.append(('www.google.com.', 'A', 3000000000, None, 'Timeout'))
+    self.assertEqual(list(store), ['ns1'])
+    self.assertEqual(len(store['ns1'][0]), 2)
+
+    (hostname, request_type, duration, stored_response, error_msg) = run[0]
+    self.assertEqual((hostname, request_type, duration, error_msg), ('www.paypal.com.', 'A', 12500000, None))
+    self.assertEqual(stored_response.answer_count, response.answer_count)
+    self.assertEqual(stored_response.ttl, response.ttl)
+    self.assertEqual(len(stored_response.answer), len(response.answer))
+    self.assertEqual(run[-1], ('www.google.com.', 'A', 3000000000, None, 'Timeout'))
+
+  def testColumns(self):
+    store = result_store.ResultStore()
+    run = store.AddRun('ns1')
+    run.append(('www.paypal.com.', 'A', 10000000, _MockResponse(), None))
+    run.append(('www.paypal.com.', 'A', 30000000, None, 'Timeout'))
+    self.assertEqual(list(run.durations_ns), [10000000, 30000000])
+    # Durations are only converted to milliseconds for display.
+    self.assertEqual(list(run.durations), [10.0, 30.0])
+    self.assertEqual(run.failure_count, 1)
+    self.assertEqual(run.nx_count, 0)
+    # Hostnames are interned.
+    self.assertEqual(run.hostnames[0], run.hostnames[1])
+
+  def testLookup(self):
+    store = result_store.ResultStore()
+    for ns in ('ns1', 'ns2'):
+      run = store.AddRun(ns)
+      run.append(('www.paypal.com.', 'A', 10000000, None, 'Timeout'))
+      run.append(('www.paypal.com.', 'A', 20000000, None, 'Timeout'))
+    store.AddRun('ns1').append(('www.google.com.', 'A', 5000000, None, 'Timeout'))
+    matches = store.Lookup('A', 'www.paypal.com.')
+    self.assertEqual(sorted(matches), ['ns1', 'ns2'])
+    self.assertEqual(matches['ns1'][2], 10000000)
+    # Only the first test run is indexed.
+    self.assertEqual(store.Lookup('A', 'www.google.com.'), {})
+
+  def testDiscardResponses(self):
+    store = result_store.ResultStore(keep_responses=False)
+    run = store.AddRun('ns1')
+    response = _MockResponse()
+    run.append(('www.paypal.com.', 'A', 10000000, response, None))
+    stored_response = run[0][3]
+    self.assertTrue(isinstance(stored_response, result_store.StoredResponse))
+    self.assertEqual(stored_response.answer_count, response.answer_count)
+    self.assertEqual(stored_response.rcode(), response.rcode())
+    self.assertEqual(run.raw_responses, {})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,261 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batched reverse DNS (PTR) lookups, with an on-disk cache.
+
+Every PTR request of a batch is sent through the shared transport at once,
+and the replies are collected as they arrive, so that looking up hostnames
+for a few hundred nameservers takes about as long as the slowest lookup.
+
+Answers are cached on disk for as long as their TTL says (within limits), so
+that hostnames do not have to be looked up again on the next run. The cache
+file is written after each batch, and once more at exit for any single
+lookups made since.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import atexit
+import os
+import os.path
+import socket
+import threading
+import time
+
+# external dependencies (from nb_third_party)
+import dns.exception
+import dns.rcode
+import dns.reversename
+import simplejson
+
+from . import dns_wire
+from . import sys_nameservers
+from . import transport
+from . import util
+
+# Seconds to wait for each round of replies, and how many rounds to try.
+LOOKUP_TIMEOUT = 2.0
+LOOKUP_ATTEMPTS = 3
+# How many requests to have outstanding at a time.
+BATCH_SIZE = 250
+
+# Answers are cached for their TTL, kept within these limits (seconds).
+# Addresses without a PTR record are cached for NEGATIVE_TTL.
+MIN_TTL = 3600
+MAX_TTL = 7 * 86400
+NEGATIVE_TTL = 3600
+
+CACHE_FILENAME = 'namebench_ptr_cache.json'
+CACHE_VERSION = 1
+
+PTR_RDTYPE = 12
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def DefaultCachePath():
+  return os.path.join(util.CacheDirectory(), CACHE_FILENAME)
+
+
+def GetCache():
+  """Return the process-wide PTR cache, loading it if necessary."""
+  global _cache
+  with _cache_lock:
+    if not _cache:
+      _cache = PtrCache()
+      atexit.register(_SaveCache, _cache)
+    return _cache
+
+
+def _SaveCache(cache):
+  """Write out lookups that were not saved with a batch (run at exit)."""
+  if cache.dirty:
+    try:
+      cache.Save()
+    except (IOError, OSError):
+      pass
+
+
+class PtrCache(object):
+  """Hostnames for IP addresses, each expiring with its PTR record."""
+
+  def __init__(self, path=None):
+    """Constructor.
+
+    Args:
+      path: cache file (defaults to DefaultCachePath())
+    """
+    self.path = path or DefaultCachePath()
+    self.entries = {}
+    # Whether there are entries that have not been saved yet.
+    self.dirty = False
+    self._lock = threading.Lock()
+    self.Load()
+
+  def Load(self):
+    """Read the cache file, skipping expired entries. A broken file is ignored."""
+    self.entries = {}
+    try:
+      with open(self.path) as fp:
+        data = simplejson.load(fp)
+    except (IOError, ValueError):
+      return
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+      return
+    now = time.time()
+    for (ip, entry) in data.get('entries', {}).items():
+      if entry['expires'] > now:
+        self.entries[ip] = entry
+
+  def Save(self):
+    with self._lock:
+      data = {'version': CACHE_VERSION, 'entries': dict(self.entries)}
+      self.dirty = False
+    tmp_path = '%s.%s.tmp' % (self.path, os.getpid())
+    with open(tmp_path, 'w') as fp:
+      simplejson.dump(data, fp)
+    os.replace(tmp_path, self.path)
+
+  def Clear(self):
+    """Forget every entry, including those on disk."""
+    with self._lock:
+      self.entries = {}
+      self.dirty = False
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def Get(self, ip):
+    """Return (found, hostname). hostname is None for an IP without a PTR record."""
+    entry = self.entries.get(ip)
+    if entry and entry['expires'] > time.time():
+      return (True, entry['hostname'])
+    return (False, None)
+
+  def Put(self, ip, hostname, ttl):
+    """Cache a hostname (None if there is none) for ttl seconds, within our limits."""
+    if hostname is None:
+      ttl = NEGATIVE_TTL
+    else:
+      ttl = min(max(ttl, MIN_TTL), MAX_TTL)
+    with self._lock:
+      self.entries[ip] = {'hostname': hostname, 'expires': time.time() + ttl}
+      self.dirty = True
+
+
+def _ParsePtrResponse(response):
+  """Return (hostname, ttl) from a PTR reply, or None if it has no usable answer.
+
+  hostname is None if the address is known to have no PTR record.
+  """
+  if response.rcode() == dns.rcode.NXDOMAIN:
+    return (None, NEGATIVE_TTL)
+  if response.rcode() != dns.rcode.NOERROR:
+    return None
+  for rrset in response.answer:
+    if rrset.rdtype == PTR_RDTYPE:
+      for rdata in rrset:
+        return (rdata.target.to_text().rstrip('.'), rrset.ttl)
+  return (None, NEGATIVE_TTL)
+
+
+def _ResolverIps():
+  servers = sys_nameservers.GetCurrentNameServers()
+  if not servers:
+    servers = sys_nameservers.GetAssignedNameServers()
+  return servers
+
+
+def _SendBatch(ips, resolver_ip, timeout):
+  """Send a PTR request for each IP to a resolver, and wait for the replies.
+
+  Returns:
+    dictionary of ip -> (hostname, ttl), for the IPs that got a usable answer.
+  """
+  udp = transport.GetTransport()
+  sent = []
+  for ip in ips:
+    try:
+      request = dns_wire.GetQueryTemplate(dns.reversename.from_address(ip).to_text(), 'PTR').NewRequest()
+      sent.append((ip, request, udp.Send(request.to_wire(), resolver_ip)))
+    except (ValueError, socket.error, dns.exception.SyntaxError):
+      continue
+
+  answers = {}
+  deadline = time.monotonic() + timeout
+  for (ip, request, pending) in sent:
+    if not pending.event.wait(max(deadline - time.monotonic(), 0)):
+      udp.Cancel(pending)
+      continue
+    response = dns_wire.WireResponse(pending.reply)
+    request.id = response.id
+    if not request.is_response(response) or response.CheckWire():
+      continue
+    answer = _ParsePtrResponse(response)
+    if answer:
+      answers[ip] = answer
+  return answers
+
+
+def LookupHostnames(ips, cache=None, timeout=LOOKUP_TIMEOUT, attempts=LOOKUP_ATTEMPTS,
+                    resolver_ips=None, save=True):
+  """Find the hostname of many IP addresses at once.
+
+  Args:
+    ips: list of IP addresses (strings)
+    cache: PtrCache to use (defaults to GetCache())
+    timeout: seconds to wait for each round of replies (float)
+    attempts: how many rounds to try unanswered addresses in (int)
+    resolver_ips: resolvers to ask, in turn for each round (defaults to the
+      system nameservers)
+    save: write new answers to the cache file now, rather than at exit
+
+  Returns:
+    dictionary of ip -> hostname. As with NameServer.GetReverseIp(), the
+    hostname is the IP itself if it has none, or it could not be found.
+  """
+  if cache is None:
+    cache = GetCache()
+  hostnames = {}
+  missing = []
+  for ip in ips:
+    (found, hostname) = cache.Get(ip)
+    if found:
+      hostnames[ip] = hostname or ip
+    else:
+      missing.append(ip)
+  missing = list(dict.fromkeys(missing))
+
+  if missing:
+    if resolver_ips is None:
+      resolver_ips = _ResolverIps()
+    for attempt in range(attempts if resolver_ips else 0):
+      resolver_ip = resolver_ips[attempt % len(resolver_ips)]
+      for start in range(0, len(missing), BATCH_SIZE):
+        answers = _SendBatch(missing[start:start + BATCH_SIZE], resolver_ip, timeout)
+        for (ip, (hostname, ttl)) in answers.items():
+          cache.Put(ip, hostname, ttl)
+          hostnames[ip] = hostname or ip
+      missing = [x for x in missing if x not in hostnames]
+      if not missing:
+        break
+    if save and cache.dirty:
+      try:
+        cache.Save()
+      except (IOError, OSError):
+        pass
+
+  for ip in missing:
+    hostnames[ip] = ip
+  return hostnames
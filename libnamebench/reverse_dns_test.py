@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the reverse_dns module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from . import reverse_dns
+
+
+class PtrCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'ptr.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testRoundTrip(self):
+    cache = reverse_dns.PtrCache(path=self.path)
+    cache.Put('192.0.2.1', 'ns1.example.com', 300)
+    cache.Put('192.0.2.2', None, 300)
+    cache.Save()
+    cache = reverse_dns.PtrCache(path=self.path)
+    self.assertEqual(cache.Get('192.0.2.1'), (True, 'ns1.example.com'))
+    self.assertEqual(cache.Get('192.0.2.2'), (True, None))
+    self.assertEqual(cache.Get('192.0.2.3'), (False, None))
+
+  def testExpiry(self):
+    cache = reverse_dns.PtrCache(path=self.path)
+    cache.Put('192.0.2.1', 'ns1.example.com', 10 * reverse_dns.MAX_TTL)
+    expires = cache.entries['192.0.2.1']['expires']
+    cache.entries['192.0.2.1']['expires'] = 0
+    self.assertEqual(cache.Get('192.0.2.1'), (False, None))
+    cache.Put('192.0.2.1', 'ns1.example.com', 10 * reverse_dns.MAX_TTL)
+    self.assertTrue(cache.entries['192.0.2.1']['expires'] <= expires + 1)
+
+  def testLookupHostnamesFromCache(self):
+    cache = reverse_dns.PtrCache(path=self.path)
+    cache.Put('192.0.2.1', 'ns1.example.com', 300)
+    cache.Put('192.0.2.2', None, 300)
+    hostnames = reverse_dns.LookupHostnames(['192.0.2.1', '192.0.2.2', '192.0.2.3'], cache=cache,
+                                            resolver_ips=[])
+    self.assertEqual(hostnames, {'192.0.2.1': 'ns1.example.com', '192.0.2.2': '192.0.2.2',
+                                 '192.0.2.3': '192.0.2.3'})
+
+  def testSavedOncePerBatch(self):
+    saved_send_batch = reverse_dns._SendBatch
+    reverse_dns._SendBatch = lambda ips, unused_ip, unused_timeout: dict(
+        (ip, ('host-%s.example.com' % ip, 300)) for ip in ips)
+    try:
+      cache = reverse_dns.PtrCache(path=self.path)
+      # Single lookups are left for the exit handler to save.
+      reverse_dns.LookupHostnames(['192.0.2.1'], cache=cache, resolver_ips=['192.0.2.53'], save=False)
+      self.assertTrue(cache.dirty)
+      self.assertFalse(os.path.exists(self.path))
+      reverse_dns._SaveCache(cache)
+      self.assertFalse(cache.dirty)
+      self.assertEqual(reverse_dns.PtrCache(path=self.path).Get('192.0.2.1'),
+                       (True, 'host-192.0.2.1.example.com'))
+
+      hostnames = reverse_dns.LookupHostnames(['192.0.2.1', '192.0.2.2'], cache=cache,
+                                              resolver_ips=['192.0.2.53'])
+      self.assertEqual(hostnames['192.0.2.2'], 'host-192.0.2.2.example.com')
+      self.assertFalse(cache.dirty)
+      self.assertEqual(len(reverse_dns.PtrCache(path=self.path).entries), 2)
+    finally:
+      reverse_dns._SendBatch = saved_send_batch
+
+  def testDefaultPathIsPerUser(self):
+    if sys.platform[:3] == 'win' or sys.platform == 'darwin':
+      self.skipTest('Uses XDG_CACHE_HOME')
+    saved_cache_home = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = self.tempdir
+    try:
+      path = reverse_dns.DefaultCachePath()
+    finally:
+      if saved_cache_home is None:
+        del os.environ['XDG_CACHE_HOME']
+      else:
+        os.environ['XDG_CACHE_HOME'] = saved_cache_home
+    self.assertEqual(path, os.path.join(self.tempdir, 'namebench', reverse_dns.CACHE_FILENAME))
+    self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode), 0o700)
+
+
+if __name__ == '__main__':
+  unittest.main()
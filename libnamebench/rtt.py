@@ -0,0 +1,77 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-server round-trip time estimation, used to decide when to resend queries.
+
+This is the TCP retransmission timer (RFC 6298, Jacobson/Karels): keep a
+smoothed RTT and RTT variance, retransmit at srtt + 4 * rttvar, and back off
+exponentially while queries go unanswered. A query is still waited on for
+the configured timeout, so that a slow answer counts.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+# Gains for the smoothed RTT and its variance (RFC 6298 alpha and beta).
+SRTT_GAIN = 1 / 8.0
+RTTVAR_GAIN = 1 / 4.0
+VARIANCE_MULTIPLIER = 4
+
+# Never resend sooner than this (seconds): recursion on a cache miss can
+# take far longer than the cached answers that dominate the samples.
+DEFAULT_MIN_TIMEOUT = 0.5
+MAX_BACKOFF_SHIFT = 6
+
+
+class RttEstimator(object):
+  """Smoothed RTT and RTT variance for one nameserver."""
+
+  def __init__(self, min_timeout=DEFAULT_MIN_TIMEOUT):
+    self.min_timeout = min_timeout
+    self.srtt = None
+    self.rttvar = None
+    self.sample_count = 0
+    self.backoff_shift = 0
+
+  def AddSample(self, rtt):
+    """Account for an answered query.
+
+    Args:
+      rtt: how long the answer took (seconds)
+    """
+    if self.srtt is None:
+      self.srtt = rtt
+      self.rttvar = rtt / 2.0
+    else:
+      self.rttvar = (1 - RTTVAR_GAIN) * self.rttvar + RTTVAR_GAIN * abs(self.srtt - rtt)
+      self.srtt = (1 - SRTT_GAIN) * self.srtt + SRTT_GAIN * rtt
+    self.sample_count += 1
+    self.backoff_shift = 0
+
+  def Backoff(self):
+    """Account for an unanswered query: double the timeout, up to a point."""
+    self.backoff_shift = min(self.backoff_shift + 1, MAX_BACKOFF_SHIFT)
+
+  def Timeout(self, max_timeout):
+    """How long to wait for the next answer before resending the query.
+
+    Args:
+      max_timeout: the configured timeout, which is never exceeded (seconds)
+
+    Returns:
+      timeout in seconds (float)
+    """
+    if self.srtt is None:
+      return max_timeout
+    rto = (self.srtt + VARIANCE_MULTIPLIER * self.rttvar) * (2 ** self.backoff_shift)
+    return min(max(rto, self.min_timeout), max_timeout)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the rtt module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import unittest
+
+from . import rtt
+
+
+class RttEstimatorTest(unittest.TestCase):
+  def testNoSamples(self):
+    estimator = rtt.RttEstimator()
+    self.assertEqual(estimator.Timeout(3.5), 3.5)
+
+  def testFirstSample(self):
+    estimator = rtt.RttEstimator(min_timeout=0.01)
+    estimator.AddSample(0.2)
+    self.assertEqual(estimator.srtt, 0.2)
+    self.assertEqual(estimator.rttvar, 0.1)
+    self.assertAlmostEqual(estimator.Timeout(3.5), 0.6)
+
+  def testSmoothing(self):
+    estimator = rtt.RttEstimator(min_timeout=0.01)
+    estimator.AddSample(0.1)
+    estimator.AddSample(0.2)
+    self.assertAlmostEqual(estimator.srtt, 0.1125)
+    self.assertAlmostEqual(estimator.rttvar, 0.0625)
+
+  def testClamping(self):
+    estimator = rtt.RttEstimator(min_timeout=0.5)
+    estimator.AddSample(0.005)
+    self.assertEqual(estimator.Timeout(3.5), 0.5)
+    estimator.AddSample(10)
+    self.assertEqual(estimator.Timeout(3.5), 3.5)
+
+  def testBackoff(self):
+    estimator = rtt.RttEstimator(min_timeout=0.01)
+    estimator.AddSample(0.1)
+    estimator.Backoff()
+    self.assertAlmostEqual(estimator.Timeout(3.5), 0.6)
+    estimator.Backoff()
+    self.assertAlmostEqual(estimator.Timeout(3.5), 1.2)
+    estimator.AddSample(0.1)
+    self.assertTrue(estimator.Timeout(3.5) < 0.6)
+
+
+if __name__ == '__main__':
+  unittest.main()
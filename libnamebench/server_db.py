@@ -0,0 +1,363 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A compiled, memory-mapped copy of config/servers.csv.
+
+Parsing the whole CSV and building a NameServer for each of its ~5,500 rows
+takes a while, even though a run rarely looks at more than a few hundred
+servers. The server list is compiled once into a binary file:
+
+  header
+  string table   (offsets, then UTF-8 data. String 0 is None)
+  records        (one fixed-size row of string ids per server)
+  index keys     (key string id, start and length of its posting list)
+  posting lists  (record numbers)
+
+The index has keys for each tag (tag:preferred, tag:country_us, tag:ipv6),
+ASN (asn:15169), hostname domain (domain:google.com) and geo_index grid cell
+(cell:64:147), so that only the servers that can pass the tag filter, or are
+close enough to be nearby, have to be built. The file is rebuilt
+whenever the CSV changes. It is a local cache, so numbers are stored in
+native byte order.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import array
+import csv
+import hashlib
+import mmap
+import os
+import os.path
+import re
+import struct
+import tempfile
+
+from . import addr_util
+from . import geo_index
+from . import nameserver
+
+MAGIC = b'NBSRVDB\0'
+# Bump this whenever the file layout or the contents of a record change.
+DB_VERSION = 3
+HEADER_FORMAT = '=8sIQqIIIQQQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INDEX_ENTRY_FORMAT = '=3I'
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+
+CSV_FIELDS = ['ip', 'tags', 'provider', 'instance', 'hostname', 'location',
+              'coords', 'asn', 'list_note', 'urls']
+# NameServer() arguments kept for each server, in record order.
+RECORD_FIELDS = ('ip', 'name', 'tags', 'provider', 'instance', 'location', 'latitude',
+                 'longitude', 'asn', 'hostname', 'network_owner')
+RECORD_FORMAT = '=%sI' % len(RECORD_FIELDS)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Tags that are not in the server list, but are added once we know where the
+# client is. They map to index keys that cover every server that could get
+# the tag (see ServerDatabase.Select).
+DYNAMIC_TAGS = ('nearby', 'network', 'isp', 'likely-isp')
+# Tags that only servers from elsewhere (system settings, command-line) have.
+EXTERNAL_TAGS = ('dhcp', 'system', 'specified')
+
+
+def ParseServerRows(fp):
+  """Yield the NameServer() keyword arguments for each row of a servers.csv file."""
+  for row in csv.DictReader(fp, fieldnames=CSV_FIELDS):
+    if row['instance']:
+      name = "%s (%s)" % (row['provider'], row['instance'])
+    else:
+      name = row['provider']
+
+    if row['coords']:
+      lat, lon = row['coords'].split(',')
+    else:
+      lat = lon = None
+
+    as_match = re.match(r'AS(\d+)(.*)', row['asn'])
+    if as_match:
+      asn, network_owner = as_match.groups()
+      network_owner = network_owner.lstrip(' ').rstrip(' ')
+    else:
+      asn = network_owner = None
+
+    yield {
+        'ip': row['ip'],
+        'name': name,
+        'tags': row['tags'].split(),
+        'provider': row['provider'],
+        'instance': row['instance'],
+        'location': row['location'],
+        'latitude': lat,
+        'longitude': lon,
+        'asn': asn,
+        'hostname': row['hostname'],
+        'network_owner': network_owner,
+    }
+
+
+def _IndexKeys(server, domains):
+  """The index keys a server (NameServer() keyword arguments) is listed under.
+
+  Args:
+    server: NameServer() keyword arguments
+    domains: hostname -> domain, from addr_util.GetDomainsFromHostnames()
+  """
+  tags = set(server['tags'])
+  if server['location']:
+    tags.add('country_%s' % server['location'].split('/')[0].lower())
+  if ':' in server['ip']:
+    tags.add('ipv6')
+  elif '.' in server['ip']:
+    tags.add('ipv4')
+  keys = ['tag:%s' % x for x in tags]
+  if server['asn']:
+    keys.append('asn:%s' % server['asn'])
+  if server['hostname']:
+    keys.append('domain:%s' % domains[server['hostname']])
+  else:
+    keys.append('domain:')
+  try:
+    keys.append('cell:%s:%s' % geo_index.CellKey(float(server['latitude']), float(server['longitude'])))
+  except (TypeError, ValueError):
+    pass
+  return keys
+
+
+def DefaultDbPath(csv_path):
+  """Where the compiled copy of a server list lives (a per-user cache)."""
+  digest = hashlib.md5(os.path.abspath(csv_path).encode('utf-8')).hexdigest()[:12]
+  return os.path.join(tempfile.gettempdir(), 'namebench_servers_%s.db' % digest)
+
+
+def Compile(csv_path, db_path):
+  """Compile a servers.csv file into a server database.
+
+  Args:
+    csv_path: server list to read
+    db_path: where to write the database (atomically replaced)
+  """
+  stat = os.stat(csv_path)
+  strings = [None]
+  string_ids = {None: 0}
+
+  def StringId(string):
+    if string not in string_ids:
+      string_ids[string] = len(strings)
+      strings.append(string)
+    return string_ids[string]
+
+  records = []
+  postings = {}
+  with open(csv_path, newline='') as fp:
+    servers = list(ParseServerRows(fp))
+  domains = addr_util.GetDomainsFromHostnames([x['hostname'] for x in servers if x['hostname']])
+  for (row, server) in enumerate(servers):
+    values = dict(server, tags=' '.join(server['tags']))
+    records.append(struct.pack(RECORD_FORMAT, *[StringId(values[x]) for x in RECORD_FIELDS]))
+    for key in _IndexKeys(server, domains):
+      postings.setdefault(key, array.array('I')).append(row)
+
+  index = []
+  posting_data = array.array('I')
+  for key in sorted(postings):
+    index.append(struct.pack(INDEX_ENTRY_FORMAT, StringId(key), len(posting_data), len(postings[key])))
+    posting_data.extend(postings[key])
+
+  string_offsets = array.array('I', [0])
+  string_data = bytearray()
+  for string in strings[1:]:
+    string_data.extend(string.encode('utf-8'))
+    string_offsets.append(len(string_data))
+  # String 0 (None) is empty: repeat the first offset for it.
+  string_offsets.insert(0, 0)
+
+  strings_offset = HEADER_SIZE
+  records_offset = strings_offset + len(string_offsets) * string_offsets.itemsize + len(string_data)
+  index_offset = records_offset + len(records) * RECORD_SIZE
+  postings_offset = index_offset + len(index) * INDEX_ENTRY_SIZE
+  header = struct.pack(HEADER_FORMAT, MAGIC, DB_VERSION, stat.st_size, stat.st_mtime_ns,
+                       len(records), len(strings), len(index), strings_offset, records_offset,
+                       index_offset, postings_offset)
+
+  tmp_path = '%s.%s.tmp' % (db_path, os.getpid())
+  with open(tmp_path, 'wb') as fp:
+    fp.write(header)
+    fp.write(string_offsets.tobytes())
+    fp.write(string_data)
+    fp.write(b''.join(records))
+    fp.write(b''.join(index))
+    fp.write(posting_data.tobytes())
+  os.replace(tmp_path, db_path)
+
+
+def _ReadHeader(db_path):
+  with open(db_path, 'rb') as fp:
+    data = fp.read(HEADER_SIZE)
+  if len(data) < HEADER_SIZE:
+    return None
+  header = struct.unpack(HEADER_FORMAT, data)
+  if header[0] != MAGIC or header[1] != DB_VERSION:
+    return None
+  return header
+
+
+def IsCurrent(csv_path, db_path):
+  """Whether db_path was compiled from the current version of csv_path."""
+  try:
+    header = _ReadHeader(db_path)
+    stat = os.stat(csv_path)
+  except (IOError, OSError, struct.error):
+    return False
+  return bool(header) and header[2] == stat.st_size and header[3] == stat.st_mtime_ns
+
+
+def Open(csv_path, db_path=None):
+  """Open the server database for a servers.csv file, compiling it if it is stale.
+
+  Returns:
+    ServerDatabase, or None if it could neither be read nor written.
+  """
+  if not db_path:
+    db_path = DefaultDbPath(csv_path)
+  try:
+    if not IsCurrent(csv_path, db_path):
+      Compile(csv_path, db_path)
+    return ServerDatabase(db_path)
+  except (IOError, OSError, ValueError, struct.error):
+    return None
+
+
+class ServerDatabase(object):
+  """Read-only access to a compiled server list."""
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as fp:
+      self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    header = struct.unpack_from(HEADER_FORMAT, self._map)
+    if header[0] != MAGIC or header[1] != DB_VERSION:
+      raise ValueError('%s is not a server database (version %s)' % (path, DB_VERSION))
+    (self.record_count, self._string_count, key_count, self._strings_offset,
+     self._records_offset, index_offset, self._postings_offset) = header[4:]
+    self._string_data_offset = self._strings_offset + (self._string_count + 1) * 4
+    # index key -> (start, length) in the posting lists
+    self._index = {}
+    for (key_id, start, length) in struct.iter_unpack(
+        INDEX_ENTRY_FORMAT, self._map[index_offset:index_offset + key_count * INDEX_ENTRY_SIZE]):
+      self._index[self._String(key_id)] = (start, length)
+
+  def __len__(self):
+    return self.record_count
+
+  def Close(self):
+    self._map.close()
+
+  def _String(self, string_id):
+    if not string_id:
+      return None
+    (start, end) = struct.unpack_from('=2I', self._map, self._strings_offset + string_id * 4)
+    return self._map[self._string_data_offset + start:self._string_data_offset + end].decode('utf-8')
+
+  def Keys(self):
+    return self._index.keys()
+
+  def Postings(self, key):
+    """The record numbers listed under an index key (set)."""
+    (start, length) = self._index.get(key, (0, 0))
+    offset = self._postings_offset + start * 4
+    return set(array.array('I', self._map[offset:offset + length * 4]))
+
+  def Record(self, row):
+    """The NameServer() keyword arguments for a record (dict)."""
+    offset = self._records_offset + row * RECORD_SIZE
+    values = dict(zip(RECORD_FIELDS, [self._String(x) for x in struct.unpack_from(RECORD_FORMAT, self._map, offset)]))
+    values['tags'] = values['tags'].split()
+    return values
+
+  def Server(self, row):
+    return nameserver.NameServer(**self.Record(row))
+
+  def _NearbyPostings(self, latitude, longitude, max_distance):
+    """Records in the grid cells within max_distance (km) of a coordinate pair (set)."""
+    rows = set()
+    for cell in geo_index.CellsWithin(float(latitude), float(longitude), float(max_distance)):
+      rows |= self.Postings('cell:%s:%s' % cell)
+    return rows
+
+  def _TagPostings(self, tag, country_code=None, asn=None, domain=None, latitude=None,
+                   longitude=None, max_distance=None):
+    """Records that have, or could get, a tag (set). None means all of them."""
+    if tag == 'nearby':
+      rows = self.Postings('tag:regional')
+      if latitude and max_distance:
+        rows &= self._NearbyPostings(latitude, longitude, max_distance)
+      return rows
+    elif tag == 'network':
+      return asn and self.Postings('asn:%s' % asn) or set()
+    elif tag == 'isp':
+      # Servers in our network or domain, and those whose domain is unknown.
+      rows = self.Postings('domain:')
+      if asn:
+        rows |= self.Postings('asn:%s' % asn)
+      if domain:
+        rows |= self.Postings('domain:%s' % domain)
+      return rows
+    elif tag == 'likely-isp':
+      return country_code and self.Postings('tag:country_%s' % country_code.lower()) or set()
+    elif tag in EXTERNAL_TAGS:
+      return set()
+    return self.Postings('tag:%s' % tag)
+
+  def Select(self, include_tags=None, require_tags=None, country_code=None, asn=None, domain=None,
+             latitude=None, longitude=None, max_distance=None):
+    """Find the records that could pass NameServers.FilterByTag().
+
+    The result may include servers that will be filtered out later (it is
+    not known which servers will be nearby, for instance), but never leaves
+    out one that would pass.
+
+    Args:
+      include_tags: a server needs one of these tags
+      require_tags: a server needs all of these tags
+      country_code: the client's country (for likely-isp)
+      asn: the client's ASN (for network and isp)
+      domain: the client's domain (for isp)
+      latitude, longitude: where the client is (for nearby)
+      max_distance: the furthest a nearby server may be (km)
+
+    Returns:
+      sorted list of record numbers
+    """
+    if include_tags:
+      rows = set()
+      for tag in include_tags:
+        rows |= self._TagPostings(tag, country_code=country_code, asn=asn, domain=domain,
+                                  latitude=latitude, longitude=longitude, max_distance=max_distance)
+    else:
+      rows = set(range(self.record_count))
+    for tag in require_tags or []:
+      if tag not in DYNAMIC_TAGS:
+        rows &= self._TagPostings(tag)
+    return sorted(rows)
+
+
+if __name__ == '__main__':
+  # python -m libnamebench.server_db [servers.csv] [output path]
+  import sys
+  from . import util
+  csv_path = util.FindDataFile(len(sys.argv) > 1 and sys.argv[1] or 'config/servers.csv')
+  db_path = len(sys.argv) > 2 and sys.argv[2] or DefaultDbPath(csv_path)
+  Compile(csv_path, db_path)
+  print('%s: %s servers' % (db_path, len(ServerDatabase(db_path))))
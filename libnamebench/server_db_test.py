@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the server_db module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import server_db
+
+SERVERS = """"192.0.2.1","preferred global","Example DNS",,"ns1.example.com","US","38.0,-97.0","AS64500 Example Networks","",1,""
+"192.0.2.2","regional","Example ISP","West","dns.isp.example.net","DE/Berlin","52.5,13.4","AS64501","",1,""
+"2001:db8::1","preferred","Example DNS","v6","","US","","","",1,""
+"""
+
+
+class ServerDatabaseTest(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.csv_path = os.path.join(self.tempdir, 'servers.csv')
+    self.db_path = os.path.join(self.tempdir, 'servers.db')
+    with open(self.csv_path, 'w') as fp:
+      fp.write(SERVERS)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testRecordsMatchCsv(self):
+    db = server_db.Open(self.csv_path, db_path=self.db_path)
+    with open(self.csv_path) as fp:
+      expected = list(server_db.ParseServerRows(fp))
+    self.assertEqual([db.Record(x) for x in range(len(db))], expected)
+    ns = db.Server(1)
+    self.assertEqual((ns.name, ns.asn, ns.network_owner, ns.hostname), ('Example ISP (West)', '64501', '', 'dns.isp.example.net'))
+    db.Close()
+
+  def testSelect(self):
+    db = server_db.Open(self.csv_path, db_path=self.db_path)
+    self.assertEqual(db.Select(['preferred']), [0, 2])
+    self.assertEqual(db.Select(['preferred'], ['ipv6']), [2])
+    self.assertEqual(db.Select(['country_de']), [1])
+    self.assertEqual(db.Select(['nearby']), [1])
+    self.assertEqual(db.Select(['nearby'], latitude=52.4, longitude=13.1, max_distance=100), [1])
+    self.assertEqual(db.Select(['nearby'], latitude=38.0, longitude=-97.0, max_distance=1250), [])
+    self.assertEqual(db.Select(['network'], asn='64500'), [0])
+    self.assertEqual(db.Select(['isp'], domain='example.net'), [1, 2])
+    self.assertEqual(db.Select(['specified']), [])
+    self.assertEqual(db.Select(), [0, 1, 2])
+    db.Close()
+
+  def testRebuildsWhenStale(self):
+    server_db.Open(self.csv_path, db_path=self.db_path).Close()
+    self.assertTrue(server_db.IsCurrent(self.csv_path, self.db_path))
+    with open(self.csv_path, 'a') as fp:
+      fp.write('"192.0.2.3","global","Other DNS",,"","FR","","","",1,""\n')
+    self.assertFalse(server_db.IsCurrent(self.csv_path, self.db_path))
+    db = server_db.Open(self.csv_path, db_path=self.db_path)
+    self.assertEqual(len(db), 4)
+    self.assertEqual(db.Select(['global']), [0, 3])
+    db.Close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,493 @@
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared UDP transport for all DNS queries.
+
+dns.query.udp() opens, binds and closes a socket for every packet. Instead, we
+multiplex every outstanding query over a small pool of long-lived sockets per
+address family, and a single reader thread (epoll on Linux, via selectors)
+routes each reply back to its waiter by (server address, query id, question).
+
+A query can be retransmitted while it waits (see RetransmitWaits): the copies
+are identical, so a reply to any of them completes it, and the duration is
+measured from the first send.
+
+With kernel timestamps enabled, the transport also does the timing itself: the
+send is stamped just before sendto(), and the reply with the time the kernel
+received it (SO_TIMESTAMPNS), so that thread scheduling and GIL contention in
+the caller do not end up in the measured duration.
+"""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import errno
+import os
+import platform
+import random
+import select
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+
+# external dependencies (from nb_third_party)
+import dns.exception
+import dns.query
+
+from . import dns_wire
+
+DEFAULT_SOCKETS_PER_FAMILY = 4
+MAX_PACKET_SIZE = 65535
+
+# A send that finds no buffer space is retried for up to MAX_SEND_WAIT seconds
+# (every SEND_RETRY_INTERVAL seconds, if we can not wait for the socket).
+MAX_SEND_WAIT = 1.0
+SEND_RETRY_INTERVAL = 0.01
+SEND_RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+
+# The socket module may not export SO_TIMESTAMPNS. Linux uses 35 on
+# architectures with the generic socket option numbers; elsewhere, kernel
+# timestamps are not supported.
+LINUX_SO_TIMESTAMPNS = 35
+GENERIC_SOCKOPT_MACHINES = ('x86_64', 'amd64', 'i386', 'i486', 'i586', 'i686', 'aarch64',
+                            'arm', 'ppc', 'powerpc', 's390', 'riscv')
+TIMESPEC_FORMAT = '@ll'
+
+# How far a kernel timestamp may be off the monotonic clock before we distrust
+# it (the realtime clock can be stepped by NTP in the middle of a query).
+MAX_CLOCK_SKEW_NS = 1000000
+
+_transport = None
+_transport_lock = threading.Lock()
+_kernel_timestamps = False
+
+
+def GetTransport():
+  """Return the process-wide transport, creating it if necessary.
+
+  A transport inherited across fork() is useless (its reader thread did not
+  survive), so child processes get a fresh one.
+  """
+  global _transport
+  with _transport_lock:
+    if not _transport or _transport.pid != os.getpid():
+      _transport = UdpTransport(kernel_timestamps=_kernel_timestamps)
+    return _transport
+
+
+def UseKernelTimestamps(enabled=True):
+  """Have the transport measure query durations itself (see module docstring).
+
+  Args:
+    enabled: boolean
+  """
+  global _kernel_timestamps
+  _kernel_timestamps = bool(enabled)
+  GetTransport().SetKernelTimestamps(_kernel_timestamps)
+
+
+def KernelTimestampsEnabled():
+  return _kernel_timestamps
+
+
+def RetransmitWaits(timeout, retransmit_timeout=None):
+  """Split a timeout into one wait per send of a query.
+
+  The first wait is retransmit_timeout, and each after it is twice as long as
+  the one before (exponential backoff), until the last one ends at timeout.
+
+  Args:
+    timeout: how long to wait for a reply in all (seconds)
+    retransmit_timeout: how long to wait before the first retransmission
+      (seconds). None sends the query once.
+
+  Returns:
+    list of waits (seconds)
+  """
+  waits = []
+  remaining = timeout
+  wait = retransmit_timeout
+  while wait and wait < remaining:
+    waits.append(wait)
+    remaining -= wait
+    wait *= 2
+  waits.append(remaining)
+  return waits
+
+
+def _SoTimestampNs():
+  """The SO_TIMESTAMPNS socket option for this platform (None if unknown)."""
+  option = getattr(socket, 'SO_TIMESTAMPNS', None)
+  if option is None and sys.platform.startswith('linux'):
+    if platform.machine().lower().startswith(GENERIC_SOCKOPT_MACHINES):
+      option = LINUX_SO_TIMESTAMPNS
+  return option
+
+
+SO_TIMESTAMPNS = _SoTimestampNs()
+# The control message type matches the option that asks for it.
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+
+
+def KernelTimestampsSupported():
+  return SO_TIMESTAMPNS is not None and hasattr(socket.socket, 'recvmsg')
+
+
+class PendingQuery(object):
+  """A query that has been sent, and is waiting for its reply."""
+
+  def __init__(self, key, question, callback=None):
+    self.key = key
+    self.question = question
+    self.callback = callback
+    self.event = threading.Event()
+    self.reply = None
+    # What was sent, and where, for Resend().
+    self.wire = None
+    self.sock = None
+    self.address = None
+    self.send_count = 0
+    # Set by the transport when it is timing queries itself.
+    self.sent_ns = None
+    self.sent_wall_ns = None
+    self.duration_ns = None
+
+  def Deliver(self, reply, duration_ns=None):
+    self.reply = reply
+    self.duration_ns = duration_ns
+    self.event.set()
+    if self.callback:
+      self.callback(self)
+
+
+class UdpTransport(object):
+  """Multiplex many outstanding queries over a few long-lived UDP sockets."""
+
+  def __init__(self, sockets_per_family=DEFAULT_SOCKETS_PER_FAMILY, kernel_timestamps=False):
+    self.sockets_per_family = sockets_per_family
+    self.kernel_timestamps = kernel_timestamps
+    self.pid = os.getpid()
+    self._lock = threading.Lock()
+    self._selector = selectors.DefaultSelector()
+    self._sockets = {}
+    self._next_socket = {}
+    # (packed ip, port, query id) -> list of PendingQuery
+    self._pending = {}
+    self._reader = None
+    self._closed = False
+
+  def _GetSocket(self, family):
+    """Round-robin through the socket pool for an address family."""
+    if family not in self._sockets:
+      pool = []
+      for _ in range(self.sockets_per_family):
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        if self.kernel_timestamps:
+          self._EnableSocketTimestamps(sock)
+        self._selector.register(sock, selectors.EVENT_READ)
+        pool.append(sock)
+      self._sockets[family] = pool
+      self._next_socket[family] = 0
+    pool = self._sockets[family]
+    self._next_socket[family] = (self._next_socket[family] + 1) % len(pool)
+    return pool[self._next_socket[family]]
+
+  def SetKernelTimestamps(self, enabled):
+    """Turn transport-side timing on or off, including for existing sockets."""
+    with self._lock:
+      self.kernel_timestamps = enabled
+      if enabled:
+        for pool in self._sockets.values():
+          for sock in pool:
+            self._EnableSocketTimestamps(sock)
+
+  def _EnableSocketTimestamps(self, sock):
+    """Ask the kernel to stamp received packets, where it knows how to."""
+    if not KernelTimestampsSupported():
+      return
+    try:
+      sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except socket.error:
+      pass
+
+  def _StartReader(self):
+    if not self._reader:
+      self._reader = threading.Thread(target=self._ReadLoop, name='UdpTransport')
+      self._reader.daemon = True
+      self._reader.start()
+
+  def Send(self, wire, ip, port=53, callback=None):
+    """Send a wire-format request, registering it for its reply.
+
+    If the socket buffer is full, this blocks for up to MAX_SEND_WAIT seconds
+    (see _SendPending). Event loops should use Register() and TrySend().
+
+    Args:
+      wire: DNS request in wire format (bytes)
+      ip: server address (string)
+      port: server port (int)
+      callback: optional function, called with the PendingQuery from the reader
+        thread once the reply arrives.
+
+    Returns:
+      PendingQuery object. Its event is set once the reply arrives.
+
+    Raises:
+      socket.error: if the request cannot be sent (no IPv6, for instance)
+    """
+    pending = self.Register(wire, ip, port=port, callback=callback)
+    try:
+      self._SendPending(pending)
+    except:
+      self.Cancel(pending)
+      raise
+    return pending
+
+  def Register(self, wire, ip, port=53, callback=None):
+    """Register a wire-format request for its reply, without sending it.
+
+    Arguments are as for Send(). The request must then be sent with
+    TrySend(), or given up on with Cancel().
+
+    Returns:
+      PendingQuery object. Its event is set once the reply arrives.
+
+    Raises:
+      socket.error: if there is no socket for the address (no IPv6, for instance)
+    """
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    packed_ip = socket.inet_pton(family, ip)
+    question = dns_wire.QuestionFromWire(wire)
+    with self._lock:
+      sock = self._GetSocket(family)
+      query_id = struct.unpack('!H', wire[0:2])[0]
+      key = (packed_ip, port, query_id)
+      # Keep (server, id, question) unique amongst outstanding queries.
+      while [x for x in self._pending.get(key, []) if x.question == question]:
+        query_id = random.randint(0, 65535)
+        key = (packed_ip, port, query_id)
+      if query_id != struct.unpack('!H', wire[0:2])[0]:
+        wire = struct.pack('!H', query_id) + wire[2:]
+      pending = PendingQuery(key, question, callback=callback)
+      pending.wire = wire
+      pending.sock = sock
+      pending.address = (ip, port)
+      self._pending.setdefault(key, []).append(pending)
+      self._StartReader()
+    return pending
+
+  def Resend(self, pending):
+    """Send an unanswered query again, with the same id and from the same socket.
+
+    Raises:
+      socket.error: if it cannot be sent
+    """
+    self._SendPending(pending)
+
+  def _SendPending(self, pending):
+    """sendto() a query, waiting for room if the socket buffer is full.
+
+    The sockets are non-blocking, so a burst of queries can fill the send
+    buffer (EAGAIN), or the interface queue (ENOBUFS). That says nothing
+    about the server, so the send is retried rather than counted as a failure.
+
+    Raises:
+      socket.error: if it cannot be sent, or there is still no room after
+        MAX_SEND_WAIT seconds.
+    """
+    deadline = time.monotonic() + MAX_SEND_WAIT
+    while True:
+      error = self.TrySend(pending)
+      if not error:
+        return
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        raise socket.error(error, os.strerror(error))
+      if error == errno.ENOBUFS:
+        # The socket stays writable: it is the interface queue that is full.
+        time.sleep(min(remaining, SEND_RETRY_INTERVAL))
+      else:
+        select.select([], [pending.sock], [], remaining)
+
+  def TrySend(self, pending):
+    """sendto() a query once, without waiting for buffer space.
+
+    Returns:
+      None if it was sent, or the errno (one of SEND_RETRY_ERRNOS) if the
+      buffer was full, and it should be tried again later.
+
+    Raises:
+      socket.error: if it cannot be sent for any other reason.
+    """
+    if self.kernel_timestamps and not pending.send_count:
+      pending.sent_wall_ns = time.time_ns()
+      pending.sent_ns = time.monotonic_ns()
+    try:
+      pending.sock.sendto(pending.wire, pending.address)
+    except socket.error as exc:
+      if exc.errno in SEND_RETRY_ERRNOS:
+        return exc.errno
+      raise
+    pending.send_count += 1
+    return None
+
+  def Cancel(self, pending):
+    """Stop waiting for a reply (used on timeout)."""
+    with self._lock:
+      waiters = self._pending.get(pending.key)
+      if waiters and pending in waiters:
+        waiters.remove(pending)
+        if not waiters:
+          del self._pending[pending.key]
+
+  def Query(self, request, ip, timeout, port=53, retransmit_timeout=None):
+    """Blocking request/reply, a stand-in for dns.query.udp().
+
+    Args:
+      request: dns_wire.WireRequest (or dns.message.Message)
+      ip: server address (string)
+      timeout: seconds to wait for a reply (float)
+      port: server port (int)
+      retransmit_timeout: seconds to wait before sending the request again
+        (see RetransmitWaits). None sends it once.
+
+    Returns:
+      dns_wire.WireResponse. Its duration_ns is set if the transport timed it.
+
+    Raises:
+      dns.exception.Timeout: if no reply arrives in time.
+      dns.query.BadResponse: if the reply does not answer the request.
+    """
+    pending = self.Send(request.to_wire(), ip, port=port)
+    for (attempt, wait) in enumerate(RetransmitWaits(timeout, retransmit_timeout)):
+      if attempt:
+        try:
+          self.Resend(pending)
+        except socket.error:
+          pass
+      if pending.event.wait(wait):
+        break
+    else:
+      self.Cancel(pending)
+      raise dns.exception.Timeout()
+    response = dns_wire.WireResponse(pending.reply, duration_ns=pending.duration_ns,
+                                     send_count=pending.send_count)
+    # The id may have been changed by Send() to avoid a collision.
+    request.id = response.id
+    if not request.is_response(response):
+      raise dns.query.BadResponse()
+    return response
+
+  def Close(self):
+    """Stop listening for replies, and close the sockets.
+
+    Only needed for a transport other than the process-wide one.
+    """
+    self._closed = True
+    if not self._reader:
+      self._CloseSockets()
+
+  def _CloseSockets(self):
+    with self._lock:
+      for pool in self._sockets.values():
+        for sock in pool:
+          self._selector.unregister(sock)
+          sock.close()
+      self._sockets = {}
+      self._selector.close()
+
+  def _ReadLoop(self):
+    while not self._closed:
+      for (key, unused_events) in self._selector.select(timeout=1):
+        self._DrainSocket(key.fileobj)
+    self._CloseSockets()
+
+  def _DrainSocket(self, sock):
+    kernel_ns = None
+    received_ns = None
+    while True:
+      try:
+        if self.kernel_timestamps and KernelTimestampsSupported():
+          (wire, ancdata, unused_flags, address) = sock.recvmsg(MAX_PACKET_SIZE,
+                                                                 socket.CMSG_SPACE(struct.calcsize(TIMESPEC_FORMAT)))
+          received_ns = time.monotonic_ns()
+          kernel_ns = _KernelTimestampFromAncillaryData(ancdata)
+        else:
+          (wire, address) = sock.recvfrom(MAX_PACKET_SIZE)
+          if self.kernel_timestamps:
+            received_ns = time.monotonic_ns()
+      except (BlockingIOError, InterruptedError):
+        return
+      except socket.error as exc:
+        # ICMP errors (port unreachable, etc.) show up here on some systems.
+        if exc.errno in (errno.ECONNREFUSED, errno.ECONNRESET, errno.EHOSTUNREACH,
+                         errno.ENETUNREACH):
+          continue
+        return
+      self._Route(sock.family, wire, address, kernel_ns=kernel_ns, received_ns=received_ns)
+
+  def _Route(self, family, wire, address, kernel_ns=None, received_ns=None):
+    """Hand a reply to the query that it answers, dropping strays."""
+    question = dns_wire.QuestionFromWire(wire)
+    if question is None:
+      return
+    try:
+      packed_ip = socket.inet_pton(family, address[0].split('%')[0])
+    except (OSError, ValueError):
+      return
+    key = (packed_ip, address[1], struct.unpack('!H', wire[0:2])[0])
+    with self._lock:
+      waiters = self._pending.get(key)
+      if not waiters:
+        return
+      matches = [x for x in waiters if x.question == question]
+      # Some servers leave the question out of error replies.
+      if not matches and not question and len(waiters) == 1:
+        matches = waiters
+      if not matches:
+        return
+      pending = matches[0]
+      waiters.remove(pending)
+      if not waiters:
+        del self._pending[key]
+    pending.Deliver(wire, duration_ns=_DurationNs(pending, kernel_ns, received_ns))
+
+
+def _KernelTimestampFromAncillaryData(ancdata):
+  """Return the SCM_TIMESTAMPNS receive time (realtime ns) from recvmsg()."""
+  for (level, cmsg_type, data) in ancdata:
+    if level == socket.SOL_SOCKET and cmsg_type == SCM_TIMESTAMPNS:
+      (seconds, nanoseconds) = struct.unpack(TIMESPEC_FORMAT, data[:struct.calcsize(TIMESPEC_FORMAT)])
+      return seconds * 1000000000 + nanoseconds
+  return None
+
+
+def _DurationNs(pending, kernel_ns, received_ns):
+  """How long a query took, in integer nanoseconds (None if not timed here).
+
+  The kernel stamps packets with the realtime clock, so its timestamp is
+  compared against the realtime send stamp, and only trusted if it agrees with
+  the monotonic clock (it can never be later than when we read the packet).
+  """
+  if pending.sent_ns is None or received_ns is None:
+    return None
+  monotonic_duration = received_ns - pending.sent_ns
+  if kernel_ns is not None:
+    kernel_duration = kernel_ns - pending.sent_wall_ns
+    if 0 <= kernel_duration <= monotonic_duration + MAX_CLOCK_SKEW_NS:
+      return min(kernel_duration, monotonic_duration)
+  return monotonic_duration
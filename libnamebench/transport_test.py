@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the transport module."""
+
+__author__ = 'tstromberg@google.com (Thomas Stromberg)'
+
+import errno
+import socket
+import struct
+import time
+import unittest
+
+from . import dns_wire
+from . import mocks
+from . import transport
+
+
+class RetransmitTest(unittest.TestCase):
+  def testRetransmitWaits(self):
+    self.assertEqual(transport.RetransmitWaits(3.5), [3.5])
+    self.assertEqual(transport.RetransmitWaits(3.5, 0.5), [0.5, 1.0, 2.0])
+    self.assertEqual(transport.RetransmitWaits(2.0, 0.5), [0.5, 1.0, 0.5])
+    self.assertEqual(transport.RetransmitWaits(0.4, 0.5), [0.4])
+
+  def testLostQueryIsResent(self):
+    try:
+      server = mocks.LoopbackDnsServer(drop_count=1)
+    except OSError:
+      self.skipTest('No loopback networking')
+    udp = transport.UdpTransport()
+    request = dns_wire.GetQueryTemplate('www.example.com.', 'A').NewRequest()
+    response = udp.Query(request, server.ip, 2, port=server.port, retransmit_timeout=0.2)
+    udp.Close()
+    server.Close()
+    self.assertEqual(response.send_count, 2)
+    self.assertEqual(server.received, 2)
+
+
+def _Query(hostname='www.example.com.'):
+  return dns_wire.GetQueryTemplate(hostname, 'A').NewRequest().to_wire()
+
+
+def _Reply(wire, query_id=None):
+  """The wire-format reply to a query: the same bytes, with the QR bit set."""
+  reply = bytearray(wire)
+  reply[2] |= 0x80
+  if query_id is not None:
+    reply[0:2] = struct.pack('!H', query_id)
+  return bytes(reply)
+
+
+def _QueryId(wire):
+  return struct.unpack('!H', wire[0:2])[0]
+
+
+class UdpTransportTest(unittest.TestCase):
+  # Nothing listens here: replies are handed to the transport with _Route().
+  PORT = 9
+
+  def setUp(self):
+    self.udp = transport.UdpTransport()
+
+  def tearDown(self):
+    self.udp.Close()
+
+  def _Deliver(self, wire, ip='127.0.0.1', port=PORT):
+    self.udp._Route(socket.AF_INET, wire, (ip, port))
+
+  def testQueryLoopback(self):
+    try:
+      server = mocks.LoopbackDnsServer()
+    except OSError:
+      self.skipTest('No loopback networking')
+    try:
+      request = dns_wire.GetQueryTemplate('www.example.com.', 'A').NewRequest()
+      response = self.udp.Query(request, server.ip, 2, port=server.port)
+    finally:
+      server.Close()
+    self.assertEqual(response.id, request.id)
+    self.assertEqual(response.answer[0][0].address, mocks.LOOPBACK_ANSWER)
+    self.assertEqual(self.udp._pending, {})
+
+  def testRoutesOnServerIdAndQuestion(self):
+    wire = _Query()
+    first = self.udp.Send(wire, '127.0.0.1', port=self.PORT)
+    # Same id and server, different question.
+    other_wire = struct.pack('!H', _QueryId(first.wire)) + _Query('www.example.net.')[2:]
+    second = self.udp.Send(other_wire, '127.0.0.1', port=self.PORT)
+    self.assertEqual(first.key, second.key)
+
+    self._Deliver(_Reply(other_wire))
+    self.assertFalse(first.event.is_set())
+    self.assertTrue(second.event.is_set())
+    self._Deliver(_Reply(first.wire))
+    self.assertEqual(first.reply, _Reply(first.wire))
+    self.assertEqual(self.udp._pending, {})
+
+  def testIdCollision(self):
+    wire = _Query()
+    first = self.udp.Send(wire, '127.0.0.1', port=self.PORT)
+    second = self.udp.Send(wire, '127.0.0.1', port=self.PORT)
+    # The second copy of an outstanding query is sent with a new id.
+    self.assertNotEqual(_QueryId(first.wire), _QueryId(second.wire))
+    self.assertEqual(first.wire[2:], second.wire[2:])
+
+    self._Deliver(_Reply(second.wire))
+    self.assertFalse(first.event.is_set())
+    self.assertTrue(second.event.is_set())
+    self._Deliver(_Reply(first.wire))
+    self.assertTrue(first.event.is_set())
+
+  def testCancel(self):
+    pending = self.udp.Send(_Query(), '127.0.0.1', port=self.PORT)
+    self.udp.Cancel(pending)
+    self.assertEqual(self.udp._pending, {})
+    self._Deliver(_Reply(pending.wire))
+    self.assertFalse(pending.event.is_set())
+    # Cancelling twice is harmless.
+    self.udp.Cancel(pending)
+
+  def testMismatchedReplies(self):
+    pending = self.udp.Send(_Query(), '127.0.0.1', port=self.PORT)
+    reply = _Reply(pending.wire)
+    query_id = _QueryId(pending.wire)
+    # Wrong id, server, port or question.
+    self._Deliver(_Reply(pending.wire, query_id=(query_id + 1) % 65536))
+    self._Deliver(reply, ip='127.0.0.2')
+    self._Deliver(reply, port=self.PORT + 1)
+    self._Deliver(_Reply(struct.pack('!H', query_id) + _Query('www.example.net.')[2:]))
+    # Not DNS at all.
+    self._Deliver(b'\x00')
+    self.assertFalse(pending.event.is_set())
+
+    # Error replies may leave the question out.
+    error_reply = struct.pack('!HHHHHH', query_id, 0x8182, 0, 0, 0, 0)
+    self._Deliver(error_reply)
+    self.assertEqual(pending.reply, error_reply)
+
+
+class FlakySendSocket(object):
+  """A socket whose first sendto() calls fail with the given errors."""
+
+  def __init__(self, errors):
+    self.errors = list(errors)
+    self.sent = []
+    self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+  def fileno(self):
+    return self._sock.fileno()
+
+  def sendto(self, wire, address):
+    if self.errors:
+      error = self.errors.pop(0)
+      raise OSError(error, errno.errorcode[error])
+    self.sent.append((wire, address))
+    return len(wire)
+
+  def close(self):
+    self._sock.close()
+
+
+class SendRetryTest(unittest.TestCase):
+  def _Send(self, errors):
+    udp = transport.UdpTransport()
+    pending = transport.PendingQuery(None, None)
+    pending.wire = _Query()
+    pending.address = ('127.0.0.1', 9)
+    pending.sock = FlakySendSocket(errors)
+    try:
+      udp._SendPending(pending)
+    finally:
+      pending.sock.close()
+      udp.Close()
+    return pending
+
+  def testFullBuffersAreRetried(self):
+    pending = self._Send([errno.EAGAIN, errno.ENOBUFS, errno.EAGAIN])
+    self.assertEqual(pending.send_count, 1)
+    self.assertEqual(pending.sock.sent, [(pending.wire, pending.address)])
+
+  def testOtherErrorsAreRaised(self):
+    self.assertRaises(OSError, self._Send, [errno.EHOSTUNREACH])
+
+  def testGiveUpAfterMaxSendWait(self):
+    saved = transport.MAX_SEND_WAIT
+    transport.MAX_SEND_WAIT = 0.05
+    try:
+      self.assertRaises(OSError, self._Send, [errno.ENOBUFS] * 1000)
+    finally:
+      transport.MAX_SEND_WAIT = saved
+
+
+class FakeSocket(object):
+  """Hands out queued (wire, address) packets, like a non-blocking UDP socket."""
+
+  family = socket.AF_INET
+
+  def __init__(self, packets, kernel_ns=None):
+    self.packets = list(packets)
+    self.kernel_ns = kernel_ns
+
+  def recvmsg(self, unused_size, unused_ancsize):
+    if not self.packets:
+      raise BlockingIOError()
+    (wire, address) = self.packets.pop(0)
+    ancdata = []
+    if self.kernel_ns is not None:
+      timespec = struct.pack(transport.TIMESPEC_FORMAT, self.kernel_ns // 1000000000,
+                             self.kernel_ns % 1000000000)
+      ancdata.append((socket.SOL_SOCKET, transport.SCM_TIMESTAMPNS, timespec))
+    return (wire, ancdata, 0, address)
+
+  def recvfrom(self, unused_size):
+    if not self.packets:
+      raise BlockingIOError()
+    return self.packets.pop(0)
+
+
+class PendingStub(object):
+  def __init__(self, sent_ns, sent_wall_ns):
+    self.sent_ns = sent_ns
+    self.sent_wall_ns = sent_wall_ns
+
+
+class KernelTimestampTest(unittest.TestCase):
+  def testDurationNs(self):
+    pending = PendingStub(1000000000, 5000000000)
+    # Not timed by the transport.
+    self.assertEqual(transport._DurationNs(PendingStub(None, None), None, 1002000000), None)
+    self.assertEqual(transport._DurationNs(pending, None, None), None)
+    # Without a kernel timestamp, the monotonic clock is used.
+    self.assertEqual(transport._DurationNs(pending, None, 1002000000), 2000000)
+    # The kernel saw the reply before we read it.
+    self.assertEqual(transport._DurationNs(pending, 5001500000, 1002000000), 1500000)
+    # Kernel timestamps from before the send, or well after the read, are
+    # from a stepped realtime clock.
+    self.assertEqual(transport._DurationNs(pending, 4999000000, 1002000000), 2000000)
+    self.assertEqual(transport._DurationNs(pending, 5010000000, 1002000000), 2000000)
+    # A little skew is tolerated, but the duration never exceeds the monotonic one.
+    self.assertEqual(transport._DurationNs(pending, 5002500000, 1002000000), 2000000)
+
+  def testKernelTimestampFromAncillaryData(self):
+    timespec = struct.pack(transport.TIMESPEC_FORMAT, 1234, 567)
+    ancdata = [(socket.SOL_SOCKET + 1, transport.SCM_TIMESTAMPNS, b'junk'),
+               (socket.SOL_SOCKET, transport.SCM_TIMESTAMPNS, timespec)]
+    self.assertEqual(transport._KernelTimestampFromAncillaryData(ancdata), 1234000000567)
+    self.assertEqual(transport._KernelTimestampFromAncillaryData([]), None)
+
+  def _SendAndDrain(self, udp, kernel_offset_ns=None):
+    """Send a query to a closed port, then feed its reply through a FakeSocket."""
+    request = dns_wire.GetQueryTemplate('www.example.com.', 'A').NewRequest()
+    pending = udp.Send(request.to_wire(), '127.0.0.1', port=9)
+    reply = bytearray(pending.wire)
+    reply[2] |= 0x80
+    # Pretend the query went out 10ms ago.
+    pending.sent_ns = time.monotonic_ns() - 10000000
+    kernel_ns = None
+    if kernel_offset_ns is not None:
+      kernel_ns = pending.sent_wall_ns + kernel_offset_ns
+    udp._DrainSocket(FakeSocket([(bytes(reply), ('127.0.0.1', 9))], kernel_ns=kernel_ns))
+    self.assertTrue(pending.event.is_set())
+    return pending
+
+  def testDrainSocketUsesKernelTimestamp(self):
+    if not transport.KernelTimestampsSupported():
+      self.skipTest('No kernel timestamps on this platform')
+    udp = transport.UdpTransport(kernel_timestamps=True)
+    try:
+      pending = self._SendAndDrain(udp, kernel_offset_ns=2000000)
+    finally:
+      udp.Close()
+    self.assertEqual(pending.duration_ns, 2000000)
+
+  def testDrainSocketWithoutKernelTimestamps(self):
+    saved = transport.SO_TIMESTAMPNS
+    transport.SO_TIMESTAMPNS = None
+    udp = transport.UdpTransport(kernel_timestamps=True)
+    try:
+      pending = self._SendAndDrain(udp)
+    finally:
+      udp.Close()
+      transport.SO_TIMESTAMPNS = saved
+    self.assertTrue(pending.duration_ns >= 10000000)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -31,6 +31,23 @@ def CalculateListAverage(values):
   return sum(values) / float(len(values))
 
 
+def CalculatePercentile(values, percent):
+  """Computes a percentile of a list of numbers (nearest-rank method).
+
+  Args:
+    values: list of numbers
+    percent: which percentile to return (0-100)
+
+  Returns:
+    The value at that percentile, or None if values is empty.
+  """
+  if not values:
+    return None
+  ordered = sorted(values)
+  rank = int(math.ceil(percent / 100.0 * len(ordered)))
+  return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
 def DrawTextBar(value, max_value, max_width=53):
   """Return a simple ASCII bar graph, making sure it fits within max_width.
 
@@ -51,6 +68,10 @@ def SecondsToMilliseconds(seconds):
   return seconds * 1000
 
 
+def NanosecondsToMilliseconds(nanoseconds):
+  return nanoseconds / 1000000.0
+
+
 def SplitSequence(seq, size):
   """Split a list.
 
@@ -71,6 +92,27 @@ def SplitSequence(seq, size):
   return  [x for x in newseq if x]
 
 
+def CacheDirectory():
+  """The per-user directory for on-disk caches, created if necessary.
+
+  Unlike the shared temporary directory, other local users can not plant or
+  replace files in it. If it can not be created, a private temporary
+  directory is used instead (so nothing is cached between runs).
+  """
+  if sys.platform[:3] == 'win':
+    base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+  elif sys.platform == 'darwin':
+    base = os.path.expanduser('~/Library/Caches')
+  else:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+  path = os.path.join(base, 'namebench')
+  try:
+    os.makedirs(path, mode=0o700, exist_ok=True)
+  except OSError:
+    path = tempfile.mkdtemp(prefix='namebench-')
+  return path
+
+
 def FindDataFile(filename):
   """Find a datafile, searching various relative and OS paths."""
   filename = os.path.expanduser(filename)
@@ -35,6 +35,14 @@ class TestBasicMethods(unittest.TestCase):
     self.assertEqual(util.CalculateListAverage([3, 2, 2]),
                      2.3333333333333335)
 
+  def testCalculatePercentile(self):
+    values = list(range(1, 101))
+    self.assertEqual(util.CalculatePercentile(values, 50), 50)
+    self.assertEqual(util.CalculatePercentile(values, 99), 99)
+    self.assertEqual(util.CalculatePercentile(values, 100), 100)
+    self.assertEqual(util.CalculatePercentile([7, 3], 0), 3)
+    self.assertEqual(util.CalculatePercentile([], 50), None)
+
   def testDrawTextBar(self):
     self.assertEqual(util.DrawTextBar(1, 10, max_width=10), '#')
     self.assertEqual(util.DrawTextBar(5, 10, max_width=10), '#####')